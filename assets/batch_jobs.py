@@ -0,0 +1,354 @@
+"""
+Modalità deferred: backfill non urgenti eseguiti con le batch API (costo ridotto, latenza di ore)
+invece che con chiamate sincrone.
+
+Gli incident avanzano nel grafo in lockstep, una fase alla volta:
+1. ogni run (una per leader di gruppo) prosegue finché un nodo non chiede all'LLM una risposta
+   che non è ancora stata scaricata: la richiesta viene registrata e la run si ferma lì
+   (il checkpoint LangGraph conserva i nodi già completati);
+2. tutte le richieste della fase finiscono in un file JSONL nel formato delle batch API,
+   inviato al backend;
+3. a batch completato le risposte vengono salvate e tutte le run riprendono dal nodo fermo.
+Il job termina quando nessuna run chiede nuove risposte.
+
+Tutto lo stato sta in `job_dir` (stato del job, checkpoint SQLite del grafo, risposte, file di
+richiesta/risposta di ogni fase): interrotto in qualsiasi momento, il job riparte da dove era,
+riprendendo il polling del batch in corso. Le richieste identiche (stesso prompt) sono inviate
+una volta sola; una richiesta fallita viene ritentata nel batch successivo, fino a
+`max_attempts`, poi la run del suo incident è marcata come fallita.
+
+Nel percorso differito i tool sono sempre invocati direttamente (l'agent con tool calling
+richiederebbe un batch per ogni passo), mentre similarità, shadow, streaming e fast-state
+non sono usati: il riuso di analisi tra incident che avanzano insieme non è possibile.
+"""
+import json
+import os
+import time
+import uuid
+from datetime import date
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+from loguru import logger
+
+from assets.coalescing import apply_group_directive, coalesce_incidents
+from assets.custom_obj import BaseLog, Incident
+from assets.deferred_llm import DeferredCall, DeferredRequestFailed, set_active_store
+from assets.graph import IncidentsGraph
+from assets.sharded import decode_nodes_logs, encode_nodes_logs
+from assets.utils import set_environment_variables, upload_json_incidents
+from assets.vocabulary import get_vocabulary
+from assets.worker_executor import apply_outbound_failures, collect_worker_logs
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+CHAT_COMPLETIONS_URL = "/v1/chat/completions"
+
+
+def _append_jsonl(path: Path, rows: List[Dict[str, Any]]) -> None:
+    with path.open("a", encoding="utf-8") as f:
+        for row in rows:
+            f.write(json.dumps(row, ensure_ascii=False, separators=(",", ":")) + "\n")
+
+
+def _read_jsonl(path: Path) -> List[Dict[str, Any]]:
+    if not path.exists():
+        return []
+    with path.open(encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _write_json(path: Path, data: Any) -> None:
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    tmp.write_text(json.dumps(data, indent=2), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+class ResponseStore:
+    """Risposte scaricate dai batch (responses.jsonl, append-only) e richieste della fase in corso."""
+
+    def __init__(self, path: Path, max_attempts: int = 3):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.responses: Dict[str, Dict[str, Any]] = {}
+        self.failures: Dict[str, int] = {}
+        self.pending: Dict[str, Dict[str, Any]] = {}
+        for row in _read_jsonl(path):
+            self._record(row)
+
+    def _record(self, row: Dict[str, Any]) -> None:
+        if "response" in row:
+            self.responses[row["key"]] = row["response"]
+        else:
+            self.failures[row["key"]] = self.failures.get(row["key"], 0) + 1
+
+    def lookup(self, key: str, body: Dict[str, Any]) -> Dict[str, Any]:
+        """La risposta salvata; altrimenti la richiesta viene accodata e la run interrotta."""
+        if key in self.responses:
+            return self.responses[key]
+        if self.failures.get(key, 0) >= self.max_attempts:
+            raise DeferredRequestFailed(f"request {key[:12]} failed in {self.failures[key]} batches")
+        self.pending[key] = body
+        raise DeferredCall(key)
+
+    def ingest(self, results_path: Path, keys: List[str]) -> Tuple[int, int]:
+        """
+        Salva le risposte di un batch (formato output delle batch API). Le richieste senza una
+        risposta valida contano come tentativo fallito e verranno rinviate.
+        :return: (risposte salvate, richieste fallite)
+        """
+        rows = []
+        answered = set()
+        for line in _read_jsonl(results_path):
+            key = line.get("custom_id")
+            response = line.get("response") or {}
+            body = response.get("body") or {}
+            if key in answered or key not in keys:
+                continue
+            if response.get("status_code") == 200 and body.get("choices"):
+                answered.add(key)
+                rows.append({"key": key, "response": {
+                    "content": body["choices"][0]["message"].get("content") or "",
+                    "usage": body.get("usage") or {},
+                    "model": body.get("model"),
+                }})
+            else:
+                error = line.get("error") or body.get("error") or {"status_code": response.get("status_code")}
+                logger.warning(f"Batch request {key[:12]} failed: {error}")
+        failed = [{"key": key, "error": "missing or failed response"} for key in keys if key not in answered]
+        _append_jsonl(self.path, rows + failed)
+        for row in rows + failed:
+            self._record(row)
+        return len(rows), len(failed)
+
+
+class BatchBackend:
+    """Interfaccia dei backend delle batch API."""
+
+    def submit(self, requests_path: Path) -> str:
+        """Invia il file di richieste; restituisce l'id del batch."""
+        raise NotImplementedError
+
+    def status(self, batch_id: str) -> str:
+        """"in_progress", "completed" o "failed" (un batch fallito può avere risposte parziali)."""
+        raise NotImplementedError
+
+    def download(self, batch_id: str, results_path: Path) -> None:
+        """Scrive in `results_path` le risposte disponibili del batch."""
+        raise NotImplementedError
+
+
+class LocalBatchBackend(BatchBackend):
+    """
+    Stand-in locale delle batch API (sviluppo e test): le richieste sono eseguite con chiamate
+    sincrone al download, il batch risulta completato dopo `delay` secondi dall'invio.
+    """
+
+    def __init__(self, work_dir: Path, delay: float = 0.0):
+        self.work_dir = work_dir / "local_batches"
+        self.work_dir.mkdir(parents=True, exist_ok=True)
+        self.delay = delay
+
+    def submit(self, requests_path: Path) -> str:
+        batch_id = f"local_{uuid.uuid4().hex[:12]}"
+        _write_json(self.work_dir / f"{batch_id}.json",
+                    {"requests": str(requests_path), "submitted_at": time.time()})
+        return batch_id
+
+    def status(self, batch_id: str) -> str:
+        meta = json.loads((self.work_dir / f"{batch_id}.json").read_text(encoding="utf-8"))
+        return "completed" if time.time() - meta["submitted_at"] >= self.delay else "in_progress"
+
+    def download(self, batch_id: str, results_path: Path) -> None:
+        from langchain_openai import ChatOpenAI
+
+        meta = json.loads((self.work_dir / f"{batch_id}.json").read_text(encoding="utf-8"))
+        rows = []
+        for request in _read_jsonl(Path(meta["requests"])):
+            body = request["body"]
+            try:
+                llm = ChatOpenAI(model=body["model"], temperature=body["temperature"], max_retries=3)
+                message = llm.invoke([(m["role"], m["content"]) for m in body["messages"]])
+                usage = message.usage_metadata or {}
+                rows.append({"custom_id": request["custom_id"], "response": {"status_code": 200, "body": {
+                    "model": body["model"],
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": message.content}}],
+                    "usage": {"prompt_tokens": usage.get("input_tokens", 0),
+                              "completion_tokens": usage.get("output_tokens", 0),
+                              "total_tokens": usage.get("total_tokens", 0)},
+                }}, "error": None})
+            except Exception as e:
+                rows.append({"custom_id": request["custom_id"], "response": None, "error": {"message": str(e)}})
+        results_path.write_text("", encoding="utf-8")
+        _append_jsonl(results_path, rows)
+
+
+class OpenAIBatchBackend(BatchBackend):
+    """Batch API di OpenAI (finestra di completamento 24h)."""
+
+    def __init__(self):
+        from openai import OpenAI
+
+        self.client = OpenAI()
+
+    def submit(self, requests_path: Path) -> str:
+        with requests_path.open("rb") as f:
+            input_file = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(input_file_id=input_file.id, endpoint=CHAT_COMPLETIONS_URL,
+                                           completion_window="24h")
+        return batch.id
+
+    def status(self, batch_id: str) -> str:
+        status = self.client.batches.retrieve(batch_id).status
+        if status == "completed":
+            return "completed"
+        if status in ("failed", "expired", "cancelled"):
+            return "failed"
+        return "in_progress"
+
+    def download(self, batch_id: str, results_path: Path) -> None:
+        batch = self.client.batches.retrieve(batch_id)
+        contents = [self.client.files.content(file_id).text
+                    for file_id in (batch.output_file_id, batch.error_file_id) if file_id]
+        results_path.write_text("".join(text if text.endswith("\n") else text + "\n" for text in contents if text),
+                                encoding="utf-8")
+
+
+def create_backend(name: str, job_dir: Path, local_delay: float = 0.0) -> BatchBackend:
+    if name == "openai":
+        return OpenAIBatchBackend()
+    return LocalBatchBackend(job_dir, local_delay)
+
+
+def _open_checkpointer(path: Path):
+    """Checkpointer SQLite in `path`: ogni nodo completato è salvato subito e sopravvive al riavvio."""
+    import sqlite3
+    from langgraph.checkpoint.sqlite import SqliteSaver  # dipendenza necessaria solo in modalità deferred
+
+    return SqliteSaver(sqlite3.connect(str(path), check_same_thread=False))
+
+
+def run_batch_job(incidents: List[Incident], job_dir: Path, backend: BatchBackend, llm_call: bool = False,
+                  coalesce_window_minutes: int = 0, local_classifier_threshold: float | None = None,
+                  max_topics: int | None = None, prompt_token_budget: int = 256, poll_interval: float = 30.0,
+                  max_attempts: int = 3) -> List[Dict[str, Dict[str, List[BaseLog]]]]:
+    """
+    Esegue (o riprende) il batch job in `job_dir` fino al completamento di tutte le run.
+    :return: i log nel formato di process_input, per gli incident completati
+    """
+    job_dir.mkdir(parents=True, exist_ok=True)
+    state_path, results_path = job_dir / "state.json", job_dir / "results.jsonl"
+    store = ResponseStore(job_dir / "responses.jsonl", max_attempts)
+    checkpointer = _open_checkpointer(job_dir / "checkpoints.sqlite")
+    graph = IncidentsGraph(llm_call=llm_call, local_classifier_threshold=local_classifier_threshold,
+                           direct_tool_dispatch=True, prompt_token_budget=prompt_token_budget, deferred_llm=True,
+                           checkpointer=checkpointer)
+    vocabulary = get_vocabulary(max_topics)
+    groups = coalesce_incidents(incidents, coalesce_window_minutes)
+
+    if state_path.exists():
+        job = json.loads(state_path.read_text(encoding="utf-8"))
+        logger.info(f"Resuming batch job {job_dir} at stage {job['stage']}")
+    else:
+        job = {"stage": 0, "batch": None, "runs": {}}
+    for group in groups:
+        job["runs"].setdefault(group.leader.id, {"thread_id": str(uuid.uuid4()), "status": "new"})
+    results = {row["id"]: row["logs"] for row in _read_jsonl(results_path)}
+
+    set_active_store(store)
+    try:
+        while True:
+            if job["batch"] is not None:
+                batch = job["batch"]
+                status = backend.status(batch["id"])
+                while status == "in_progress":
+                    logger.info(f"Batch {batch['id']} (stage {batch['stage']}) in progress")
+                    time.sleep(poll_interval)
+                    status = backend.status(batch["id"])
+                batch_results = job_dir / f"stage_{batch['stage']:03d}.results.jsonl"
+                backend.download(batch["id"], batch_results)
+                saved, failed = store.ingest(batch_results, batch["keys"])
+                logger.info(f"Batch {batch['id']} {status}: {saved} responses, {failed} failed requests")
+                job["batch"] = None
+                _write_json(state_path, job)
+
+            store.pending.clear()
+            stage_logs: Dict[str, Dict[str, List[BaseLog]]] = {}
+            finished = []
+            for group in groups:
+                run = job["runs"][group.leader.id]
+                if run["status"] in ("done", "failed"):
+                    continue
+                try:
+                    if run["status"] == "new":
+                        run["status"] = "running"
+                        response = graph.step(run["thread_id"], group.leader, topics=vocabulary.topics())
+                    else:
+                        response = graph.step(run["thread_id"])
+                except DeferredCall:
+                    continue
+                except DeferredRequestFailed as e:
+                    logger.error(f"Deferred run of {group.leader.id} failed: {e}")
+                    run["status"], run["error"] = "failed", str(e)
+                    graph.memory.delete_thread(run["thread_id"])
+                    continue
+                group_logs = apply_group_directive(group, response) if group.members \
+                    else {group.leader.id: response.nodes_logs}
+                collect_worker_logs(group_logs, flush=False)
+                stage_logs.update(group_logs)
+                finished.append(run)
+
+            if finished:
+                # un solo flush outbound per fase; i checkpoint delle run concluse sono rimossi solo
+                # dopo aver salvato risultati e stato (se interrotto prima, la run riprende dall'ultimo nodo)
+                apply_outbound_failures(stage_logs)
+                rows = [{"id": inc_id, "logs": encode_nodes_logs(nodes_logs)} for inc_id, nodes_logs in stage_logs.items()]
+                _append_jsonl(results_path, rows)
+                results.update((row["id"], row["logs"]) for row in rows)
+                for run in finished:
+                    run["status"] = "done"
+                _write_json(state_path, job)
+                for run in finished:
+                    graph.memory.delete_thread(run["thread_id"])
+
+            if not store.pending:
+                _write_json(state_path, job)
+                break
+            job["stage"] += 1
+            requests_path = job_dir / f"stage_{job['stage']:03d}.requests.jsonl"
+            requests_path.write_text("", encoding="utf-8")
+            _append_jsonl(requests_path, [{"custom_id": key, "method": "POST", "url": CHAT_COMPLETIONS_URL, "body": body}
+                                          for key, body in store.pending.items()])
+            batch_id = backend.submit(requests_path)
+            job["batch"] = {"id": batch_id, "stage": job["stage"], "keys": list(store.pending)}
+            _write_json(state_path, job)
+            running = sum(1 for run in job["runs"].values() if run["status"] == "running")
+            logger.info(f"Stage {job['stage']}: submitted {len(store.pending)} requests for {running} runs "
+                        f"as batch {batch_id}")
+    finally:
+        set_active_store(None)
+        checkpointer.conn.close()
+        vocabulary.flush()
+
+    failed = [inc_id for inc_id, run in job["runs"].items() if run["status"] == "failed"]
+    logger.info(f"Batch job completed in {job['stage']} stages: {len(results)} incidents analyzed, "
+                f"{len(failed)} failed")
+    return [{f"Inc{i}": decode_nodes_logs(results[inc.id])}
+            for i, inc in enumerate(inc for inc in incidents if inc.id in results)]
+
+
+def run_deferred(settings) -> List[Dict[str, Dict[str, List[BaseLog]]]]:
+    """Modalità deferred: i primi `n_items` incident di data/incidents.json come batch job."""
+    set_environment_variables(f"incidents_analyzer_{date.today()}")
+    incidents = [Incident.model_validate(inc) for inc in (upload_json_incidents() or [])[:settings.n_items]]
+    job_dir = Path(settings.batch_job_dir)
+    job_dir = job_dir if job_dir.is_absolute() else PROJECT_ROOT / job_dir
+    return run_batch_job(
+        incidents, job_dir, create_backend(settings.batch_backend, job_dir, settings.batch_local_delay),
+        llm_call=settings.llm_call,
+        coalesce_window_minutes=settings.coalesce_window_minutes,
+        local_classifier_threshold=settings.local_classifier_threshold,
+        max_topics=settings.max_topics,
+        prompt_token_budget=settings.prompt_token_budget,
+        poll_interval=settings.batch_poll_interval,
+        max_attempts=settings.batch_max_attempts,
+    )
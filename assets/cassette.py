@@ -0,0 +1,212 @@
+"""
+Cassette delle chiamate LLM: una run reale viene registrata e poi riprodotta offline, così le
+modifiche all'orchestrazione si misurano a parità di comportamento dell'LLM.
+
+- record: ogni richiesta di chain e agent passa al modello vero; richiesta, risposta (testo o
+  tool call), usage e latenza osservata finiscono in un file JSONL (in append);
+- replay: le risposte arrivano dalla cassette, con la latenza registrata se `replay_latency`;
+  una richiesta non registrata solleva CassetteMiss.
+
+La chiave è il prompt renderizzato (ruolo e testo di ogni messaggio, tool disponibili, modello),
+con le parti che cambiano a ogni run sostituite da segnaposto: gli UUID (id delle directive) e
+l'output dei tool nei messaggi dell'agent. Nella risposta riprodotta gli UUID e l'output del
+tool registrati vengono rimpiazzati con quelli della run corrente. Se il prompt differisce solo
+per la lista dei topic del vocabolario (che evolve a ogni run) si usa una chiave che la ignora.
+Più registrazioni con la stessa chiave vengono servite nell'ordine in cui sono state registrate.
+
+In registrazione lo streaming non è usato: la chiamata al modello vero è sincrona.
+"""
+import hashlib
+import json
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from loguru import logger
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_CASSETTE_PATH = "data/cassettes/llm.jsonl"
+
+_UUID_RE = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}")
+# lista compatta di nomi (render_topics di un insieme): il vocabolario dei topic nei prompt
+_TOPIC_LIST_RE = re.compile(r'^\[(?:"[^"\n]*",?)*\]$', re.MULTILINE)
+
+
+class CassetteMiss(Exception):
+    """La richiesta non è presente nella cassette."""
+
+
+def _hash(data: Any) -> str:
+    return hashlib.sha256(json.dumps(data, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def normalize_request(messages: List[BaseMessage], tools: Optional[list], model: str
+                      ) -> Tuple[Dict[str, Any], List[str], List[str]]:
+    """
+    Richiesta con le parti variabili sostituite da segnaposto.
+    :return: (richiesta normalizzata, UUID in ordine di apparizione, output dei tool)
+    """
+    uuids: List[str] = []
+    tool_outputs: List[str] = []
+
+    def replace_uuid(match: re.Match) -> str:
+        if match.group(0) not in uuids:
+            uuids.append(match.group(0))
+        return f"<uuid:{uuids.index(match.group(0))}>"
+
+    rendered = []
+    for m in messages:
+        if isinstance(m, ToolMessage):
+            tool_outputs.append(str(m.content))
+            rendered.append({"role": m.type, "content": f"<tool_output:{len(tool_outputs) - 1}>"})
+            continue
+        entry = {"role": m.type, "content": _UUID_RE.sub(replace_uuid, str(m.content))}
+        if getattr(m, "tool_calls", None):
+            entry["tool_calls"] = [{"name": c["name"], "args": _UUID_RE.sub(replace_uuid, json.dumps(c["args"]))}
+                                   for c in m.tool_calls]
+        rendered.append(entry)
+    request = {
+        "model": model,
+        "tools": sorted(t.get("function", {}).get("name", "") for t in tools or []),
+        "messages": rendered,
+    }
+    return request, uuids, tool_outputs
+
+
+def request_keys(request: Dict[str, Any]) -> Tuple[str, str]:
+    """(chiave esatta, chiave che ignora la lista dei topic del vocabolario)."""
+    loose = {**request, "messages": [{**m, "content": _TOPIC_LIST_RE.sub("<topics>", m["content"])}
+                                     for m in request["messages"]]}
+    return _hash(request), _hash(loose)
+
+
+class Cassette:
+    def __init__(self, mode: str, path: Path, replay_latency: bool = True):
+        self.mode = mode
+        self.path = path
+        self.replay_latency = replay_latency
+        self._lock = threading.Lock()
+        self._entries: Dict[str, List[Dict[str, Any]]] = {}
+        self._loose: Dict[str, List[Dict[str, Any]]] = {}
+        self._served: Dict[int, int] = {}
+        if mode == "replay":
+            if not path.exists():
+                raise FileNotFoundError(f"Cassette {path} not found: record it first")
+            with path.open(encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._entries.setdefault(entry["key"], []).append(entry)
+                        self._loose.setdefault(entry["loose_key"], []).append(entry)
+            logger.info(f"Cassette {path}: {sum(map(len, self._entries.values()))} recorded responses")
+
+    def record(self, request: Dict[str, Any], uuids: List[str], tool_outputs: List[str],
+               message: AIMessage, latency_ms: float) -> None:
+        key, loose_key = request_keys(request)
+        usage = message.usage_metadata or {}
+        entry = {
+            "key": key, "loose_key": loose_key, "request": request, "uuids": uuids, "tool_outputs": tool_outputs,
+            "response": {
+                "content": message.content,
+                "tool_calls": [{"name": c["name"], "args": c["args"], "id": c["id"]} for c in message.tool_calls],
+                "usage": {k: usage.get(k, 0) for k in ("input_tokens", "output_tokens", "total_tokens")},
+                "model_name": message.response_metadata.get("model_name", request["model"]),
+            },
+            "latency_ms": round(latency_ms, 1),
+        }
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with self.path.open("a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n")
+
+    def replay(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        key, loose_key = request_keys(request)
+        with self._lock:
+            candidates = self._entries.get(key)
+            if not candidates:
+                candidates = self._loose.get(loose_key)
+                if candidates:
+                    logger.debug("Cassette: request matched ignoring the topic vocabulary")
+            if not candidates:
+                raise CassetteMiss(f"No recorded response for request {key[:12]} in {self.path}")
+            # registrazioni con la stessa chiave: servite in ordine, poi si ricomincia
+            served = self._served.get(id(candidates), 0)
+            self._served[id(candidates)] = served + 1
+            return candidates[served % len(candidates)]
+
+
+def _substitute(text: str, recorded: List[str], current: List[str]) -> str:
+    for old, new in zip(recorded, current):
+        text = text.replace(old, new)
+    return text
+
+
+class CassetteChatModel(BaseChatModel):
+    """In record avvolge il modello vero (`inner`); in replay risponde solo dalla cassette."""
+    model: str
+    cassette: Any  # Cassette
+    inner: Optional[BaseChatModel] = None
+
+    @property
+    def _llm_type(self) -> str:
+        return f"cassette-{self.cassette.mode}"
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        request, uuids, tool_outputs = normalize_request(messages, kwargs.get("tools"), self.model)
+        if self.cassette.mode == "record":
+            start = time.perf_counter()
+            result = self.inner._generate(messages, stop=stop, **kwargs)
+            self.cassette.record(request, uuids, tool_outputs, result.generations[0].message,
+                                 (time.perf_counter() - start) * 1000)
+            return result
+
+        entry = self.cassette.replay(request)
+        if self.cassette.replay_latency:
+            time.sleep(entry["latency_ms"] / 1000)
+        response = entry["response"]
+        content = _substitute(response["content"], entry["uuids"], uuids)
+        content = _substitute(content, entry["tool_outputs"], tool_outputs)
+        if entry["tool_outputs"] and tool_outputs:
+            # l'agent riporta l'output del tool in "tool_output" (TOOL_SUPERVISOR_PROMPT), anche riformattato
+            try:
+                answer = json.loads(content)
+                if isinstance(answer, dict) and "tool_output" in answer:
+                    answer["tool_output"] = json.loads(tool_outputs[-1])
+                    content = json.dumps(answer, ensure_ascii=False)
+            except json.JSONDecodeError:
+                pass
+        tool_calls = [{"name": c["name"], "args": json.loads(_substitute(json.dumps(c["args"]), entry["uuids"], uuids)),
+                       "id": c["id"]} for c in response["tool_calls"]]
+        message = AIMessage(content=content, tool_calls=tool_calls, usage_metadata=response["usage"],
+                            response_metadata={"model_name": response["model_name"]})
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+
+_cassette: Cassette | None = None
+_cassette_lock = threading.Lock()
+
+
+def get_cassette(mode: str | None = None, path: str | None = None, replay_latency: bool = True) -> Cassette | None:
+    """
+    Cassette di processo: con `mode` ("record"/"replay") la attiva (o la riusa se già aperta con
+    gli stessi parametri), con "off" la disattiva; senza argomenti restituisce quella attiva.
+    """
+    global _cassette
+    with _cassette_lock:
+        if mode is None:
+            return _cassette
+        if mode == "off":
+            _cassette = None
+            return None
+        location = Path(path or DEFAULT_CASSETTE_PATH)
+        location = location if location.is_absolute() else PROJECT_ROOT / location
+        if _cassette is None or (_cassette.mode, _cassette.path) != (mode, location):
+            _cassette = Cassette(mode, location, replay_latency)
+        _cassette.replay_latency = replay_latency
+        return _cassette
@@ -0,0 +1,214 @@
+import json
+import math
+import random
+import re
+import threading
+import zlib
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from loguru import logger
+
+from assets.coalescing import normalize_description
+from assets.custom_obj import Incident
+
+PROJECT_ROOT = Path(__file__).resolve().parent
+DEFAULT_DATASET_PATH = PROJECT_ROOT.parent / "data" / "consultant_labels.jsonl"
+DEFAULT_MODEL_PATH = PROJECT_ROOT.parent / "data" / "topic_classifier.json"
+
+N_FEATURES = 1 << 18
+MIN_TOPIC_SCORE = 0.30  # sotto questa soglia il topic non viene restituito
+
+_dataset_lock = threading.Lock()
+_WORD_RE = re.compile(r"[a-z]+")
+
+
+def features(incident: Incident, node: str) -> List[int]:
+    """
+    Feature hashate dell'incident: unigrammi e bigrammi di parole, trigrammi di caratteri,
+    service e nome del consultant (un solo modello serve tutti e tre i consultant).
+    """
+    text = normalize_description(f"{incident.short_description} {incident.description}")
+    words = _WORD_RE.findall(text)
+    grams = [f"w:{w}" for w in words]
+    grams += [f"b:{a}_{b}" for a, b in zip(words, words[1:])]
+    grams += [f"c:{text[i:i + 3]}" for i in range(len(text) - 2)]
+    grams += [f"s:{(incident.service or '').lower()}", f"n:{node}", f"i:{incident.impact}", f"st:{incident.state}"]
+    return sorted({zlib.crc32(g.encode("utf-8")) % N_FEATURES for g in grams})
+
+
+def record_consultant_output(incident: Incident, node: str, topics: Dict[str, float],
+                             path: Path = DEFAULT_DATASET_PATH) -> None:
+    """
+    Accumula l'output di un consultant LLM come esempio di training per il classificatore locale.
+    """
+    row = {"incident": incident.model_dump(mode="json"), "node": node, "topics": topics}
+    with _dataset_lock:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open("a", encoding="utf-8") as f:
+            f.write(json.dumps(row, ensure_ascii=False, separators=(",", ":")) + "\n")
+
+
+def load_dataset(path: Path = DEFAULT_DATASET_PATH) -> List[Tuple[Incident, str, Dict[str, float]]]:
+    logger.debug("Entering the load dataset function")
+    rows = []
+    with path.open("r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                row = json.loads(line)
+                rows.append((Incident.model_validate(row["incident"]), row["node"], row["topics"]))
+    return rows
+
+
+def split_dataset(rows: list, test_ratio: float = 0.2) -> Tuple[list, list]:
+    """Split deterministico per incident id: le etichette di uno stesso incident restano dallo stesso lato."""
+    buckets = round(test_ratio * 100)
+    train, test = [], []
+    for row in rows:
+        (test if zlib.crc32(row[0].id.encode("utf-8")) % 100 < buckets else train).append(row)
+    return train, test
+
+
+class LocalTopicClassifier:
+    """
+    Regressione logistica one-vs-rest su feature n-gram hashate, addestrata sugli score dei
+    consultant LLM (target soft in [0,1]). La confidenza misura quanto l'input è noto: la quota
+    delle sue feature viste in training, pesate per IDF (le feature presenti in tutti gli esempi,
+    come il nome del consultant, non contano). Un input nuovo ha confidenza bassa e, sotto
+    `local_classifier_threshold`, torna all'LLM; gli score dei topic non entrano nella confidenza
+    perché gli output dei consultant sono multi-label.
+    """
+
+    def __init__(self, topics: List[str] | None = None):
+        self.topics: List[str] = list(topics or [])
+        self.weights: Dict[str, Dict[int, float]] = {t: {} for t in self.topics}
+        self.bias: Dict[str, float] = {t: 0.0 for t in self.topics}
+        self.doc_freq: Dict[int, int] = {}  # feature -> numero di esempi di training che la contengono
+        self.n_samples = 0
+
+    def _score(self, topic: str, feats: List[int]) -> float:
+        w = self.weights[topic]
+        z = self.bias[topic] + sum(w.get(f, 0.0) for f in feats)
+        return 1.0 / (1.0 + math.exp(-max(-30.0, min(30.0, z))))
+
+    def fit(self, rows: List[Tuple[Incident, str, Dict[str, float]]], epochs: int = 15,
+            lr: float = 0.5, l2: float = 1e-4, seed: int = 7) -> "LocalTopicClassifier":
+        logger.debug("Entering the classifier fit function")
+        vocab = sorted({str(k).lower().strip() for _, _, t in rows for k in t} | set(self.topics))
+        self.topics = vocab
+        self.weights = {t: self.weights.get(t, {}) for t in vocab}
+        self.bias = {t: self.bias.get(t, 0.0) for t in vocab}
+        samples = []
+        for incident, node, topics in rows:
+            feats = features(incident, node)
+            target = {str(k).lower().strip(): max(0.0, min(1.0, float(v))) for k, v in topics.items()}
+            samples.append((feats, target))
+            for f in feats:
+                self.doc_freq[f] = self.doc_freq.get(f, 0) + 1
+        self.n_samples += len(samples)
+        rnd = random.Random(seed)
+        for epoch in range(epochs):
+            rnd.shuffle(samples)
+            step = lr / (1 + epoch)
+            for feats, target in samples:
+                for topic in vocab:
+                    grad = self._score(topic, feats) - target.get(topic, 0.0)
+                    w = self.weights[topic]
+                    for f in feats:
+                        w[f] = w.get(f, 0.0) * (1 - step * l2) - step * grad
+                    self.bias[topic] -= step * grad
+        logger.info(f"Local topic classifier trained on {len(samples)} samples, {len(vocab)} topics")
+        return self
+
+    def _coverage(self, feats: List[int]) -> float:
+        """Quota (pesata per IDF) delle feature dell'input viste in training."""
+        seen = total = 0.0
+        for f in feats:
+            df = self.doc_freq.get(f, 0)
+            idf = math.log((self.n_samples + 1) / (df + 1))
+            total += idf
+            if df:
+                seen += idf
+        if not total:
+            # modello non addestrato, o solo feature presenti in tutti gli esempi di training
+            return 1.0 if self.n_samples else 0.0
+        return seen / total
+
+    def predict(self, incident: Incident, node: str) -> Tuple[Dict[str, float], float]:
+        """
+        :return: (topic -> score sopra MIN_TOPIC_SCORE, confidenza in [0,1]: quota pesata delle
+                 feature dell'input viste in training)
+        """
+        feats = features(incident, node)
+        if not self.topics:
+            return {}, 0.0
+        topics = {topic: round(p, 2) for topic in self.topics if (p := self._score(topic, feats)) >= MIN_TOPIC_SCORE}
+        return dict(sorted(topics.items(), key=lambda kv: -kv[1])), self._coverage(feats)
+
+    def evaluate(self, rows: List[Tuple[Incident, str, Dict[str, float]]], threshold: float = 0.5) -> Dict[str, float]:
+        """
+        Confronto con le etichette LLM di held-out: MAE sugli score, precision/recall/F1 dei topic
+        sopra `threshold` e accordo sul topic principale.
+        """
+        tp = fp = fn = top1 = 0
+        abs_err, n_scores = 0.0, 0
+        for incident, node, topics in rows:
+            truth = {str(k).lower().strip(): float(v) for k, v in topics.items()}
+            pred, _ = self.predict(incident, node)
+            for topic in set(truth) | set(self.topics):
+                abs_err += abs(pred.get(topic, 0.0) - truth.get(topic, 0.0))
+                n_scores += 1
+            pos_true = {t for t, v in truth.items() if v >= threshold}
+            pos_pred = {t for t, v in pred.items() if v >= threshold}
+            tp += len(pos_true & pos_pred)
+            fp += len(pos_pred - pos_true)
+            fn += len(pos_true - pos_pred)
+            if truth and pred and max(truth, key=truth.get) == max(pred, key=pred.get):
+                top1 += 1
+        precision = tp / (tp + fp) if tp + fp else 0.0
+        recall = tp / (tp + fn) if tp + fn else 0.0
+        return {
+            "samples": len(rows),
+            "mae": abs_err / n_scores if n_scores else 0.0,
+            "precision": precision,
+            "recall": recall,
+            "f1": 2 * precision * recall / (precision + recall) if precision + recall else 0.0,
+            "top1_agreement": top1 / len(rows) if rows else 0.0,
+        }
+
+    def save(self, path: Path = DEFAULT_MODEL_PATH) -> Path:
+        data = {
+            "n_features": N_FEATURES,
+            "topics": self.topics,
+            "bias": self.bias,
+            "n_samples": self.n_samples,
+            "doc_freq": {str(f): n for f, n in self.doc_freq.items()},
+            "weights": {t: {str(f): round(v, 6) for f, v in w.items() if abs(v) > 1e-6} for t, w in self.weights.items()},
+        }
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(data, separators=(",", ":")), encoding="utf-8")
+        return path
+
+    @classmethod
+    def load(cls, path: Path = DEFAULT_MODEL_PATH) -> "LocalTopicClassifier":
+        data = json.loads(path.read_text(encoding="utf-8"))
+        if data.get("n_features") != N_FEATURES:
+            raise ValueError(f"{path.name}: modello addestrato con {data.get('n_features')} feature, attese {N_FEATURES}")
+        model = cls(data["topics"])
+        model.bias = {t: float(v) for t, v in data["bias"].items()}
+        model.weights = {t: {int(f): float(v) for f, v in w.items()} for t, w in data["weights"].items()}
+        if "doc_freq" not in data:
+            logger.warning(f"{path.name}: modello senza frequenze delle feature, confidenza sempre 0 (va riaddestrato)")
+        model.n_samples = int(data.get("n_samples", 0))
+        model.doc_freq = {int(f): int(n) for f, n in data.get("doc_freq", {}).items()}
+        return model
+
+
+@lru_cache(maxsize=4)
+def load_classifier(path: Path = DEFAULT_MODEL_PATH) -> LocalTopicClassifier | None:
+    """Carica (una sola volta per processo) il classificatore locale, None se non ancora addestrato."""
+    if not path.exists():
+        logger.warning(f"{path.name} non trovato: il classificatore locale non è disponibile")
+        return None
+    return LocalTopicClassifier.load(path)
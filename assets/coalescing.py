@@ -0,0 +1,119 @@
+import hashlib
+import re
+import uuid
+from datetime import datetime
+from typing import Dict, List
+
+from loguru import logger
+
+from assets.custom_obj import Incident, IncidentGroup, AgentState, Directive, CoalescedLog, AgentRole
+
+
+_NOISE_RE = re.compile(r"[^a-z ]+")
+_SPACES_RE = re.compile(r"\s+")
+
+
+def normalize_description(text: str) -> str:
+    """
+    Normalizza la descrizione per il fingerprint: minuscolo, senza numeri,
+    punteggiatura e spazi multipli (es. "Error 500 on login" -> "error on login").
+    """
+    text = _NOISE_RE.sub(" ", (text or "").lower())
+    return _SPACES_RE.sub(" ", text).strip()
+
+
+def incident_fingerprint(incident: Incident, window_minutes: int) -> str:
+    """
+    Fingerprint di un incident: service + descrizione normalizzata + bucket temporale
+    di `window_minutes` minuti su `created_at`.
+    """
+    description = normalize_description(incident.short_description or incident.description)
+    bucket = int(incident.created_at.timestamp() // (window_minutes * 60)) if window_minutes > 0 else incident.id
+    raw = f"{(incident.service or '').lower()}|{description}|{bucket}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def coalesce_incidents(incidents: List[Incident], window_minutes: int) -> List[IncidentGroup]:
+    """
+    Raggruppa gli incident con lo stesso fingerprint. Il primo incident (in ordine di
+    arrivo) di ogni gruppo è il leader su cui viene eseguito il grafo.
+    :param incidents: incident da raggruppare
+    :param window_minutes: ampiezza della finestra temporale; 0 disabilita il raggruppamento
+    :return: la lista dei gruppi, nell'ordine del loro leader
+    """
+    logger.debug("Entering the coalesce incidents function")
+    groups: Dict[str, IncidentGroup] = {}
+    for incident in incidents:
+        fingerprint = incident_fingerprint(incident, window_minutes)
+        group = groups.get(fingerprint)
+        if group is None:
+            groups[fingerprint] = IncidentGroup(fingerprint=fingerprint, leader=incident)
+        else:
+            group.members.append(incident)
+    coalesced = [g for g in groups.values() if g.members]
+    if coalesced:
+        logger.info(f"Coalesced {sum(len(g.members) for g in coalesced)} incidents into {len(coalesced)} groups")
+    return list(groups.values())
+
+
+def apply_group_directive(group: IncidentGroup, leader_state: AgentState) -> Dict[str, Dict[str, list]]:
+    """
+    Applica la directive finale del leader ad ogni membro del gruppo sottomettendo direttamente
+    l'azione del worker selezionato, senza rieseguire il grafo (i WorkerLog dei membri si
+    raccolgono con collect_worker_logs).
+    :return: i nodes_logs per incident id (leader compreso), collegati tramite CoalescedLog
+    """
+    # Import locale: il registry dei tool vive nel modulo dei supervisor
+    from assets.nodes.supervisors import TOOL_REGISTRY, dispatch_tool
+
+    logger.debug("Entering the apply group directive function")
+    member_ids = [inc.id for inc in group.members]
+    leader_directive = (leader_state.directives or [None])[-1]
+    tool_name = (leader_directive.metadata or {}).get("selected_tool") if leader_directive else None
+
+    logs: Dict[str, Dict[str, list]] = {
+        group.leader.id: leader_state.nodes_logs
+    }
+    leader_state.nodes_logs.setdefault(AgentRole.coalescing.value, []).append(
+        _coalesced_log(group, group.leader, member_ids, leader_directive.id if leader_directive else None)
+    )
+    for member in group.members:
+        member_logs: Dict[str, list] = {
+            AgentRole.consultant.value: [],
+            AgentRole.supervisor.value: [],
+            AgentRole.worker.value: [],
+        }
+        directive_id = None
+        if tool_name in TOOL_REGISTRY:
+            directive = Directive(
+                id=str(uuid.uuid4()),
+                action=f"{leader_directive.action} [coalesced into {group.leader.id} for incident {member.id}]",
+                confidence=leader_directive.confidence,
+                source_token_id=leader_directive.source_token_id,
+                timestamp=datetime.now(),
+                metadata={**(leader_directive.metadata or {}), "coalesced_from": leader_directive.id},
+            )
+            directive_id = directive.id
+            # azione sottomessa all'esecutore: il WorkerLog del membro si raccoglie a fine batch
+            dispatch_tool(tool_name, directive.action, directive.id, member.service, member.id)
+        else:
+            logger.error(f"No valid directive from leader {group.leader.id}, member {member.id} not actioned")
+        member_logs[AgentRole.coalescing.value] = [_coalesced_log(group, member, member_ids, directive_id)]
+        logs[member.id] = member_logs
+    logger.info(f"Directive of {group.leader.id} applied to {len(member_ids)} coalesced incidents: {member_ids}")
+    return logs
+
+
+def _coalesced_log(group: IncidentGroup, incident: Incident, member_ids: List[str], directive_id: str | None) -> CoalescedLog:
+    return CoalescedLog(
+        node_name=AgentRole.coalescing.value,
+        token_usage=0,
+        processing_time=0,
+        total_cost=0,
+        llm_count=0,
+        group_id=group.fingerprint,
+        incident_id=incident.id,
+        leader_id=group.leader.id,
+        members=member_ids,
+        directive_id=directive_id,
+    )
@@ -1,5 +1,6 @@
 import time
 
+from dataclasses import dataclass, field
 from datetime import datetime
 from enum import StrEnum
 from typing import Optional, List, Dict, Any, Literal
@@ -42,11 +43,19 @@ class BaseLog(BaseModel):
     processing_time: int  # ms
     total_cost: float
     llm_count: int
+    prompt_tokens: int = 0  # conteggio locale, prima dell'invio
+    prompt_tokens_saved: int = 0  # rispetto alla serializzazione verbosa
+    ttft_ms: Optional[int] = None  # solo in streaming: tempo al primo token
+    decision_ms: Optional[int] = None  # solo in streaming: tempo ai campi necessari alla decisione
+    usage_estimated: bool = False  # stream senza usage: token e costo stimati in locale
+    logging_ms: Optional[float] = None  # tempo del nodo passato in loguru (se misurato, vedi assets.log_setup)
 
 class ConsultantLog(BaseLog):
     input_length: int
     token_id: str
     topic_extracted: List[str]
+    topic_source: str = "llm"  # "llm", "reused", "local", "graph"
+    prompt_topics_chars: int = 0  # dimensione di existing_topics nel prompt
 
 class SupervisorLog(BaseLog):
     actions: List[str]
@@ -60,6 +69,27 @@ class WorkerLog(BaseLog):
     action: str
     success: str
     timestamp: datetime
+    batch_id: Optional[str] = None  # batch outbound in cui l'azione è stata accodata
+
+class ShadowLog(BaseLog):
+    """Confronto tra il percorso veloce usato in produzione e il percorso LLM originale"""
+    incident_id: str
+    fast_paths: List[str]
+    primary_route: Optional[str] = None
+    shadow_route: Optional[str] = None
+    primary_tool: Optional[str] = None
+    shadow_tool: Optional[str] = None
+    route_match: bool
+    tool_match: bool
+    topic_overlap: float  # Jaccard sui nomi dei topic
+
+class CoalescedLog(BaseLog):
+    """Collega gli incident di uno stesso gruppo (storm) all'analisi del leader"""
+    group_id: str
+    incident_id: str
+    leader_id: str
+    members: List[str]
+    directive_id: Optional[str] = None
 
 
 class AgentRole(StrEnum):
@@ -67,16 +97,84 @@ class AgentRole(StrEnum):
     consultant = "consultant"
     supervisor = "supervisor"
     worker = "worker"
+    coalescing = "coalescing"
+    shadow = "shadow"
+
+class SimilarAnalysis(BaseModel):
+    """Analisi di un incident simile già processato, riusabile al posto delle chiamate LLM"""
+    incident_id: str
+    topics: Dict[str, float]
+    route: str
+    tool: str
+    similarity: float
+
+def merge_nodes_logs(left: Optional[Dict[str, List[BaseLog]]],
+                     right: Optional[Dict[str, List[BaseLog]]]) -> Dict[str, List[BaseLog]]:
+    """Reducer di nodes_logs: i nodi restituiscono solo i propri log, accodati per ruolo."""
+    merged = {role: list(entries) for role, entries in (left or {}).items()}
+    for role, entries in (right or {}).items():
+        merged[role] = merged.get(role, []) + list(entries)
+    return merged
+
+def append_directives(left: Optional[List[Directive]], right: Optional[List[Directive]]) -> List[Directive]:
+    """Reducer di directives: le directive dei supervisor si accodano a quelle già emesse."""
+    return (left or []) + (right or [])
 
 class AgentState(BaseModel):
     topics: Annotated[set[str], operator.or_]
     llm_supervisor: bool = False
     incident: Optional[Incident] = None
     token: Optional[Token] = None
-    directives: Optional[List[Directive]] = None
-    nodes_logs: Optional[Dict[str, List[BaseLog]]]
+    directives: Annotated[Optional[List[Directive]], append_directives] = None
+    nodes_logs: Annotated[Optional[Dict[str, List[BaseLog]]], merge_nodes_logs]
+    temperature: Optional[float] = 0.5
+    model: Optional[str] = "gpt-4o-mini"
+    reused: Optional[SimilarAnalysis] = None
+    local_classifier_threshold: Optional[float] = None
+    direct_tool_dispatch: bool = False
+    shadow: bool = False
+    prompt_token_budget: int = 256
+    streaming: bool = False
+    stream_early_exit: bool = False
+    deferred_llm: bool = False
+    service_graph_mode: str = "off"
+    record_labels: bool = True  # output dei consultant LLM salvati come esempi per il classificatore locale
+
+@dataclass(slots=True)
+class FastAgentState:
+    """
+    Stato del grafo in modalità fast-state: stessi campi e reducer di AgentState, ma come dataclass,
+    così LangGraph non rivalida lo stato a ogni nodo. La validazione avviene solo ai bordi del
+    grafo (AgentState iniziale e finale).
+    """
+    topics: Annotated[set[str], operator.or_] = field(default_factory=set)
+    llm_supervisor: bool = False
+    incident: Optional[Incident] = None
+    token: Optional[Token] = None
+    directives: Annotated[Optional[List[Directive]], append_directives] = None
+    nodes_logs: Annotated[Optional[Dict[str, List[BaseLog]]], merge_nodes_logs] = None
     temperature: Optional[float] = 0.5
     model: Optional[str] = "gpt-4o-mini"
+    reused: Optional[SimilarAnalysis] = None
+    local_classifier_threshold: Optional[float] = None
+    direct_tool_dispatch: bool = False
+    shadow: bool = False
+    prompt_token_budget: int = 256
+    streaming: bool = False
+    stream_early_exit: bool = False
+    deferred_llm: bool = False
+    service_graph_mode: str = "off"
+    record_labels: bool = True  # output dei consultant LLM salvati come esempi per il classificatore locale
+
+class IncidentGroup(BaseModel):
+    """Gruppo di incident con lo stesso fingerprint (service, descrizione, finestra temporale)"""
+    fingerprint: str
+    leader: Incident
+    members: List[Incident] = Field(default_factory=list)
+
+    @property
+    def incidents(self) -> List[Incident]:
+        return [self.leader, *self.members]
 
 class Processed_Logs(BaseModel):
     final_cost: float
@@ -85,6 +183,21 @@ class Processed_Logs(BaseModel):
     total_items: int
     total_success_rate: float
     throughput_per_min: float
+    vocabulary_size: Optional[int] = None
+    avg_prompt_topics_chars: Optional[float] = None
+    max_prompt_topics_chars: Optional[int] = None
+    prompt_tokens: Optional[int] = None
+    prompt_tokens_saved: Dict[str, int] = Field(default_factory=dict)
+    avg_ttft_ms: Dict[str, float] = Field(default_factory=dict)
+    avg_decision_ms: Dict[str, float] = Field(default_factory=dict)
+    estimated_usage_calls: int = 0  # chiamate in streaming senza usage (token e costo stimati)
+    logging_overhead_pct: Optional[float] = None  # quota del tempo dei nodi passata nei log
+    logging_overhead_pct_by_node: Dict[str, float] = Field(default_factory=dict)
+    shadow_samples: int = 0
+    shadow_route_agreement: Optional[float] = None
+    shadow_tool_agreement: Optional[float] = None
+    shadow_topic_overlap: Optional[float] = None
+    shadow_cost: float = 0.0
 
 
 
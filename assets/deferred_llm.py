@@ -0,0 +1,71 @@
+"""
+Chat model dei batch job differiti: non chiama l'API ma cerca la risposta tra quelle già
+scaricate dai batch precedenti. Se manca, la richiesta viene registrata per il batch della
+prossima fase e la run del nodo si interrompe con DeferredCall (il grafo riprenderà da lì).
+"""
+import hashlib
+import json
+from typing import Any, Dict, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+# tipi dei messaggi LangChain -> ruoli dell'API chat completions
+ROLES = {"system": "system", "human": "user", "ai": "assistant"}
+
+_active_store = None
+
+
+class DeferredCall(Exception):
+    """La risposta non è ancora disponibile: la richiesta è stata accodata per il prossimo batch."""
+
+
+class DeferredRequestFailed(Exception):
+    """La richiesta è fallita in tutti i batch in cui è stata inviata."""
+
+
+def request_key(body: Dict[str, Any]) -> str:
+    """Chiave della richiesta: stesso modello, temperatura e messaggi -> stessa risposta."""
+    return hashlib.sha256(json.dumps(body, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def set_active_store(store) -> None:
+    global _active_store
+    _active_store = store
+
+
+def active_store():
+    if _active_store is None:
+        raise RuntimeError("deferred_llm requires an active batch job response store")
+    return _active_store
+
+
+class DeferredChatModel(BaseChatModel):
+    model: str
+    temperature: Optional[float] = None
+    store: Any  # assets.batch_jobs.ResponseStore
+
+    @property
+    def _llm_type(self) -> str:
+        return "deferred-batch"
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        body = {
+            "model": self.model,
+            "temperature": self.temperature,
+            "messages": [{"role": ROLES.get(m.type, m.type), "content": m.content} for m in messages],
+        }
+        response = self.store.lookup(request_key(body), body)
+        usage = response.get("usage") or {}
+        message = AIMessage(
+            content=response["content"],
+            usage_metadata={
+                "input_tokens": usage.get("prompt_tokens", 0),
+                "output_tokens": usage.get("completion_tokens", 0),
+                "total_tokens": usage.get("total_tokens", 0),
+            },
+            response_metadata={"model_name": response.get("model", self.model)},
+        )
+        return ChatResult(generations=[ChatGeneration(message=message)])
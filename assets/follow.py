@@ -0,0 +1,232 @@
+"""
+Modalità follow: segue un file JSONL a cui l'exporter dei ticket continua ad aggiungere incident
+(uno per riga) e li analizza man mano che arrivano.
+
+- l'offset letto viene salvato in un file di checkpoint solo dopo che gli incident del batch sono
+  stati processati: dopo un crash le righe non confermate vengono rilette (at-least-once);
+- gli id già processati sono salvati nello stesso checkpoint, quindi un incident ripetuto
+  (riletto dopo un restart o ri-esportato) non viene analizzato due volte;
+- una riga senza newline finale è considerata ancora in scrittura e riletta al giro successivo;
+- troncamento o rotazione del file (inode diverso) fanno ripartire la lettura da capo e azzerano
+  l'offset del checkpoint; i batch letti prima del troncamento non ne confermano più l'offset;
+- il riepilogo viene stampato periodicamente, sugli incident processati nell'ultimo intervallo;
+- le notifiche e le work note restano nei batch outbound aperti tra un batch e l'altro e le
+  invia il timer della finestra: uno storm letto a piccoli batch condivide le chiamate bulk.
+"""
+import json
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from loguru import logger
+from pydantic import ValidationError
+
+from assets.custom_obj import BaseLog, Incident
+from assets.helper.config_helper import AppSettings
+from assets.helper.logging import log_processing, print_summary
+from assets.run import IncidentProcessor
+from assets.utils import set_environment_variables
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+MAX_CHECKPOINT_IDS = 10_000  # id processati ricordati per la deduplica
+
+# (offset a fine riga, inode del file, generazione del checkpoint, incident o None se la riga non è valida)
+QueueItem = Tuple[int, int, int, Incident | None]
+
+
+class OffsetCheckpoint:
+    """
+    Offset confermato e ultimi id processati, scritti in modo atomico su un file JSON.
+    La generazione (solo in memoria) cresce a ogni `reset`: una commit con una generazione
+    precedente conferma gli id ma non l'offset, che si riferisce al contenuto troncato.
+    """
+
+    def __init__(self, path: Path, max_ids: int = MAX_CHECKPOINT_IDS):
+        self.path = path
+        self.max_ids = max_ids
+        self.inode: int | None = None
+        self.offset = 0
+        self.generation = 0
+        self.ids: "OrderedDict[str, None]" = OrderedDict()
+        self._lock = threading.Lock()
+        if path.exists():
+            data = json.loads(path.read_text(encoding="utf-8"))
+            self.inode, self.offset = data.get("inode"), data.get("offset", 0)
+            self.ids = OrderedDict.fromkeys(data.get("ids", []))
+
+    def seen(self, incident_id: str) -> bool:
+        return incident_id in self.ids
+
+    def commit(self, inode: int, offset: int, incident_ids: List[str], generation: int = 0) -> None:
+        with self._lock:
+            for incident_id in incident_ids:
+                self.ids[incident_id] = None
+                self.ids.move_to_end(incident_id)
+            while len(self.ids) > self.max_ids:
+                self.ids.popitem(last=False)
+            if generation == self.generation:
+                self.inode, self.offset = inode, offset
+            self._write()
+
+    def reset(self, inode: int) -> int:
+        """Riparte dall'inizio del file (dopo troncamento o rotazione); restituisce la nuova generazione."""
+        with self._lock:
+            self.generation += 1
+            self.inode, self.offset = inode, 0
+            self._write()
+            return self.generation
+
+    def _write(self) -> None:
+        tmp = self.path.with_suffix(self.path.suffix + ".tmp")
+        tmp.write_text(json.dumps({"inode": self.inode, "offset": self.offset, "ids": list(self.ids)}),
+                       encoding="utf-8")
+        os.replace(tmp, self.path)
+
+
+class JsonlFollower:
+    """
+    Legge in un thread le righe complete aggiunte al file e le mette in una coda limitata:
+    se l'analisi è più lenta dell'exporter la lettura si ferma (backpressure) invece di
+    accumulare incident in memoria.
+    """
+
+    def __init__(self, path: Path, checkpoint: OffsetCheckpoint, poll_interval: float = 1.0,
+                 queue_size: int = 256):
+        self.path = path
+        self.checkpoint = checkpoint
+        self.poll_interval = poll_interval
+        self.queue: queue.Queue[QueueItem] = queue.Queue(maxsize=queue_size)
+        self.stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._read_loop, name="jsonl-follower", daemon=True)
+
+    def start(self) -> "JsonlFollower":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.stop_event.set()
+        self._thread.join()
+
+    def _put(self, item: QueueItem) -> bool:
+        while not self.stop_event.is_set():
+            try:
+                self.queue.put(item, timeout=self.poll_interval)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _read_loop(self) -> None:
+        restart = False
+        generation = self.checkpoint.generation
+        while not self.stop_event.is_set():
+            if not self.path.exists():
+                self.stop_event.wait(self.poll_interval)
+                continue
+            with self.path.open("rb") as f:
+                inode = os.fstat(f.fileno()).st_ino
+                if restart:
+                    # il file ora ha un contenuto diverso: anche il checkpoint riparte da 0
+                    offset, generation = 0, self.checkpoint.reset(inode)
+                else:
+                    offset = self.checkpoint.offset if self.checkpoint.inode in (None, inode) else 0
+                    if offset > os.fstat(f.fileno()).st_size:
+                        offset = 0
+                f.seek(offset)
+                logger.info(f"Following {self.path} from offset {offset}")
+                restart = self._follow(f, inode, generation)
+
+    def _follow(self, f, inode: int, generation: int) -> bool:
+        """Legge le righe complete fino allo stop; True se il file è stato troncato o ruotato."""
+        while not self.stop_event.is_set():
+            start = f.tell()
+            line = f.readline()
+            if line.endswith(b"\n"):
+                if self._put((f.tell(), inode, generation, self._parse(line, start))):
+                    continue
+                return False
+            # fine file o riga ancora in scrittura: si riprova dopo il poll
+            f.seek(start)
+            self.stop_event.wait(self.poll_interval)
+            try:
+                stat = os.stat(self.path)
+            except FileNotFoundError:
+                continue
+            if stat.st_ino != inode or stat.st_size < start:
+                logger.warning(f"{self.path} rotated or truncated: reading from the start")
+                return True
+        return False
+
+    @staticmethod
+    def _parse(line: bytes, offset: int) -> Incident | None:
+        if not line.strip():
+            return None
+        try:
+            return Incident.model_validate(json.loads(line))
+        except (ValueError, ValidationError) as e:
+            logger.error(f"Skipping invalid incident at offset {offset}: {e}")
+            return None
+
+    def next_batch(self, max_items: int) -> List[QueueItem]:
+        """Attende il primo elemento (al più poll_interval) e prende quelli già in coda, fino a max_items."""
+        try:
+            batch = [self.queue.get(timeout=self.poll_interval)]
+        except queue.Empty:
+            return []
+        while len(batch) < max_items:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+
+def follow(settings: AppSettings, stop_event: threading.Event | None = None) -> None:
+    """Segue `settings.follow_path` fino a Ctrl+C (o a `stop_event`), con riepiloghi periodici."""
+    set_environment_variables(f"incidents_analyzer_{date.today()}")
+    path = Path(settings.follow_path)
+    path = path if path.is_absolute() else PROJECT_ROOT / path
+    checkpoint_path = Path(settings.follow_checkpoint) if settings.follow_checkpoint else \
+        path.with_name(path.name + ".offset")
+    checkpoint_path = checkpoint_path if checkpoint_path.is_absolute() else PROJECT_ROOT / checkpoint_path
+    checkpoint = OffsetCheckpoint(checkpoint_path)
+    follower = JsonlFollower(path, checkpoint, settings.follow_poll_interval, settings.follow_queue_size).start()
+    processor = IncidentProcessor.from_settings(settings)
+    window: List[Dict[str, Dict[str, List[BaseLog]]]] = []
+    last_summary = time.monotonic()
+    stop_event = stop_event or threading.Event()
+
+    def flush_summary() -> None:
+        nonlocal window, last_summary
+        if window:
+            print_summary(log_processing(window), settings)
+        window, last_summary = [], time.monotonic()
+
+    try:
+        while not stop_event.is_set():
+            batch = follower.next_batch(settings.follow_batch_size)
+            if batch:
+                offset, inode, generation = batch[-1][:3]
+                # duplicati (anche all'interno dello stesso batch) analizzati una volta sola
+                incidents = list({inc.id: inc for _, _, _, inc in batch
+                                  if inc is not None and not checkpoint.seen(inc.id)}.values())
+                skipped = sum(1 for item in batch if item[3] is not None) - len(incidents)
+                if skipped:
+                    logger.info(f"Skipping {skipped} already processed incidents")
+                if incidents:
+                    for _, _, nodes_logs in processor.process(incidents, flush_outbound=False):
+                        window.append({f"Inc{len(window)}": nodes_logs})
+                checkpoint.commit(inode, offset, [inc.id for inc in incidents], generation)
+            if time.monotonic() - last_summary >= settings.follow_summary_interval:
+                flush_summary()
+    except KeyboardInterrupt:
+        logger.info("Stopping follow mode")
+    finally:
+        follower.stop()
+        processor.close()
+        flush_summary()
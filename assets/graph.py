@@ -1,7 +1,7 @@
 import uuid
 from langgraph.graph.state import StateGraph
 from langgraph.checkpoint.memory import MemorySaver
-from assets.custom_obj import AgentState, AgentRole, Incident
+from assets.custom_obj import AgentState, AgentRole, Incident, SimilarAnalysis, FastAgentState
 from assets.nodes.consultants import (
     input_consultant_node,
     root_cause_consultant_node,
@@ -11,6 +11,9 @@ from assets.nodes.supervisors import (
     router_supervisor_node,
     tool_invocation_supervisor_node,
 )
+from assets.log_setup import logging_timer_enabled, measure_node_logging
+from assets.profiling import get_profiler
+from assets.tracing import get_tracer
 from assets.helper.costants import (
     INPUT_CONSULTANT_NAME,
     ROUTER_SUPERVISOR_NAME,
@@ -20,27 +23,50 @@ from assets.helper.costants import (
 )
 
 class IncidentsGraph:
-    def __init__(self, llm_call: bool, topics: set[str] | None = None):
-        self.builder = StateGraph(AgentState)
-        memory = MemorySaver()
+    def __init__(self, llm_call: bool, topics: set[str] | None = None,
+                 local_classifier_threshold: float | None = None, direct_tool_dispatch: bool = False,
+                 shadow: bool = False, prompt_token_budget: int = 256,
+                 streaming: bool = False, stream_early_exit: bool = False, fast_state: bool = False,
+                 deferred_llm: bool = False, service_graph_mode: str = "off", record_labels: bool = True,
+                 checkpointer=None):
+        # fast-state: stato dataclass senza validazione per nodo e nessun checkpointer
+        # (il grafo non usa interrupt né resume, il checkpoint serviva solo a LangGraph)
+        self.fast_state = fast_state
+        self.builder = StateGraph(FastAgentState if fast_state else AgentState)
+        # checkpointer in memoria salvo diversa indicazione (SqliteSaver per i batch job ripresi dopo un'interruzione)
+        self.memory = None if fast_state else checkpointer or MemorySaver()
 
-        # Nodi
-        self.builder.add_node(INPUT_CONSULTANT_NAME, input_consultant_node)
-        self.builder.add_node(ROUTER_SUPERVISOR_NAME, router_supervisor_node)
-        self.builder.add_node(ROOT_CAUSE_CONSULTANT_NAME, root_cause_consultant_node)
-        self.builder.add_node(ENTITY_GRAPH_CONSULTANT_NAME, entity_graph_consultant_node)
-        self.builder.add_node(TOOL_INVOCATION_SUPERVISOR_NAME, tool_invocation_supervisor_node)
+        # Nodi (avvolti dalla misura del tempo nei log, dal profiler per nodo e dal tracer se attivi)
+        wrappers = [measure_node_logging] if logging_timer_enabled() else []
+        wrappers += [w.wrap for w in (get_tracer(), get_profiler()) if w is not None]
+
+        def wrap(name, node):
+            for wrapper in wrappers:
+                node = wrapper(name, node)
+            return node
+
+        self.builder.add_node(INPUT_CONSULTANT_NAME, wrap(INPUT_CONSULTANT_NAME, input_consultant_node))
+        self.builder.add_node(ROUTER_SUPERVISOR_NAME, wrap(ROUTER_SUPERVISOR_NAME, router_supervisor_node))
+        self.builder.add_node(ROOT_CAUSE_CONSULTANT_NAME, wrap(ROOT_CAUSE_CONSULTANT_NAME, root_cause_consultant_node))
+        self.builder.add_node(ENTITY_GRAPH_CONSULTANT_NAME,
+                              wrap(ENTITY_GRAPH_CONSULTANT_NAME, entity_graph_consultant_node))
+        self.builder.add_node(TOOL_INVOCATION_SUPERVISOR_NAME,
+                              wrap(TOOL_INVOCATION_SUPERVISOR_NAME, tool_invocation_supervisor_node))
         self.builder.set_entry_point(INPUT_CONSULTANT_NAME)
-        self.graph = (
-            self.builder
-            .compile(checkpointer=memory)
-            .with_config({
-                "configurable": {"thread_id": str(uuid.uuid4())}
-            })
-        )
-        self.state = AgentState(
+        # compilato una sola volta: ogni run usa un proprio thread del checkpointer
+        self.graph = self.builder.compile(checkpointer=self.memory)
+        self.initial_state = AgentState(
             topics=topics or set(),
             llm_supervisor=llm_call,
+            local_classifier_threshold=local_classifier_threshold,
+            direct_tool_dispatch=direct_tool_dispatch,
+            shadow=shadow,
+            prompt_token_budget=prompt_token_budget,
+            streaming=streaming,
+            stream_early_exit=stream_early_exit,
+            deferred_llm=deferred_llm,
+            service_graph_mode=service_graph_mode,
+            record_labels=record_labels,
             incident=None,
             token=None,
             directives=[],
@@ -50,20 +76,69 @@ class IncidentsGraph:
                 AgentRole.worker.value: []
             }
         )
+        self.state = self.initial_state
+        self._initial_values = self.initial_state.model_dump() if fast_state else None
 
-    def run(self, incident: Incident) -> AgentState:
-        state_dict = self.state.model_dump()
+    def run(self, incident: Incident, reused: SimilarAnalysis | None = None,
+            topics: set[str] | None = None) -> AgentState:
+        """
+        Analizza un incident partendo sempre dallo stato iniziale, così lo stesso grafo
+        compilato può essere riusato per più incident; `topics` aggiorna il vocabolario corrente.
+        """
+        if self.fast_state:
+            return self._run_fast(incident, reused, topics)
+        state_dict = self.initial_state.model_dump()
 
         invoke_input = {
         **state_dict,
-        "incident": incident
+        "topics": topics if topics is not None else state_dict["topics"],
+        "incident": incident,
+        "reused": reused
         }
 
-        new_state_dict = self.graph.invoke(invoke_input)
+        thread_id = str(uuid.uuid4())
+        try:
+            new_state_dict = self.graph.invoke(invoke_input, config={"configurable": {"thread_id": thread_id}})
+        finally:
+            # il checkpoint serve solo durante la run: rimuoverlo evita che la memoria cresca nel tempo
+            self.memory.delete_thread(thread_id)
 
         self.state = AgentState(**new_state_dict)
 
         return self.state
 
+    def step(self, thread_id: str, incident: Incident | None = None, topics: set[str] | None = None) -> AgentState:
+        """
+        Avvia (con `incident`) o riprende (senza) la run nel thread indicato, senza cancellarne il
+        checkpoint: se un nodo solleva un'eccezione la run si ferma all'ultimo nodo completato e la
+        chiamata successiva riparte da lì. Usato dai batch job differiti; il thread va rimosso a fine run.
+        """
+        config = {"configurable": {"thread_id": thread_id}}
+        if incident is None:
+            self.state = AgentState(**self.graph.invoke(None, config=config))
+            return self.state
+        state_dict = self.initial_state.model_dump()
+        invoke_input = {
+            **state_dict,
+            "topics": topics if topics is not None else state_dict["topics"],
+            "incident": incident,
+            "reused": None
+        }
+        self.state = AgentState(**self.graph.invoke(invoke_input, config=config))
+        return self.state
+
+    def _run_fast(self, incident: Incident, reused: SimilarAnalysis | None, topics: set[str] | None) -> AgentState:
+        invoke_input = {
+            **self._initial_values,
+            "topics": set(topics if topics is not None else self._initial_values["topics"]),
+            "nodes_logs": {role: [] for role in self._initial_values["nodes_logs"]},
+            "directives": [],
+            "incident": incident,
+            "reused": reused,
+        }
+        # unica validazione della run: lo stato finale torna un AgentState
+        self.state = AgentState(**self.graph.invoke(invoke_input))
+        return self.state
+
 if __name__ == "__main__":
     pass
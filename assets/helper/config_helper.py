@@ -8,30 +8,149 @@ from typing_extensions import Literal
 
 Style = Literal["simple", "table", "pretty"]
 DebugLevel = Literal["info","debug"]
+Mode = Literal["batch", "serve", "follow", "deferred"]
+BatchBackendName = Literal["local", "openai"]
+CassetteMode = Literal["off", "record", "replay"]
+ProfilingMode = Literal["off", "sampling", "cprofile"]
+ServiceGraphMode = Literal["off", "context", "direct"]
 
 class AppSettings(BaseModel):
+    mode: Mode = Field(default="batch", description="batch: processa n_items incident ed esce; serve: servizio HTTP a lunga vita; follow: segue un file JSONL in crescita; deferred: backfill a fasi tramite batch API")
     style: Style = Field(default="simple", description="Formato dell'output")
     folder: str = Field(default="runs", description="Cartella di destinazione")
     filename: Optional[str] = Field(default=None, description="Nome file; se assente usa timestamp")
     llm_call: bool = Field(default=False, description="Uso di llm nei nodi di supervisor")
     n_items: int = Field(default=50, description="Su quant oggetti eseguire la run. Se il numero è maggiore degli oggetti presenti, verrò usato il numero degli oggetti presenti")
     log_level: DebugLevel = Field(default="info", description="Regola la verbosità dei log")
+    async_logging: bool = Field(default=False, description="Scrittura dei log su stderr in un thread separato (sink accodato): i nodi non attendono l'I/O dei log")
+    log_payload_sample_rate: float = Field(default=1.0, ge=0, le=1, description="Frazione dei payload verbosi (output dell'LLM, directive dei worker) riportati nei log")
+    log_payload_sample_rates: Optional[Dict[str, float]] = Field(default=None, description="Frazione dei payload verbosi per nodo (es. root_cause_consultant: 0.1); i nodi non indicati usano log_payload_sample_rate")
+    raw_llm_log_dir: Optional[str] = Field(default=None, description="Se indicata, tutti gli output grezzi dell'LLM vengono scritti in questa cartella (relativa alla root del progetto) in un file compresso llm_outputs_<timestamp>_<pid>.log.gz, fuori dal campionamento")
+    log_overhead_measurement: bool = Field(default=False, description="Misura per nodo il tempo speso nei log (avvolge un metodo interno di loguru): solo per diagnosi, riportato nel riepilogo")
     model: str = Field(default="gpt-4o-mini", description="Il modello usato per le chiamate agli LLM")
     temperature: float = Field(default=0.5, description="La temperatura per la creatività dei modelli")
+    coalesce_window_minutes: int = Field(default=0, ge=0, description="Finestra (minuti) in cui incident con stesso service e descrizione vengono analizzati una sola volta. 0 disabilita il raggruppamento")
+    similarity_threshold: float = Field(default=0.0, ge=0, le=1, description="Similarità minima (MinHash) per riusare l'analisi di un incident già processato. 0 disabilita l'indice")
+    local_classifier_threshold: Optional[float] = Field(default=None, ge=0, le=1, description="Confidenza minima del classificatore locale (quota pesata delle feature dell'incident già viste in training, in [0,1]) per usarlo al posto dell'LLM nei consultant: 0 lo usa sempre, valori alti solo per incident simili a quelli di training. None lo disabilita")
+    direct_tool_dispatch: bool = Field(default=False, description="Invoca direttamente il worker tool selezionato, senza agent LLM")
+    shadow_sample_rate: float = Field(default=0.0, ge=0, le=1, description="Frazione di incident rieseguiti in background con il percorso LLM originale per misurare l'accordo con i percorsi veloci")
+    max_topics: int = Field(default=64, ge=1, description="Numero massimo di topic nel vocabolario condiviso (e quindi nei prompt); i meno usati vengono rimossi")
+    prompt_token_budget: int = Field(default=256, ge=0, description="Token massimi della description dell'incident nei prompt (0 = nessun troncamento)")
+    streaming: bool = Field(default=False, description="Riceve le risposte LLM in streaming, con parsing JSON incrementale e misura di time-to-first-token/time-to-decision")
+    stream_early_exit: bool = Field(default=False, description="In streaming, router e tool decider interrompono lo stream appena route/tool_name sono completi")
+    fast_state: bool = Field(default=False, description="Stato del grafo come dataclass con reducer append-only e senza checkpointer; validazione solo a inizio e fine run")
+    processes: int = Field(default=1, ge=1, description="Processi worker su cui distribuire gli incident in modalità batch (1 = nessun sharding)")
+    work_queue: Optional[str] = Field(default=None, description="File SQLite della coda di lavoro condivisa tra più runner (relativo alla root del progetto); None la disabilita")
+    work_queue_lease_size: int = Field(default=16, ge=1, description="Incident presi in lease dalla coda a ogni giro")
+    work_queue_visibility_timeout: float = Field(default=600.0, gt=0, description="Secondi dopo i quali un lease non completato torna disponibile ad altri runner")
+    work_queue_max_attempts: int = Field(default=3, ge=1, description="Tentativi per incident prima del dead-letter")
+    batch_job_dir: str = Field(default="runs/batch_job", description="Cartella con lo stato del batch job in modalità deferred (relativa alla root del progetto); rilanciando si riprende da lì")
+    batch_backend: BatchBackendName = Field(default="local", description="Backend delle batch API: local (stand-in con chiamate sincrone) o openai")
+    batch_poll_interval: float = Field(default=30.0, gt=0, description="Secondi tra due controlli dello stato di un batch")
+    batch_max_attempts: int = Field(default=3, ge=1, description="Batch in cui una richiesta fallita viene rinviata prima di abbandonare l'incident")
+    batch_local_delay: float = Field(default=0.0, ge=0, description="Secondi dopo i quali il backend local considera completato un batch")
+    worker_concurrency: Optional[Dict[str, int]] = Field(default=None, description="Azioni contemporanee per tool e per service (es. restart_worker: 2); i tool non indicati usano i default dell'esecutore")
+    worker_timeout_s: float = Field(default=30.0, gt=0, description="Secondi dopo i quali un'azione dei worker viene interrotta e registrata come timeout")
+    outbound_window_s: float = Field(default=2.0, gt=0, description="Ritardo massimo (secondi) con cui notifiche e work note vengono raggruppate per destinazione prima della chiamata bulk")
+    outbound_max_batch: int = Field(default=50, ge=1, description="Azioni oltre le quali un batch outbound viene inviato subito")
+    outbound_sink_path: str = Field(default="data/outbound.jsonl", description="File del sink outbound locale (una riga per chiamata bulk), relativo alla root del progetto")
+    cassette_mode: CassetteMode = Field(default="off", description="record: registra richieste, risposte, usage e latenza di ogni chiamata LLM; replay: le riproduce offline dalla cassette; off: chiamate normali")
+    cassette_path: str = Field(default="data/cassettes/llm.jsonl", description="File JSONL della cassette (relativo alla root del progetto); in record le chiamate vengono aggiunte in coda")
+    cassette_replay_latency: bool = Field(default=True, description="In replay attende la latenza registrata di ogni chiamata; False risponde subito")
+    worker_random_seed: Optional[int] = Field(default=None, description="Seed delle latenze simulate dei worker, per run ripetibili; None non le fissa")
+    profiling: ProfilingMode = Field(default="off", description="Profiling per nodo del grafo: sampling (stack campionati, fasi render/network/parse/log, stack collassati per flamegraph) o cprofile (in più profilo cProfile per nodo); off lo disabilita")
+    profiling_interval_ms: float = Field(default=5.0, gt=0, description="Intervallo di campionamento del profiler (millisecondi)")
+    profiling_dir: str = Field(default="runs/profile", description="Cartella dei profili (relativa alla root del progetto); ogni run scrive una sottocartella")
+    tracing_sample_rate: float = Field(default=0.0, ge=0.0, le=1.0, description="Frazione di incident tracciati in formato Chrome trace-event (nodi, chiamate LLM, tool, I/O su file; apribile con Perfetto); 0 disabilita il tracing")
+    tracing_dir: str = Field(default="runs/trace", description="Cartella delle tracce (relativa alla root del progetto); ogni processo scrive un file trace_<timestamp>_<pid>.json")
+    memory_profiling_every: int = Field(default=0, ge=0, description="Se > 0 attiva tracemalloc e registra uno snapshot con RSS ogni N incident (siti di allocazione cresciuti, byte trattenuti per incident, verifica di leak); 0 lo disabilita")
+    memory_profiling_dir: str = Field(default="runs/memory", description="Cartella dei report di memoria (relativa alla root del progetto); ogni run scrive una sottocartella")
+    memory_leak_bytes_per_incident: int = Field(default=1024, ge=0, description="Crescita per incident oltre la quale, se la memoria non raggiunge un plateau, viene segnalato un possibile leak")
+    service_graph_mode: ServiceGraphMode = Field(default="off", description="Uso del grafo delle dipendenze tra service nell'entity_graph_consultant. direct: topic strutturali dal grafo senza chiamata LLM (per i service presenti nel grafo); context: riassunto del grafo nel prompt; off: disabilitato")
+    service_graph_path: str = Field(default="data/service_graph.json", description="File JSON del grafo delle dipendenze tra service (relativo alla root del progetto)")
+    metrics_port: Optional[int] = Field(default=None, description="Se indicata, espone le metriche in formato Prometheus su http://127.0.0.1:<porta>/metrics (in modalità serve sono anche su GET /metrics)")
+    serve_host: str = Field(default="127.0.0.1", description="Indirizzo di ascolto in modalità serve")
+    serve_port: int = Field(default=8080, description="Porta di ascolto in modalità serve")
+    serve_unix_socket: Optional[str] = Field(default=None, description="Se indicato, il servizio ascolta su questo Unix socket invece che su TCP")
+    serve_queue_size: int = Field(default=64, ge=1, description="Job in coda oltre i quali le richieste vengono rifiutate con 503")
+    serve_wait_timeout: float = Field(default=120.0, gt=0, description="Secondi di attesa del risultato prima di rispondere 202 con l'id del job")
+    follow_path: str = Field(default="data/incidents.jsonl", description="File JSONL (un incident per riga) seguito in modalità follow; relativo alla root del progetto")
+    follow_checkpoint: Optional[str] = Field(default=None, description="File con offset confermato e id processati; se assente <follow_path>.offset")
+    follow_poll_interval: float = Field(default=1.0, gt=0, description="Secondi tra due controlli di nuove righe nel file")
+    follow_queue_size: int = Field(default=256, ge=1, description="Incident letti e non ancora processati oltre i quali la lettura si ferma")
+    follow_batch_size: int = Field(default=16, ge=1, description="Incident processati insieme (coalescing incluso) per ogni giro")
+    follow_summary_interval: float = Field(default=300.0, gt=0, description="Secondi tra due riepiloghi in modalità follow")
 
 
 PROJECT_ROOT = Path(__file__).resolve().parent.parent
 DEFAULT_CONFIG_PATH = PROJECT_ROOT.parent / "config.yaml"
 
 DEFAULT_CONFIG_CONTENT = {
+    "mode": "batch",
     "style": "simple",
     "folder": "runs",
     "filename": None,
     "llm_call": False,
     "n_items": 2,
     "log_level": "info",
+    "async_logging": False,
+    "log_payload_sample_rate": 1.0,
+    "log_payload_sample_rates": None,
+    "raw_llm_log_dir": None,
+    "log_overhead_measurement": False,
     "model": "gpt-4o-mini",
     "temperature": 0.5,
+    "coalesce_window_minutes": 0,
+    "similarity_threshold": 0.0,
+    "local_classifier_threshold": None,
+    "direct_tool_dispatch": False,
+    "shadow_sample_rate": 0.0,
+    "max_topics": 64,
+    "prompt_token_budget": 256,
+    "streaming": False,
+    "stream_early_exit": False,
+    "fast_state": False,
+    "processes": 1,
+    "work_queue": None,
+    "work_queue_lease_size": 16,
+    "work_queue_visibility_timeout": 600.0,
+    "work_queue_max_attempts": 3,
+    "batch_job_dir": "runs/batch_job",
+    "batch_backend": "local",
+    "batch_poll_interval": 30.0,
+    "batch_max_attempts": 3,
+    "batch_local_delay": 0.0,
+    "worker_concurrency": {"restart_worker": 2, "diagnostic_worker": 4, "notify_team": 64, "log_work_note": 64},
+    "worker_timeout_s": 30.0,
+    "outbound_window_s": 2.0,
+    "outbound_max_batch": 50,
+    "outbound_sink_path": "data/outbound.jsonl",
+    "cassette_mode": "off",
+    "cassette_path": "data/cassettes/llm.jsonl",
+    "cassette_replay_latency": True,
+    "worker_random_seed": None,
+    "profiling": "off",
+    "profiling_interval_ms": 5.0,
+    "profiling_dir": "runs/profile",
+    "tracing_sample_rate": 0.0,
+    "tracing_dir": "runs/trace",
+    "memory_profiling_every": 0,
+    "memory_profiling_dir": "runs/memory",
+    "memory_leak_bytes_per_incident": 1024,
+    "service_graph_mode": "off",
+    "service_graph_path": "data/service_graph.json",
+    "metrics_port": None,
+    "serve_host": "127.0.0.1",
+    "serve_port": 8080,
+    "serve_unix_socket": None,
+    "serve_queue_size": 64,
+    "serve_wait_timeout": 120.0,
+    "follow_path": "data/incidents.jsonl",
+    "follow_checkpoint": None,
+    "follow_poll_interval": 1.0,
+    "follow_queue_size": 256,
+    "follow_batch_size": 16,
+    "follow_summary_interval": 300.0,
 }
 
 def load_settings(path: Path = DEFAULT_CONFIG_PATH) -> AppSettings:
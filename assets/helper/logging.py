@@ -1,15 +1,14 @@
 from __future__ import annotations
 
+import functools
 import json
 import random
 import time
 from datetime import datetime
-from typing import Any, List, Dict
+from typing import Any, List, Dict, TYPE_CHECKING
 from tabulate import tabulate
-from langchain_community.callbacks import OpenAICallbackHandler
 from loguru import logger
 
-from assets.utils import save_run_to_file
 from assets.custom_obj import (
     AgentRole,
     AgentState,
@@ -17,9 +16,17 @@ from assets.custom_obj import (
     ConsultantLog,
     SupervisorLog,
     WorkerLog,
+    ShadowLog,
     Processed_Logs,
+    merge_nodes_logs,
 )
 from assets.helper.config_helper import AppSettings
+from assets.log_setup import node_logging_ms
+from assets.metrics import get_metrics
+from assets.vocabulary import get_vocabulary
+
+if TYPE_CHECKING:
+    from langchain_community.callbacks import OpenAICallbackHandler
 
 
 def worker_log_factory(
@@ -31,9 +38,10 @@ def worker_log_factory(
     directive_id: str,
     action: str,
     success: str,
-    timestamp: datetime
+    timestamp: datetime,
+    batch_id: str | None = None
 ) -> WorkerLog:
-    return WorkerLog(
+    return _observe(AgentRole.worker.value, None, WorkerLog(
         node_name=node_name,
         processing_time=processing_time,
         token_usage=token_usage,
@@ -42,10 +50,19 @@ def worker_log_factory(
         directive_id=directive_id,
         action=action,
         success=success,
-        timestamp=timestamp
-    )
+        timestamp=timestamp,
+        batch_id=batch_id
+    ))
 
-def add_log_to_state(
+
+def _observe(agent_role: str, state: AgentState | None, log: BaseLog) -> BaseLog:
+    """Passa il log alle metriche di processo, se attive."""
+    metrics = get_metrics()
+    if metrics is not None:
+        metrics.observe_log(agent_role, log, state.model if state is not None else None)
+    return log
+
+def create_node_log(
         agent_name: str,
         agent_role: str,
         state: AgentState|None,
@@ -53,28 +70,40 @@ def add_log_to_state(
         llm_count: bool,
         llm_callback: OpenAICallbackHandler|None,
         **role_specific_info:Any
-) -> AgentState | WorkerLog | None:
-    logger.debug(f"Adding {agent_name} log to state")
+) -> BaseLog | None:
+    """
+    Crea il log del nodo senza modificare lo stato: i nodi lo restituiscono nel loro update
+    (`{"nodes_logs": {ruolo: [log]}}`) e il reducer di nodes_logs lo accoda.
+    """
+    logger.debug(f"Creating {agent_name} log")
+    # stream interrotto alla decisione: token e costo arrivano al callback a fine lettura in background
+    pending = role_specific_info.get("usage_pending")
     log = BaseLog(
         node_name=agent_name,
         processing_time=round((time.perf_counter() - start_time) * 1000),
         token_usage=llm_callback.total_tokens if llm_callback else 0,
         total_cost=llm_callback.total_cost if llm_callback else 0,
         llm_count=llm_callback.successful_requests if llm_count else 0,
+        prompt_tokens=role_specific_info.get("prompt_tokens", 0),
+        prompt_tokens_saved=role_specific_info.get("prompt_tokens_saved", 0),
+        ttft_ms=role_specific_info.get("ttft_ms"),
+        decision_ms=role_specific_info.get("decision_ms"),
+        usage_estimated=role_specific_info.get("usage_estimated", False),
+        logging_ms=node_logging_ms(),
     )
     match agent_role:
         case AgentRole.consultant.value:
-            consultant_log = ConsultantLog(
+            node_log = ConsultantLog(
                 **log.model_dump(),
                 token_id=state.token.id,
                 topic_extracted=state.token.topics.keys(),
-                input_length=len(state.token.content)
+                input_length=len(state.token.content),
+                topic_source=role_specific_info.get("topic_source", "llm"),
+                prompt_topics_chars=role_specific_info.get("prompt_topics_chars", 0)
             )
-            state.nodes_logs[AgentRole.consultant.value].append(consultant_log)
-            logger.debug("Consultant log added successfully")
-            return state
+            logger.debug("Consultant log created successfully")
         case AgentRole.supervisor.value:
-            supervisor_log = SupervisorLog(
+            node_log = SupervisorLog(
                 **log.model_dump(),
                 actions=[directive.action for directive in state.directives],
                 reasons=[directive.metadata['directive_reason'] for directive in state.directives],
@@ -82,13 +111,11 @@ def add_log_to_state(
                 directive_generated=len(state.directives),
                 timestamp=datetime.now()
             )
-            state.nodes_logs[AgentRole.supervisor.value].append(supervisor_log)
-            logger.debug("Supervisor log added successfully")
-            return state
+            logger.debug("Supervisor log created successfully")
         case AgentRole.worker.value:
             data = log.model_dump()
             data.pop("processing_time", None)
-            worker_log = WorkerLog(
+            node_log = WorkerLog(
                 **data,
                 processing_time=random.randint(50, 200),
                 directive_id=role_specific_info['directive_id'],
@@ -96,11 +123,47 @@ def add_log_to_state(
                 success="ok",
                 timestamp=datetime.now()
             )
-            #state.nodes_logs[AgentRole.worker.value].append(worker_log)
             logger.info("Worker log successfully created")
-            return worker_log
         case _:
-            pass
+            return None
+    if pending is not None:
+        # il nodo non attende la lettura: il log (e le metriche) si completano quando l'usage arriva
+        pending.add_done_callback(functools.partial(_complete_usage, agent_role, state, node_log,
+                                                    llm_callback, llm_count))
+        return node_log
+    return _observe(agent_role, state, node_log)
+
+
+def _complete_usage(agent_role: str, state: AgentState | None, log: BaseLog,
+                    llm_callback: OpenAICallbackHandler | None, llm_count: bool, pending) -> None:
+    """Riporta nel log token, costo e chiamate letti dal callback a fine stream."""
+    if pending.exception() is not None:
+        logger.error(f"{log.node_name}: background stream read failed: {pending.exception()}")
+    else:
+        log.usage_estimated = pending.result()
+    if llm_callback is not None:
+        log.token_usage = llm_callback.total_tokens
+        log.total_cost = llm_callback.total_cost
+        if llm_count:
+            log.llm_count = llm_callback.successful_requests
+    _observe(agent_role, state, log)
+
+
+def add_log_to_state(
+        agent_name: str,
+        agent_role: str,
+        state: AgentState|None,
+        start_time: float,
+        llm_count: bool,
+        llm_callback: OpenAICallbackHandler|None,
+        **role_specific_info:Any
+) -> AgentState | WorkerLog | None:
+    """Come create_node_log, ma accoda il log a state.nodes_logs (senza modificare le liste esistenti)."""
+    log = create_node_log(agent_name, agent_role, state, start_time, llm_count, llm_callback, **role_specific_info)
+    if agent_role == AgentRole.worker.value or log is None:
+        return log
+    state.nodes_logs = merge_nodes_logs(state.nodes_logs, {agent_role: [log]})
+    return state
 
 def log_processing(logs: List[Dict[str, Dict[str, List[BaseLog]]]]) -> Processed_Logs:
     logger.debug("Entering the log processing function")
@@ -109,12 +172,41 @@ def log_processing(logs: List[Dict[str, Dict[str, List[BaseLog]]]]) -> Processed
     total_time = 0
     total_success = 0
     total_items = 0
+    shadow_logs: List[ShadowLog] = []
+    prompt_topics_chars: List[int] = []
+    prompt_tokens = 0
+    tokens_saved_by_node: Dict[str, int] = {}
+    ttft_by_node: Dict[str, List[int]] = {}
+    decision_by_node: Dict[str, List[int]] = {}
+    estimated_usage_calls = 0
+    logging_by_node: Dict[str, List[float]] = {}  # nodo -> [ms nei log, ms del nodo]
     # Per ogni incident
     for i, log in enumerate(logs):
         log_value = log[f'Inc{i}']
         logger.debug(log_value)
         for role, entries in log_value.items():
+            if role == AgentRole.shadow.value:
+                # i run shadow sono fuori dal percorso critico: aggregati a parte
+                shadow_logs.extend(entries)
+                continue
             for entry in entries:
+                if isinstance(entry, ConsultantLog) and entry.prompt_topics_chars:
+                    prompt_topics_chars.append(entry.prompt_topics_chars)
+                prompt_tokens += entry.prompt_tokens
+                if entry.prompt_tokens_saved:
+                    tokens_saved_by_node[entry.node_name] = (
+                        tokens_saved_by_node.get(entry.node_name, 0) + entry.prompt_tokens_saved
+                    )
+                if entry.ttft_ms is not None:
+                    ttft_by_node.setdefault(entry.node_name, []).append(entry.ttft_ms)
+                if entry.decision_ms is not None:
+                    decision_by_node.setdefault(entry.node_name, []).append(entry.decision_ms)
+                if entry.usage_estimated:
+                    estimated_usage_calls += entry.llm_count
+                if entry.logging_ms is not None:
+                    times = logging_by_node.setdefault(entry.node_name, [0.0, 0.0])
+                    times[0] += entry.logging_ms
+                    times[1] += entry.processing_time
                 final_cost += entry.total_cost
                 total_llm_calls += entry.llm_count
                 total_time += entry.processing_time
@@ -134,8 +226,66 @@ def log_processing(logs: List[Dict[str, Dict[str, List[BaseLog]]]]) -> Processed
         total_success_rate=total_success_rate,
         throughput_per_min=throughput_per_min
     )
+    if prompt_topics_chars:
+        processed_logs.avg_prompt_topics_chars = sum(prompt_topics_chars) / len(prompt_topics_chars)
+        processed_logs.max_prompt_topics_chars = max(prompt_topics_chars)
+    processed_logs.vocabulary_size = get_vocabulary().stats()["size"]
+    if prompt_tokens:
+        processed_logs.prompt_tokens = prompt_tokens
+        processed_logs.prompt_tokens_saved = tokens_saved_by_node
+    processed_logs.avg_ttft_ms = {node: sum(v) / len(v) for node, v in ttft_by_node.items()}
+    processed_logs.avg_decision_ms = {node: sum(v) / len(v) for node, v in decision_by_node.items()}
+    processed_logs.estimated_usage_calls = estimated_usage_calls
+    node_time = sum(total for _, total in logging_by_node.values())
+    if node_time:
+        processed_logs.logging_overhead_pct = sum(ms for ms, _ in logging_by_node.values()) / node_time * 100
+        processed_logs.logging_overhead_pct_by_node = {node: ms / total * 100
+                                                       for node, (ms, total) in logging_by_node.items() if total}
+    if shadow_logs:
+        n = len(shadow_logs)
+        processed_logs.shadow_samples = n
+        processed_logs.shadow_route_agreement = sum(e.route_match for e in shadow_logs) / n * 100
+        processed_logs.shadow_tool_agreement = sum(e.tool_match for e in shadow_logs) / n * 100
+        processed_logs.shadow_topic_overlap = sum(e.topic_overlap for e in shadow_logs) / n
+        processed_logs.shadow_cost = sum(e.total_cost for e in shadow_logs)
     return processed_logs
 
+def extra_summary_rows(logs: Processed_Logs) -> List[List[Any]]:
+    """Righe aggiuntive del riepilogo, presenti solo se la relativa funzionalità è attiva."""
+    rows: List[List[Any]] = []
+    if logs.vocabulary_size is not None:
+        rows.append(["Topic vocabulary size", logs.vocabulary_size])
+    if logs.avg_prompt_topics_chars is not None:
+        rows += [
+            ["Topics in prompt (avg chars)", f"{logs.avg_prompt_topics_chars:.0f}"],
+            ["Topics in prompt (max chars)", logs.max_prompt_topics_chars],
+        ]
+    if logs.prompt_tokens is not None:
+        rows += [
+            ["Prompt tokens (local count)", logs.prompt_tokens],
+            ["Prompt tokens saved", sum(logs.prompt_tokens_saved.values())],
+        ]
+        rows += [[f"  saved by {node}", saved] for node, saved in sorted(logs.prompt_tokens_saved.items())]
+    for node, ttft in sorted(logs.avg_ttft_ms.items()):
+        rows.append([f"Avg time to first token {node} (ms)", f"{ttft:.0f}"])
+    for node, decision in sorted(logs.avg_decision_ms.items()):
+        rows.append([f"Avg time to decision {node} (ms)", f"{decision:.0f}"])
+    if logs.estimated_usage_calls:
+        rows.append(["LLM calls with estimated usage", logs.estimated_usage_calls])
+    if logs.logging_overhead_pct is not None:
+        rows.append(["Logging overhead (% of node time)", f"{logs.logging_overhead_pct:.2f}"])
+        rows += [[f"  logging in {node} (%)", f"{pct:.2f}"]
+                 for node, pct in sorted(logs.logging_overhead_pct_by_node.items())]
+    if logs.shadow_samples:
+        rows += [
+            ["Shadow samples", logs.shadow_samples],
+            ["Shadow route agreement (%)", f"{logs.shadow_route_agreement:.2f}"],
+            ["Shadow tool agreement (%)", f"{logs.shadow_tool_agreement:.2f}"],
+            ["Shadow topic overlap", f"{logs.shadow_topic_overlap:.2f}"],
+            ["Shadow cost", f"{logs.shadow_cost:.10f}"],
+        ]
+    return rows
+
 def print_summary(logs: Processed_Logs, settings: AppSettings) -> None:
     """
     Stampa un riepilogo dei log processati in diversi formati usando loguru.
@@ -149,6 +299,8 @@ def print_summary(logs: Processed_Logs, settings: AppSettings) -> None:
                - "pretty" : tabella con tabulate (richiede libreria esterna)
     """
 
+    extra_rows = extra_summary_rows(logs)
+    extra_width = max((len(str(label)) + 2 for label, _ in extra_rows), default=0)
     if settings.style == "simple":
         output = (
             "=== Processing Summary ===\n"
@@ -158,6 +310,7 @@ def print_summary(logs: Processed_Logs, settings: AppSettings) -> None:
             f"Total processed items:      {logs.total_items}\n"
             f"Total success rate:         {logs.total_success_rate:.2f}%\n"
             f"Items processed per minute: {logs.throughput_per_min:.2f}\n"
+            + "".join(f"{label + ':':{max(28, extra_width)}}{value}\n" for label, value in extra_rows) +
             "===========================\n"
         )
     elif settings.style == "table":
@@ -169,6 +322,7 @@ def print_summary(logs: Processed_Logs, settings: AppSettings) -> None:
             f"{'Processed items:':25}{logs.total_items}\n"
             f"{'Success rate (%):':25}{logs.total_success_rate:.2f}\n"
             f"{'Throughput (items/min):':25}{logs.throughput_per_min:.2f}\n"
+            + "".join(f"{label + ':':{max(25, extra_width)}}{value}\n" for label, value in extra_rows) +
             "===========================\n"
         )
     elif settings.style == "pretty":
@@ -178,7 +332,8 @@ def print_summary(logs: Processed_Logs, settings: AppSettings) -> None:
             ["Execution time (ms)", logs.total_time],
             ["Processed items", logs.total_items],
             ["Success rate (%)", f"{logs.total_success_rate:.2f}"],
-            ["Throughput (items/min)", f"{logs.throughput_per_min:.2f}"]
+            ["Throughput (items/min)", f"{logs.throughput_per_min:.2f}"],
+            *extra_rows
         ]
         output = tabulate(summary, headers=["Metric", "Value"], tablefmt="pretty")
     else:
@@ -186,6 +341,9 @@ def print_summary(logs: Processed_Logs, settings: AppSettings) -> None:
 
     report = compose_final_report(settings, output)
 
+    # Import locale: assets.utils importa le costanti di assets.helper
+    from assets.utils import save_run_to_file
+
     path = save_run_to_file(report, settings.folder, settings.filename)
     log_str = "*"*30 + " INC ANALYSIS TERMINATED " + "*"*30
     logger.info(log_str)
@@ -0,0 +1,151 @@
+"""
+Configurazione dei log di processo (main, shard worker): sink su stderr, payload verbosi
+campionati, output grezzi dell'LLM su un file compresso a parte e misura del costo dei log.
+
+- async_logging: il sink su stderr è accodato (`enqueue`): il thread del nodo formatta il
+  messaggio e lo mette in coda, la scrittura avviene in un thread di loguru;
+- payload verbosi (output dell'LLM, directive dei worker) registrati con `log_payload` /
+  `log_llm_output`: formattati solo se emessi e campionati per nodo (`payload_sample_rate`,
+  con eccezioni per nodo in `payload_sample_rates`);
+- raw_llm_log_dir: ogni output dell'LLM, completo, finisce in
+  `<dir>/llm_outputs_<timestamp>_<pid>.log.gz` (sink accodato), non su stderr;
+- log_overhead_measurement: il tempo passato dai thread dei nodi dentro loguru viene misurato per
+  nodo (BaseLog.logging_ms) e il riepilogo ne riporta la quota sul tempo dei nodi. Richiede di
+  avvolgere un metodo interno di loguru, per questo è attiva solo su richiesta (diagnosi).
+"""
+import functools
+import gzip
+import os
+import random
+import sys
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+from loguru import logger
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+
+_payload_sample_rate = 1.0
+_payload_sample_rates: Dict[str, float] = {}
+_raw_sink_active = False
+_timing = threading.local()  # ms spesi nei log dal thread corrente, dall'inizio del nodo
+_timer_installed = False
+
+
+class GzipSink:
+    """Sink loguru su un file gzip, aperto alla prima scrittura e chiuso alla rimozione del sink."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._file = None
+
+    def write(self, message: str) -> None:
+        if self._file is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._file = gzip.open(self.path, "at", encoding="utf-8")
+        self._file.write(message)
+
+    def stop(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def _install_timer() -> None:
+    """
+    Misura il tempo di ogni chiamata a loguru nel thread chiamante (controllo del livello,
+    formattazione, scrittura o accodamento) avvolgendo Logger._log, il punto d'ingresso comune a
+    logger.info/warning/...; la profondità dello stack viene corretta, così il record riporta
+    ancora il chiamante.
+    """
+    global _timer_installed
+    if _timer_installed:
+        return
+    from loguru._logger import Logger
+
+    original = Logger._log
+
+    @functools.wraps(original)
+    def timed_log(self, level, from_decorator, options, message, args, kwargs):
+        exception, depth, *rest = options
+        start = time.perf_counter()
+        try:
+            return original(self, level, from_decorator, (exception, depth + 1, *rest), message, args, kwargs)
+        finally:
+            _timing.ms = getattr(_timing, "ms", 0.0) + (time.perf_counter() - start) * 1000
+
+    Logger._log = timed_log
+    _timer_installed = True
+
+
+def configure_logging(level: str = "info", async_logging: bool = False, payload_sample_rate: float = 1.0,
+                      payload_sample_rates: Optional[Dict[str, float]] = None,
+                      raw_llm_log_dir: Optional[str] = None, measure_overhead: bool = False) -> None:
+    """Sostituisce i sink di loguru secondo le opzioni (vedi logging_options)."""
+    global _payload_sample_rate, _payload_sample_rates, _raw_sink_active
+    _payload_sample_rate = payload_sample_rate
+    _payload_sample_rates = dict(payload_sample_rates or {})
+    _raw_sink_active = bool(raw_llm_log_dir)
+    logger.remove()
+    logger.add(sys.stderr, level=level.upper(), enqueue=async_logging,
+               filter=lambda record: "raw_llm" not in record["extra"])
+    if raw_llm_log_dir:
+        location = Path(raw_llm_log_dir)
+        location = location if location.is_absolute() else PROJECT_ROOT / location
+        path = location / f"llm_outputs_{datetime.now():%Y%m%d_%H%M%S}_{os.getpid()}.log.gz"
+        logger.add(GzipSink(path), level="INFO", enqueue=True, filter=lambda record: "raw_llm" in record["extra"],
+                   format="{time:YYYY-MM-DD HH:mm:ss.SSS} | {extra[node]} | {message}")
+    if measure_overhead:
+        _install_timer()
+
+
+def logging_options(settings) -> Dict[str, Any]:
+    """Argomenti di configure_logging dalle impostazioni (passati anche agli shard worker)."""
+    return dict(level=settings.log_level, async_logging=settings.async_logging,
+                payload_sample_rate=settings.log_payload_sample_rate,
+                payload_sample_rates=settings.log_payload_sample_rates,
+                raw_llm_log_dir=settings.raw_llm_log_dir, measure_overhead=settings.log_overhead_measurement)
+
+
+def _sampled(node: str) -> bool:
+    rate = _payload_sample_rates.get(node, _payload_sample_rate)
+    return rate >= 1.0 or (rate > 0 and random.random() < rate)
+
+
+def log_payload(node: str, prefix: str, payload: Any) -> None:
+    """Log INFO di un payload verboso, campionato per nodo; `payload` è convertito in stringa solo se emesso."""
+    if _sampled(node):
+        logger.opt(depth=1).info("{}{}", prefix, payload)
+
+
+def log_llm_output(node: str, prefix: str, output: Any) -> None:
+    """Come log_payload; in più l'output completo va nel sink compresso degli output LLM, se attivo."""
+    if _raw_sink_active:
+        logger.bind(raw_llm=True, node=node).opt(depth=1).info("{}", output)
+    if _sampled(node):
+        logger.opt(depth=1).info("{}{}", prefix, output)
+
+
+def measure_node_logging(name: str, node: Callable) -> Callable:
+    """Avvolge un nodo del grafo: azzera il tempo di log del thread all'ingresso (letto da node_logging_ms)."""
+
+    @functools.wraps(node)
+    def measured_node(*args, **kwargs):
+        _timing.ms = 0.0
+        return node(*args, **kwargs)
+
+    return measured_node
+
+
+def logging_timer_enabled() -> bool:
+    return _timer_installed
+
+
+def node_logging_ms() -> Optional[float]:
+    """Ms spesi nei log dal nodo in esecuzione nel thread corrente; None se la misura non è attiva."""
+    if not _timer_installed:
+        return None
+    return round(getattr(_timing, "ms", 0.0), 3)
@@ -0,0 +1,220 @@
+"""
+Profiling della memoria su run lunghe (`memory_profiling_every` > 0): con tracemalloc attivo,
+ogni N incident processati viene preso uno snapshot delle allocazioni insieme a RSS e memoria
+tracciata, per capire quali strutture crescono (checkpoint di MemorySaver, log accumulati,
+messaggi di log, oggetti pydantic dei nodi, ...).
+
+A ogni checkpoint (dopo un gc.collect) il log riporta RSS, memoria tracciata e byte trattenuti
+per incident dall'ultimo checkpoint. La crescita è sospetta (`leak`) se negli ultimi intervalli
+la memoria tracciata cresce sempre e di più di `leak_bytes_per_incident` per incident, cioè se
+non raggiunge un plateau dopo il riscaldamento delle cache.
+
+A `write()` (chiamato alla chiusura dell'IncidentProcessor) in `output_dir/<timestamp>_<pid>/`:
+memory.json (campioni, byte per incident, siti di allocazione cresciuti dal primo snapshot,
+esito della verifica), memory.txt (lo stesso in forma leggibile) e il primo e l'ultimo snapshot
+(first.snapshot, last.snapshot). Ogni sito è attribuito alla riga che alloca e al chiamante più
+interno nel codice del progetto. Il primo checkpoint (dopo N incident) fa da riferimento: la
+memoria allocata nel riscaldamento (import, client, cache) non viene contata come crescita.
+"""
+import functools
+import gc
+import json
+import os
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List
+
+from loguru import logger
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+_PROJECT_PREFIX = str(PROJECT_ROOT) + os.sep
+DEFAULT_MEMORY_DIR = "runs/memory"
+TRACEBACK_FRAMES = 15
+TOP_SITES = 20
+LEAK_WINDOW = 3  # intervalli finali considerati per la verifica del plateau
+
+# siti esclusi dal report (filtrati sulle statistiche e non sugli snapshot: filter_traces costa secondi)
+_IGNORED_SITES = (tracemalloc.__file__, __file__, "<frozen importlib._bootstrap>",
+                  "<frozen importlib._bootstrap_external>", "<unknown>")
+
+
+def current_rss_bytes() -> int:
+    """RSS attuale (/proc su Linux); altrove il picco da getrusage."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss if sys.platform == "darwin" else rss * 1024
+
+
+@functools.lru_cache(maxsize=None)
+def _project_file(filename: str) -> str | None:
+    """Percorso relativo al progetto di `filename`, None se è fuori dal progetto o in site-packages."""
+    if not filename.startswith(_PROJECT_PREFIX) or "site-packages" in filename:
+        return None
+    return filename[len(_PROJECT_PREFIX):]
+
+
+def _project_caller(traceback: tracemalloc.Traceback) -> str | None:
+    # frame dal più vecchio al più recente: il chiamante più interno del progetto (fuori da site-packages)
+    for frame in reversed(traceback):
+        relative = _project_file(frame.filename)
+        if relative is not None:
+            return f"{relative}:{frame.lineno}"
+    return None
+
+
+class MemoryProfiler:
+    def __init__(self, every: int, output_dir: Path, leak_bytes_per_incident: int = 1024):
+        self.every = every
+        self.output_dir = output_dir
+        self.leak_bytes_per_incident = leak_bytes_per_incident
+        self._lock = threading.Lock()
+        self._processed = 0
+        self._next_checkpoint = every
+        self._samples: List[Dict[str, Any]] = []
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEBACK_FRAMES)
+        self._first: tracemalloc.Snapshot | None = None
+        self._last: tracemalloc.Snapshot | None = None
+
+    def incident_done(self, count: int = 1) -> None:
+        """Conta gli incident processati; ogni `every` incident prende un checkpoint."""
+        with self._lock:
+            self._processed += count
+            if self._processed < self._next_checkpoint:
+                return
+            self._next_checkpoint = self._processed + self.every
+            self._checkpoint()
+
+    def _checkpoint(self) -> None:
+        start = time.perf_counter()
+        gc.collect()
+        snapshot = tracemalloc.take_snapshot()
+        traced, peak = tracemalloc.get_traced_memory()
+        sample = {"incidents": self._processed, "rss_bytes": current_rss_bytes(), "traced_bytes": traced,
+                  "traced_peak_bytes": peak}
+        previous = self._samples[-1] if self._samples else None
+        self._samples.append(sample)
+        if self._first is None:
+            self._first = snapshot
+        self._last = snapshot
+        if previous is not None:
+            delta = (traced - previous["traced_bytes"]) / (self._processed - previous["incidents"])
+            logger.info(f"Memory after {self._processed} incidents: RSS {sample['rss_bytes'] / 2 ** 20:.1f} MB, "
+                        f"traced {traced / 2 ** 20:.1f} MB ({delta:+.0f} B/incident), "
+                        f"checkpoint {(time.perf_counter() - start) * 1000:.0f} ms")
+            if self.leak_suspected():
+                logger.warning(f"Memory keeps growing after {self._processed} incidents "
+                               f"({self.bytes_per_incident(LEAK_WINDOW):.0f} B/incident retained): possible leak")
+
+    def bytes_per_incident(self, intervals: int | None = None) -> float:
+        """Memoria tracciata trattenuta per incident, dal primo checkpoint o sugli ultimi `intervals`."""
+        samples = self._samples if intervals is None else self._samples[-(intervals + 1):]
+        if len(samples) < 2 or samples[-1]["incidents"] == samples[0]["incidents"]:
+            return 0.0
+        return (samples[-1]["traced_bytes"] - samples[0]["traced_bytes"]) / \
+            (samples[-1]["incidents"] - samples[0]["incidents"])
+
+    def leak_suspected(self) -> bool:
+        """True se negli ultimi LEAK_WINDOW intervalli la memoria cresce sempre, oltre la soglia per incident."""
+        window = self._samples[-(LEAK_WINDOW + 1):]
+        if len(window) < LEAK_WINDOW + 1:
+            return False
+        always_growing = all(b["traced_bytes"] > a["traced_bytes"] for a, b in zip(window, window[1:]))
+        return always_growing and self.bytes_per_incident(LEAK_WINDOW) > self.leak_bytes_per_incident
+
+    def growth_sites(self, top: int = TOP_SITES) -> List[Dict[str, Any]]:
+        """Siti di allocazione con la crescita maggiore tra il primo e l'ultimo snapshot."""
+        if self._first is None or self._last is self._first:
+            return []
+        incidents = max(self._processed - self._samples[0]["incidents"], 1)
+        # prima i siti (ultima riga del traceback), poi il chiamante del progetto solo per i `top` siti
+        # cresciuti di più: tracebacks diversi con la stessa riga e lo stesso chiamante vengono sommati
+        by_site: Dict[str, List[Any]] = {}
+        for stat in self._last.compare_to(self._first, "traceback"):
+            frame = stat.traceback[-1]
+            if frame.filename in _IGNORED_SITES:
+                continue
+            entry = by_site.setdefault(f"{frame.filename}:{frame.lineno}", [0, []])
+            entry[0] += stat.size_diff
+            entry[1].append(stat)
+        top_sites = sorted(by_site.items(), key=lambda item: item[1][0], reverse=True)[:top]
+        grouped: Dict[tuple, List[int]] = {}
+        for site, (_, stats) in top_sites:
+            for stat in stats:
+                diff = grouped.setdefault((site, _project_caller(stat.traceback)), [0, 0])
+                diff[0] += stat.size_diff
+                diff[1] += stat.count_diff
+        ranked = sorted(grouped.items(), key=lambda item: item[1][0], reverse=True)[:top]
+        return [{"site": site, "project_caller": caller, "size_diff_bytes": size, "count_diff": count,
+                 "bytes_per_incident": round(size / incidents, 1)}
+                for (site, caller), (size, count) in ranked if size > 0]
+
+    def report(self) -> Dict[str, Any]:
+        with self._lock:
+            if not self._samples or self._samples[-1]["incidents"] != self._processed:
+                self._checkpoint()
+            return {
+                "every": self.every,
+                "incidents": self._processed,
+                "samples": list(self._samples),
+                "bytes_per_incident": round(self.bytes_per_incident(), 1),
+                "recent_bytes_per_incident": round(self.bytes_per_incident(LEAK_WINDOW), 1),
+                "leak_threshold_bytes_per_incident": self.leak_bytes_per_incident,
+                "leak_suspected": self.leak_suspected(),
+                "growth_sites": self.growth_sites(),
+            }
+
+    def write(self) -> Path:
+        """Scrive il report della memoria (con un checkpoint finale); restituisce la cartella."""
+        report = self.report()
+        directory = self.output_dir / f"{datetime.now():%Y%m%d_%H%M%S}_{os.getpid()}"
+        directory.mkdir(parents=True, exist_ok=True)
+        (directory / "memory.json").write_text(json.dumps(report, indent=2), encoding="utf-8")
+        # snapshot completi per l'analisi offline (tracemalloc.Snapshot.load)
+        self._first.dump(str(directory / "first.snapshot"))
+        self._last.dump(str(directory / "last.snapshot"))
+
+        lines = [f"{'incidents':>10} {'RSS MB':>9} {'traced MB':>10} {'peak MB':>9}"]
+        for s in report["samples"]:
+            lines.append(f"{s['incidents']:10} {s['rss_bytes'] / 2 ** 20:9.1f} {s['traced_bytes'] / 2 ** 20:10.2f} "
+                         f"{s['traced_peak_bytes'] / 2 ** 20:9.2f}")
+        lines += ["", f"Retained per incident: {report['bytes_per_incident']:.0f} B overall, "
+                      f"{report['recent_bytes_per_incident']:.0f} B in the last {LEAK_WINDOW} intervals "
+                      f"-> {'POSSIBLE LEAK' if report['leak_suspected'] else 'no leak detected'}",
+                  "", f"{'B/incident':>11} {'KB':>9} {'blocks':>8}  site (project caller)"]
+        for site in report["growth_sites"]:
+            caller = f" ({site['project_caller']})" if site["project_caller"] else ""
+            lines.append(f"{site['bytes_per_incident']:11.0f} {site['size_diff_bytes'] / 1024:9.1f} "
+                         f"{site['count_diff']:8}  {site['site']}{caller}")
+        (directory / "memory.txt").write_text("\n".join(lines) + "\n", encoding="utf-8")
+        logger.info(f"Memory report written to {directory}")
+        return directory
+
+
+_memory_profiler: MemoryProfiler | None = None
+_memory_profiler_lock = threading.Lock()
+
+
+def get_memory_profiler(every: int | None = None, output_dir: str | None = None,
+                        leak_bytes_per_incident: int | None = None) -> MemoryProfiler | None:
+    """
+    Profiler della memoria di processo: con `every` > 0 lo attiva se non lo è già; senza
+    argomenti restituisce quello attivo (None se il profiling della memoria è spento).
+    """
+    global _memory_profiler
+    with _memory_profiler_lock:
+        if not every:
+            return _memory_profiler
+        if _memory_profiler is None:
+            location = Path(output_dir or DEFAULT_MEMORY_DIR)
+            location = location if location.is_absolute() else PROJECT_ROOT / location
+            _memory_profiler = MemoryProfiler(every, location, leak_bytes_per_incident or 1024)
+        return _memory_profiler
@@ -0,0 +1,215 @@
+"""
+Metriche in-process in formato testo Prometheus, per la visibilità in produzione (il riepilogo
+di print_summary arriva solo a fine run).
+
+Il registry è attivo solo se richiesto (`metrics_port` o modalità serve): create_node_log e
+worker_log_factory gli passano ogni log di nodo (gli stessi dati di add_log_to_state), con un
+costo di qualche incremento sotto lock. Le profondità delle code sono gauge calcolati solo al
+momento dello scrape.
+
+Metriche:
+- incident_node_latency_seconds{node}                    istogramma della latenza dei nodi
+- incident_llm_calls_total / incident_llm_tokens_total /
+  incident_llm_cost_usd_total{node,model}                chiamate, token e costo LLM
+- incident_topic_source_total{node,source}               topic da llm, reused (indice di similarità), local
+                                                         (classificatore) o graph (grafo dei service)
+- incident_cache_hit_ratio{node}                         quota di topic non chiesti all'LLM
+- incident_worker_actions_total{tool,success}            esiti delle azioni dei worker
+- incident_processed_total, incident_in_flight           incident completati e in analisi
+- incident_queue_depth{queue}                            job in coda (serve), azioni dei worker in corso,
+                                                         azioni nel buffer outbound
+
+Esposte su GET /metrics del servizio e, con `metrics_port`, da un server HTTP locale dedicato
+(127.0.0.1) utile nelle modalità batch e follow.
+"""
+import bisect
+import threading
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Tuple
+
+from loguru import logger
+
+from assets.custom_obj import AgentRole, BaseLog, ConsultantLog, WorkerLog
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Labels, le: str | None = None) -> str:
+    parts = [f'{k}="{_escape(v)}"' for k, v in labels] + ([f'le="{le}"'] if le is not None else [])
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class MetricsRegistry:
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._help: Dict[str, Tuple[str, str]] = {}  # nome -> (tipo, descrizione)
+        self._values: Dict[str, Dict[Labels, float]] = {}
+        self._histograms: Dict[str, Dict[Labels, List[float]]] = {}  # conteggi per bucket + [oltre l'ultimo bucket, somma, count]
+        self._callbacks: Dict[str, List[Tuple[Labels, Callable[[], float]]]] = {}
+
+    def _declare(self, name: str, kind: str, help_text: str) -> None:
+        if name not in self._help:
+            self._help[name] = (kind, help_text)
+
+    def inc(self, name: str, help_text: str, value: float = 1.0, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._declare(name, "counter", help_text)
+            series = self._values.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+
+    def set(self, name: str, help_text: str, value: float, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._declare(name, "gauge", help_text)
+            self._values.setdefault(name, {})[key] = value
+
+    def add(self, name: str, help_text: str, value: float, **labels: str) -> None:
+        """Incremento (anche negativo) di un gauge."""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._declare(name, "gauge", help_text)
+            series = self._values.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+
+    def observe(self, name: str, help_text: str, value: float, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._declare(name, "histogram", help_text)
+            counts = self._histograms.setdefault(name, {}).get(key)
+            if counts is None:
+                counts = self._histograms[name][key] = [0.0] * (len(self.buckets) + 3)
+            # i valori oltre l'ultimo bucket finiscono nello slot di overflow (contato solo in +Inf)
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    def gauge_callback(self, name: str, help_text: str, callback: Callable[[], float], **labels: str) -> None:
+        """Gauge letto allo scrape (es. profondità di una coda); sostituisce un callback con le stesse label."""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._declare(name, "gauge", help_text)
+            callbacks = [(k, cb) for k, cb in self._callbacks.get(name, []) if k != key]
+            self._callbacks[name] = callbacks + [(key, callback)]
+
+    def render(self) -> str:
+        with self._lock:
+            values = {name: dict(series) for name, series in self._values.items()}
+            histograms = {name: {k: list(v) for k, v in series.items()} for name, series in self._histograms.items()}
+            callbacks = {name: list(cbs) for name, cbs in self._callbacks.items()}
+            declared = dict(self._help)
+        for name, cbs in callbacks.items():
+            for key, callback in cbs:
+                try:
+                    values.setdefault(name, {})[key] = float(callback())
+                except Exception as e:
+                    logger.error(f"Metric {name} callback failed: {e}")
+        lines = []
+        for name, (kind, help_text) in sorted(declared.items()):
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            if kind == "histogram":
+                for key, counts in sorted(histograms.get(name, {}).items()):
+                    cumulative = 0.0
+                    for bound, count in zip(self.buckets, counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_format_labels(key, f'{bound:g}')} {cumulative:g}")
+                    lines.append(f"{name}_bucket{_format_labels(key, '+Inf')} {counts[-1]:g}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {counts[-2]:g}")
+                    lines.append(f"{name}_count{_format_labels(key)} {counts[-1]:g}")
+            else:
+                for key, value in sorted(values.get(name, {}).items()):
+                    lines.append(f"{name}{_format_labels(key)} {value:g}")
+        return "\n".join(lines) + "\n"
+
+    # --- metriche della pipeline ---
+
+    def observe_log(self, role: str, log: BaseLog, model: str | None = None) -> None:
+        """Aggiorna le metriche a partire dal log di un nodo."""
+        node = log.node_name
+        self.observe("incident_node_latency_seconds", "Node processing time", log.processing_time / 1000, node=node)
+        if log.llm_count:
+            model = model or "unknown"
+            self.inc("incident_llm_calls_total", "LLM calls", log.llm_count, node=node, model=model)
+            self.inc("incident_llm_tokens_total", "LLM tokens (prompt + completion)", log.token_usage,
+                     node=node, model=model)
+            self.inc("incident_llm_cost_usd_total", "LLM cost in USD", log.total_cost, node=node, model=model)
+        if isinstance(log, ConsultantLog):
+            self.inc("incident_topic_source_total", "Consultant topics by source (llm, reused, local, graph)",
+                     node=node, source=log.topic_source)
+        if role == AgentRole.worker.value and isinstance(log, WorkerLog):
+            self.inc("incident_worker_actions_total", "Worker actions by outcome", tool=node,
+                     success="ok" if log.success == "ok" else log.success.split(":")[0])
+
+    def cache_hit_ratios(self) -> Dict[str, float]:
+        with self._lock:
+            sources = dict(self._values.get("incident_topic_source_total", {}))
+        totals: Dict[str, List[float]] = {}
+        for key, value in sources.items():
+            labels = dict(key)
+            hits_total = totals.setdefault(labels["node"], [0.0, 0.0])
+            hits_total[0] += value if labels["source"] != "llm" else 0.0
+            hits_total[1] += value
+        return {node: hits / total for node, (hits, total) in totals.items() if total}
+
+    def render_all(self) -> str:
+        """render() con i rapporti di cache hit calcolati al momento."""
+        for node, ratio in self.cache_hit_ratios().items():
+            self.set("incident_cache_hit_ratio", "Share of consultant topics not requested to the LLM", ratio,
+                     node=node)
+        return self.render()
+
+
+_registry: MetricsRegistry | None = None
+_registry_lock = threading.Lock()
+_server: ThreadingHTTPServer | None = None
+
+
+def get_metrics(enable: bool = False) -> MetricsRegistry | None:
+    """Registry di processo; None finché nessuno lo attiva con `enable=True`."""
+    global _registry
+    with _registry_lock:
+        if _registry is None and enable:
+            _registry = MetricsRegistry()
+        return _registry
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+        data = get_metrics(enable=True).render_all().encode("utf-8")
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format: str, *args) -> None:
+        logger.debug(f"metrics: {format % args}")
+
+
+def start_metrics_server(port: int, host: str = "127.0.0.1") -> None:
+    """Attiva il registry ed espone /metrics su host:port in un thread (una sola volta per processo)."""
+    global _server
+    get_metrics(enable=True)
+    with _registry_lock:
+        if _server is not None:
+            return
+        try:
+            _server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+        except OSError as e:
+            # es. processi shard sulla stessa porta: il registry resta attivo ma non esposto
+            logger.warning(f"Metrics endpoint not started on {host}:{port}: {e}")
+            return
+    threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+    logger.info(f"Metrics available on http://{host}:{port}/metrics")
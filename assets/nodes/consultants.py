@@ -1,44 +1,78 @@
-import json
 import time
 import uuid
 from datetime import datetime
+from typing import Any
 
 from assets.helper.costants import INPUT_CONSULTANT_NAME, ROUTER_SUPERVISOR_NAME, ROOT_CAUSE_CONSULTANT_NAME, \
     TOOL_INVOCATION_SUPERVISOR_NAME, ENTITY_GRAPH_CONSULTANT_NAME
-from assets.helper.logging import add_log_to_state
-from assets.utils import create_chain, save_topics, merge_topic_scores
+from assets.classifier import load_classifier, record_consultant_output
+from assets.helper.logging import create_node_log
+from assets.utils import create_chain, create_llm, save_topics, merge_topic_scores, openai_callback
+from assets.vocabulary import get_vocabulary
 from assets.custom_obj import AgentState, Token, AgentRole
-from assets.prompts import INPUT_CONSULTANT_PROMPT, ROOT_CAUSE_CONSULTANT_PROMPT, ENTITY_GRAPH_CONSULTANT_PROMPT
-from langchain_openai import ChatOpenAI
+from assets.prompt_render import render_incident, render_topics, prompt_tokens
+from assets.streaming import invoke_json_chain
+from assets.prompts import INPUT_CONSULTANT_PROMPT, ROOT_CAUSE_CONSULTANT_PROMPT, ENTITY_GRAPH_CONSULTANT_PROMPT, \
+    ENTITY_GRAPH_CONSULTANT_GRAPH_PROMPT
+from assets.service_graph import get_service_graph
 from langgraph.types import Command
 from loguru import logger
-from langchain_community.callbacks import get_openai_callback
-
 
 
+def invoke_consultant_chain(state: AgentState, prompt: str, node_name: str, label: str,
+                            extra_input: dict | None = None) -> tuple[dict, Any, dict]:
+    """
+    Esegue la chain LLM del consultant e ne parsifica il JSON dei topic.
+    La chiamata LLM viene saltata se lo stato contiene un'analisi riusata da un incident simile
+    o se il classificatore locale è abbastanza confidente.
+    `extra_input` aggiunge variabili (già compatte) al prompt.
+    :return: (topic -> score, callback OpenAI o None, info aggiuntive per il ConsultantLog)
+    """
+    if state.reused is not None:
+        logger.info(f"{label} consultant reusing topics of {state.reused.incident_id} "
+                    f"(similarity={state.reused.similarity:.2f})")
+        return dict(state.reused.topics), None, {"topic_source": "reused"}
+
+    if state.local_classifier_threshold is not None:
+        classifier = load_classifier()
+        if classifier is not None:
+            topics, confidence = classifier.predict(state.incident, node_name)
+            if confidence >= state.local_classifier_threshold:
+                logger.info(f"{label} consultant using local classifier (confidence={confidence:.2f})")
+                return topics, None, {"topic_source": "local"}
+            logger.info(f"{label} consultant deferring to LLM: local confidence {confidence:.2f} "
+                        f"< {state.local_classifier_threshold:.2f}")
+
+    chain = create_chain(create_llm(state), prompt)
+    input = {
+        "incident_json": render_incident(state.incident, state.prompt_token_budget, state.model),
+        "existing_topics": render_topics(state.topics),
+        **(extra_input or {})
+    }
+    tokens, tokens_saved = prompt_tokens(
+        prompt, input, {"incident_json": state.incident, "existing_topics": state.topics, **(extra_input or {})},
+        state.model
+    )
+    with openai_callback() as cb:
+        result_json, timing = invoke_json_chain(chain, input, {"callbacks": [cb]}, f"{label} consultant",
+                                                streaming=state.streaming, node=node_name)
+    # varianti (maiuscole, plurali, sinonimi) ricondotte al vocabolario condiviso
+    result_json = get_vocabulary().canonicalize_scores(result_json)
+    if result_json and state.record_labels:
+        record_consultant_output(state.incident, node_name, result_json)
+    return result_json, cb, {
+        "topic_source": "llm",
+        "prompt_topics_chars": len(input["existing_topics"]),
+        "prompt_tokens": tokens,
+        "prompt_tokens_saved": tokens_saved,
+        **timing,
+    }
 
 
 def input_consultant_node(state: AgentState) -> Command:
-    LLM = ChatOpenAI(model=state.model, temperature=state.temperature, max_retries=3, streaming=False)
-
     logger.warning("Entering the input consultant node")
     start_time = time.perf_counter()
-    chain = create_chain(LLM, INPUT_CONSULTANT_PROMPT)
-    input = {
-        "incident_json": state.incident,
-        "existing_topics": state.topics
-    }
-    with get_openai_callback() as cb:
-        result = chain.invoke(input, config={"callbacks": [cb]})
-
-    logger.info(f"Consultant node results: {result}")
-    try:
-        result_json = json.loads(result) if isinstance(result, str) else result
-        if not isinstance(result_json, dict):
-            result_json = {}
-    except Exception as e:
-        logger.error(f"Failed to parse RC consultant JSON: {e}")
-        result_json = {}
+    result_json, cb, log_info = invoke_consultant_chain(state, INPUT_CONSULTANT_PROMPT, INPUT_CONSULTANT_NAME, "Input")
     token = Token(
         id=str(uuid.uuid4()),
         layer="observation",
@@ -53,47 +87,31 @@ def input_consultant_node(state: AgentState) -> Command:
     logger.info(f"Token created with ID: {token.id}")
     save_topics(result_json)
     state.token = token
-    state = add_log_to_state(
+    log = create_node_log(
         agent_name=INPUT_CONSULTANT_NAME,
         agent_role=AgentRole.consultant.value,
         start_time=start_time,
-        llm_count=True,
+        llm_count=cb is not None,
         llm_callback=cb,
-        state=state
+        state=state,
+        **log_info
     )
     logger.info("-"*50)
     return Command(
         update={
-            "nodes_logs": state.nodes_logs,
+            "nodes_logs": {AgentRole.consultant.value: [log]},
             "token": token,
-            "topics": set(json.loads(result).keys())
+            "topics": set(result_json.keys())
         },
         goto=ROUTER_SUPERVISOR_NAME
     )
 
 def root_cause_consultant_node(state: "AgentState") -> Command:
-    LLM = ChatOpenAI(model=state.model, temperature=state.temperature, max_retries=3, streaming=False)
     logger.warning("Entering the root_cause_consultant node")
     start_time = time.perf_counter()
 
-    chain = create_chain(LLM, ROOT_CAUSE_CONSULTANT_PROMPT)
-    input = {
-        "incident_json": state.incident,
-        "existing_topics": state.topics
-    }
-
-    with get_openai_callback() as cb:
-        result = chain.invoke(input, config={"callbacks": [cb]})
-
-    logger.info(f"Root-cause consultant raw result: {result}")
-
-    try:
-        result_json = json.loads(result) if isinstance(result, str) else result
-        if not isinstance(result_json, dict):
-            result_json = {}
-    except Exception as e:
-        logger.error(f"Failed to parse RC consultant JSON: {e}")
-        result_json = {}
+    result_json, cb, log_info = invoke_consultant_chain(state, ROOT_CAUSE_CONSULTANT_PROMPT,
+                                                    ROOT_CAUSE_CONSULTANT_NAME, "Root-cause")
 
     # Merge topic scores (mantieni gli score)
     merged_topics = merge_topic_scores(state.token.topics, result_json)
@@ -116,18 +134,19 @@ def root_cause_consultant_node(state: "AgentState") -> Command:
     state.token = token
 
     # Log LLM usage
-    state = add_log_to_state(
+    log = create_node_log(
         agent_name="root_cause_consultant",
         agent_role=AgentRole.consultant.value,
         start_time=start_time,
-        llm_count=True,
+        llm_count=cb is not None,
         llm_callback=cb,
-        state=state
+        state=state,
+        **log_info
     )
     logger.info("-"*50)
     return Command(
         update={
-            "nodes_logs": state.nodes_logs,
+            "nodes_logs": {AgentRole.consultant.value: [log]},
             "token": token,
             "topics": set(merged_topics.keys())
         },
@@ -135,28 +154,22 @@ def root_cause_consultant_node(state: "AgentState") -> Command:
     )
 
 def entity_graph_consultant_node(state: "AgentState") -> Command:
-    LLM = ChatOpenAI(model=state.model, temperature=state.temperature, max_retries=3, streaming=False)
     logger.warning("Entering the entity_graph_consultant node")
     start_time = time.perf_counter()
 
-    chain = create_chain(LLM, ENTITY_GRAPH_CONSULTANT_PROMPT)
-    input = {
-        "incident_json": state.incident,
-        "existing_topics": state.topics
-    }
-
-    with get_openai_callback() as cb:
-        result = chain.invoke(input, config={"callbacks": [cb]})
-
-    logger.info(f"Entity-graph consultant raw result: {result}")
-
-    try:
-        result_json = json.loads(result) if isinstance(result, str) else result
-        if not isinstance(result_json, dict):
-            result_json = {}
-    except Exception as e:
-        logger.error(f"Failed to parse EG consultant JSON: {e}")
-        result_json = {}
+    # grafo delle dipendenze tra service: topic strutturali senza LLM (direct) o contesto nel prompt
+    service_graph = get_service_graph() if state.service_graph_mode != "off" and state.reused is None else None
+    if service_graph is not None and state.service_graph_mode == "direct" and state.incident.service in service_graph:
+        result_json, cb, log_info = service_graph.signals(state.incident), None, {"topic_source": "graph"}
+        logger.info(f"Entity-graph consultant using service graph for {state.incident.service}: {result_json}")
+    elif service_graph is not None:
+        result_json, cb, log_info = invoke_consultant_chain(
+            state, ENTITY_GRAPH_CONSULTANT_GRAPH_PROMPT, ENTITY_GRAPH_CONSULTANT_NAME, "Entity-graph",
+            extra_input={"service_graph": service_graph.prompt_context(state.incident)},
+        )
+    else:
+        result_json, cb, log_info = invoke_consultant_chain(state, ENTITY_GRAPH_CONSULTANT_PROMPT,
+                                                        ENTITY_GRAPH_CONSULTANT_NAME, "Entity-graph")
 
     merged_topics = merge_topic_scores(state.token.topics, result_json)
 
@@ -177,18 +190,19 @@ def entity_graph_consultant_node(state: "AgentState") -> Command:
     state.token = token
 
     # Log LLM usage
-    state = add_log_to_state(
+    log = create_node_log(
         agent_name=ENTITY_GRAPH_CONSULTANT_NAME,
         agent_role=AgentRole.consultant.value,
         start_time=start_time,
-        llm_count=True,
+        llm_count=cb is not None,
         llm_callback=cb,
-        state=state
+        state=state,
+        **log_info
     )
     logger.info("-"*50)
     return Command(
         update={
-            "nodes_logs": state.nodes_logs,
+            "nodes_logs": {AgentRole.consultant.value: [log]},
             "token": token,
             "topics": set(merged_topics.keys())
         },
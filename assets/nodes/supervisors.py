@@ -3,24 +3,24 @@ import time
 import uuid
 from datetime import datetime
 
-from openai import APIError
-
 from assets.helper.costants import RESTART_WORKER_NAME, DIAGNOSTIC_WORKER_NAME, NOTIFY_TEAM_WORKER_NAME, \
     LOG_WORK_NOTE_WORKER_NAME, ROUTER_SUPERVISOR_NAME, TOOL_INVOCATION_SUPERVISOR_NAME
-from assets.helper.logging import add_log_to_state
-from assets.utils import create_agent, choose_worker_tool, parse_worker_log, create_chain
+from assets.helper.logging import create_node_log
+from assets.utils import create_agent, choose_worker_tool, parse_worker_log, create_chain, create_llm, \
+    openai_callback, llm_api_error
 from assets.custom_obj import AgentState, AgentRole, Directive, WorkerLog
 
 from assets.prompts import ROUTER_SUPERVISOR_PROMPT, TOOL_INVOCATION_SUPERVISOR_PROMPT
-from langchain_openai import ChatOpenAI
 from langgraph.types import Command
 from loguru import logger
-from langchain_community.callbacks import get_openai_callback
 
 from assets.utils import group_scores
 from assets.nodes.workers import restart_worker_tool, diagnostics_worker_tool, notify_team_worker_tool, \
-    log_work_note_worker_tool
-from assets.prompts import TOOL_SUPERVISOR_PROMPT
+    log_work_note_worker_tool, for_service
+from assets.prompts import TOOL_SUPERVISOR_CONTEXT, TOOL_SUPERVISOR_PROMPT
+from assets.prompt_render import render_incident, render_topics, prompt_tokens
+from assets.streaming import invoke_json_chain
+from assets.worker_executor import get_worker_executor
 
 
 TOOL_REGISTRY = {
@@ -30,6 +30,15 @@ TOOL_REGISTRY = {
     LOG_WORK_NOTE_WORKER_NAME: log_work_note_worker_tool,
 }
 
+def dispatch_tool(tool_name: str, directive_text: str, directive_id: str, service: str | None,
+                  incident_id: str) -> None:
+    """
+    Sottomette l'azione del worker all'esecutore asincrono, senza agent LLM e senza attenderla:
+    il WorkerLog si raccoglie con get_worker_executor().collect(incident_id).
+    """
+    logger.debug(f"Dispatching directive {directive_id} directly to {tool_name}")
+    get_worker_executor().submit(tool_name, directive_text, directive_id, service=service, incident_id=incident_id)
+
 def router_supervisor_deterministic(topics):
     ROUTE_MIN = 0.50  # conf. minima per considerare “forte” un segnale
     MARGIN = 0.10
@@ -58,36 +67,40 @@ def router_supervisor_node(state: AgentState) -> Command:
     #@TODO rivedere il sistema di soglie rispetto ai topic, introdurre elementi di dinamismo
     #@TODO meccanismo di validazione di nuovi topic -> esportare i dati su file per la gestione dinamica
 
-    LLM = ChatOpenAI(model=state.model, temperature=state.temperature, max_retries=3, streaming=False)
-
     logger.warning("Entering the router supervisor node")
     start_time = time.perf_counter()
     topics = state.token.topics
+    tokens, tokens_saved = 0, 0
+    timing = {}
 
-    if state.llm_supervisor:
+    if state.reused is not None:
+        logger.info(f"Reusing route of similar incident {state.reused.incident_id} in router supervisor node")
+        llm_count, cb = False, None
+        route = state.reused.route
+        reason = f"reused from {state.reused.incident_id} (similarity={state.reused.similarity:.2f})"
+        rc_score, eg_score, _, _ = group_scores(topics or {})
+    elif state.llm_supervisor:
         logger.info(f"Using LLM in router supervisor node")
-        topics_json = json.dumps(topics, ensure_ascii=False)
-        chain = create_chain(LLM, ROUTER_SUPERVISOR_PROMPT)
+        chain = create_chain(create_llm(state), ROUTER_SUPERVISOR_PROMPT)
         input = {
-            "topics_json": topics_json
+            "topics_json": render_topics(topics)
         }
+        tokens, tokens_saved = prompt_tokens(
+            ROUTER_SUPERVISOR_PROMPT, input, {"topics_json": json.dumps(topics, ensure_ascii=False)}, state.model
+        )
         try:
-            with get_openai_callback() as cb:
-                result = chain.invoke(input, config={"callbacks": [cb]})
-                logger.info(f"Router supervisor node results: {result}")
-                try:
-                    result_json = json.loads(result) if isinstance(result, str) else result
-                    if not isinstance(result_json, dict):
-                        result_json = {}
-                except Exception as e:
-                    logger.error(f"Failed to parse RC consultant JSON: {e}")
-                    result_json = {}
+            with openai_callback() as cb:
+                result_json, timing = invoke_json_chain(
+                    chain, input, {"callbacks": [cb]}, "Router supervisor", streaming=state.streaming,
+                    required_keys=("route",), stop_on_decision=state.stream_early_exit,
+                    node=ROUTER_SUPERVISOR_NAME,
+                )
                 route = result_json.get("route", "entity_graph_consultant")
                 reason = result_json.get("reason", "")
                 rc_score = result_json.get("rc_score", 0)
                 eg_score = result_json.get("eg_score", 0)
                 llm_count = True
-        except APIError as e:
+        except llm_api_error() as e:
             logger.error(f"LLM server error after retries: {e}. Falling back to heuristic.")
             llm_count, cb, route, reason, rc_score, eg_score = router_supervisor_deterministic(topics)
     else:
@@ -109,26 +122,27 @@ def router_supervisor_node(state: AgentState) -> Command:
     logger.info(f"Directive created with ID: {directive.id}")
     state.directives = [directive]
 
-    state = add_log_to_state(
+    log = create_node_log(
         agent_name=ROUTER_SUPERVISOR_NAME,
         agent_role=AgentRole.supervisor.value,
         start_time=start_time,
         llm_count=llm_count,
         llm_callback=cb,
-        state=state
+        state=state,
+        prompt_tokens=tokens,
+        prompt_tokens_saved=tokens_saved,
+        **timing,
     )
     logger.info("-"*50)
     return Command(
         update={
-            "nodes_logs": state.nodes_logs,
+            "nodes_logs": {AgentRole.supervisor.value: [log]},
             "directives": state.directives
         },
         goto=route
     )
 def tool_invocation_supervisor_node(state: AgentState) -> Command:
 
-    LLM = ChatOpenAI(model=state.model, temperature=state.temperature, max_retries=3, streaming=False)
-
     logger.warning("Entering the tool_invocation_supervisor node")
     start_time = time.perf_counter()
 
@@ -139,32 +153,50 @@ def tool_invocation_supervisor_node(state: AgentState) -> Command:
         exclude_none=True,
         by_alias=True,
     )
-    with get_openai_callback() as cb:
-        if state.llm_supervisor:
+    incident_json = render_incident(incident, state.prompt_token_budget, state.model)
+    topics_json = render_topics(topics)
+    tokens, tokens_saved = 0, 0
+    timing = {}
+    worker_logs = []
+    # True se incident e topics sono già arrivati all'LLM con il Tool Decider
+    context_sent = False
+    # il callback OpenAI (e langchain_community) serve solo se il nodo chiama davvero l'LLM
+    uses_llm = (state.llm_supervisor and state.reused is None) or not (
+        state.shadow or state.reused is not None or state.direct_tool_dispatch
+    )
+    with openai_callback(uses_llm) as cb:
+        if state.reused is not None:
+            logger.info(f"Reusing tool of similar incident {state.reused.incident_id} in tool invocation supervisor node")
+            tool_name = state.reused.tool
+            confidence = max(topics.values(), default=0.0)
+            reason = f"reused from {state.reused.incident_id} (similarity={state.reused.similarity:.2f})"
+            directive_text = f"[Directive] Execute tool '{tool_name}' for incident {incident.id}. "
+        elif state.llm_supervisor:
             logger.info(f"Using LLM in tool invocation supervisor node")
             available_tools = list(TOOL_REGISTRY.keys())
-            chain = create_chain(LLM, TOOL_INVOCATION_SUPERVISOR_PROMPT)
+            chain = create_chain(create_llm(state), TOOL_INVOCATION_SUPERVISOR_PROMPT)
             input = {
-                "incident_json": inc_dict,
-                "topics": topics,
-                "available_tools": available_tools
+                "incident_json": incident_json,
+                "topics": topics_json,
+                "available_tools": render_topics(available_tools)
             }
+            tokens, tokens_saved = prompt_tokens(
+                TOOL_INVOCATION_SUPERVISOR_PROMPT, input,
+                {"incident_json": inc_dict, "topics": topics, "available_tools": available_tools}, state.model
+            )
             try:
-                result = chain.invoke(input, config={"callbacks": [cb]})
-                logger.info(f"Tool invocation supervisor node results: {result}")
-                try:
-                    result_json = json.loads(result) if isinstance(result, str) else result
-                    if not isinstance(result_json, dict):
-                        result_json = {}
-                except Exception as e:
-                    logger.error(f"Failed to parse RC consultant JSON: {e}")
-                    result_json = {}
+                result_json, timing = invoke_json_chain(
+                    chain, input, {"callbacks": [cb]}, "Tool invocation supervisor", streaming=state.streaming,
+                    required_keys=("tool_name",), stop_on_decision=state.stream_early_exit,
+                    node=TOOL_INVOCATION_SUPERVISOR_NAME,
+                )
+                context_sent = True
                 tool_name = result_json.get("tool_name", LOG_WORK_NOTE_WORKER_NAME)
                 confidence = result_json.get("confidence", 0)
                 reason = result_json.get("reason", "No reason available")
                 directive_text = result_json.get("directive_text",
                                                  f"[Directive] Execute tool '{tool_name}' for incident {incident.id}. ")
-            except APIError as e:
+            except llm_api_error() as e:
                 logger.error(f"LLM server error after retries: {e}. Falling back to heuristic.")
                 tool_name, confidence, reason = choose_worker_tool(topics, inc_dict)
                 directive_text = f"[Directive] Execute tool '{tool_name}' for incident {incident.id}. "
@@ -190,46 +222,70 @@ def tool_invocation_supervisor_node(state: AgentState) -> Command:
         logger.info(f"Reason: {directive.metadata['directive_reason']}")
 
         tool_obj = TOOL_REGISTRY[tool_name]
-        agent = create_agent(
-            llm=LLM,
-            tools=[tool_obj],
-            system_prompt=TOOL_SUPERVISOR_PROMPT,
-        )
         try:
-            result = agent.invoke({
-                # molti agent executor richiedono 'input'
-                "input": directive_text,
-                # variabili usate dal prompt
-                "directive": directive_text,
-                "directive_id": directive.id,
-                "incident_json": inc_dict,
-                "topics": topics,
-                "tool_name": tool_name
-            })
-            logger.debug(f"tool_invocation_supervisor agent result: {result}")
-            logger.debug("------------------------------------------")
-            logger.debug(f"Creating worker log from supervisor node")
-            worker_log = parse_worker_log(result.get("output"))
-            if isinstance(worker_log, WorkerLog):
-                state.nodes_logs.setdefault("worker", []).append(worker_log)
+            if state.shadow:
+                # run di confronto: la decisione viene registrata ma il tool non viene eseguito
+                logger.info(f"Shadow run: tool '{tool_name}' not executed")
+                result = {"output": None}
+            elif state.reused is not None or state.direct_tool_dispatch:
+                # il supervisor non attende il tool: il WorkerLog viene aggiunto a fine batch
+                dispatch_tool(tool_name, directive_text, directive.id, incident.service, incident.id)
+                result = {"output": None, "submitted": directive.id}
             else:
-                logger.error(f"Worker log non valido, salvato come raw: {worker_log}")
-            logger.debug("------------------------------------------")
-        except APIError as e:
+                agent = create_agent(
+                    llm=create_llm(state),
+                    tools=[for_service(tool_obj, incident.service)],
+                    system_prompt=TOOL_SUPERVISOR_PROMPT,
+                )
+                # incident e topics una volta sola: se li ha già visti il Tool Decider, il directive basta
+                context = "" if context_sent else TOOL_SUPERVISOR_CONTEXT.format(
+                    incident_json=incident_json, topics=topics_json)
+                agent_input = {
+                    "directive": directive_text,
+                    "directive_id": directive.id,
+                    "context": context,
+                    "tool_name": tool_name
+                }
+                agent_tokens, agent_saved = prompt_tokens(
+                    TOOL_SUPERVISOR_PROMPT, agent_input,
+                    {**agent_input, "context": TOOL_SUPERVISOR_CONTEXT.format(incident_json=inc_dict, topics=topics)},
+                    state.model
+                )
+                tokens, tokens_saved = tokens + agent_tokens, tokens_saved + agent_saved
+                result = agent.invoke({
+                    # molti agent executor richiedono 'input': il directive è già nel prompt di sistema
+                    "input": f"Call {tool_name} now.",
+                    # variabili usate dal prompt
+                    **agent_input,
+                })
+            if result.get("output") is not None:
+                logger.debug("tool_invocation_supervisor agent result: {}", result)
+                logger.debug("------------------------------------------")
+                logger.debug(f"Creating worker log from supervisor node")
+                worker_log = parse_worker_log(result.get("output"))
+                if isinstance(worker_log, WorkerLog):
+                    worker_logs.append(worker_log)
+                else:
+                    logger.error(f"Worker log non valido, salvato come raw: {worker_log}")
+                logger.debug("------------------------------------------")
+        except llm_api_error() as e:
             logger.error(f"LLM server error after retries: {e}. No worker called.")
 
     state.directives = [directive]
-    state = add_log_to_state(
+    log = create_node_log(
         agent_name=TOOL_INVOCATION_SUPERVISOR_NAME,
         agent_role=AgentRole.supervisor.value,
         start_time=start_time,
-        llm_count=True,
+        llm_count=cb is not None,
         llm_callback=cb,
         state=state,
+        prompt_tokens=tokens,
+        prompt_tokens_saved=tokens_saved,
+        **timing,
     )
 
     update = {
-        "nodes_logs": state.nodes_logs,
+        "nodes_logs": {AgentRole.worker.value: worker_logs, AgentRole.supervisor.value: [log]},
         "directives": state.directives,
         "last_executed_tool": tool_name,
         "last_tool_result": result.get("output", result),
@@ -1,17 +1,86 @@
+import asyncio
+import functools
 import random
-import time
-from typing import Dict, Any
+import re
+from typing import Annotated, Dict, Any, Optional
 
-from langchain.tools import tool
+from langchain_core.tools import BaseTool, InjectedToolArg, StructuredTool, tool
 from loguru import logger
-from datetime import datetime
-from assets.custom_obj import AgentRole, WorkerLog
-from assets.helper import add_log_to_state, RESTART_WORKER_NAME, DIAGNOSTIC_WORKER_NAME, NOTIFY_TEAM_WORKER_NAME, \
-    LOG_WORK_NOTE_WORKER_NAME, worker_log_factory
+from assets.helper import RESTART_WORKER_NAME, DIAGNOSTIC_WORKER_NAME, NOTIFY_TEAM_WORKER_NAME, \
+    LOG_WORK_NOTE_WORKER_NAME
+from assets.log_setup import log_payload
+from assets.outbound import get_outbound_buffer
+from assets.worker_executor import get_worker_executor
 
+# Latenza simulata delle azioni (ms): in produzione le azioni chiamano i sistemi reali
+SIMULATED_LATENCY_MS = (50, 200)
+# Sistema di ticketing su cui vengono scritte le work note
+TICKET_SYSTEM = "itsm"
+_CHANNEL_RE = re.compile(r"channel=([\w\-#]+)")
+# generatore delle latenze simulate: con seed_simulated_latency le run sono ripetibili
+_random = random.Random()
 
+
+def seed_simulated_latency(seed: int | None) -> None:
+    _random.seed(seed)
+
+
+async def _simulate(worker: str, directive: str, directive_id: str) -> None:
+    log_payload(worker, f"[{worker}] id={directive_id} directive=", directive)
+    await asyncio.sleep(_random.randint(*SIMULATED_LATENCY_MS) / 1000)
+
+
+async def restart_action(directive: str, directive_id: str, service: str) -> None:
+    await _simulate(RESTART_WORKER_NAME, directive, directive_id)
+
+
+async def diagnostics_action(directive: str, directive_id: str, service: str) -> None:
+    await _simulate(DIAGNOSTIC_WORKER_NAME, directive, directive_id)
+
+
+async def notify_team_action(directive: str, directive_id: str, service: str) -> str:
+    """
+    Notifica accodata nel buffer outbound, senza attenderne l'invio: una pagina per canale
+    (o team del service) per finestra.
+    """
+    channel = _CHANNEL_RE.search(directive)
+    key = channel.group(1) if channel else f"team:{service}"
+    logger.info(f"[{NOTIFY_TEAM_WORKER_NAME}] id={directive_id} buffered for {key}")
+    return await get_outbound_buffer().add("notification", key, directive_id, directive)
+
+
+async def log_work_note_action(directive: str, directive_id: str, service: str) -> str:
+    """
+    Work note accodata nel buffer outbound, senza attenderne l'invio: una scrittura bulk sul
+    sistema di ticketing per finestra.
+    """
+    logger.info(f"[{LOG_WORK_NOTE_WORKER_NAME}] id={directive_id} buffered for {TICKET_SYSTEM}")
+    return await get_outbound_buffer().add("work_note", TICKET_SYSTEM, directive_id, directive)
+
+
+# Azioni eseguite dal WorkerExecutor: un'eccezione (o il timeout) rende success != "ok" nel WorkerLog;
+# le azioni bufferizzate restituiscono l'id del batch outbound in cui sono state accodate
+WORKER_ACTIONS = {
+    RESTART_WORKER_NAME: restart_action,
+    DIAGNOSTIC_WORKER_NAME: diagnostics_action,
+    NOTIFY_TEAM_WORKER_NAME: notify_team_action,
+    LOG_WORK_NOTE_WORKER_NAME: log_work_note_action,
+}
+
+
+def for_service(worker_tool: BaseTool, service: str | None) -> BaseTool:
+    """
+    Copia del tool con il service dell'incident fissato: l'argomento è nascosto all'LLM e serve
+    ai limiti di concorrenza per service dell'esecutore.
+    """
+    return StructuredTool.from_function(functools.partial(worker_tool.func, service=service), name=worker_tool.name,
+                                        description=worker_tool.description, args_schema=worker_tool.tool_call_schema)
+
+
+# I tool LangChain (usati dall'agent) attendono l'esito dell'azione, che serve all'LLM
 @tool("restart_worker")
-def restart_worker_tool(directive: str, directive_id: str) -> Dict[str, Any]:
+def restart_worker_tool(directive: str, directive_id: str,
+                        service: Annotated[Optional[str], InjectedToolArg] = None) -> Dict[str, Any]:
     """
     Restart a failing component/service according to the directive.
 
@@ -21,26 +90,12 @@ def restart_worker_tool(directive: str, directive_id: str) -> Dict[str, Any]:
     Returns:
         The json representation of the worker log.
     """
-    logger.info("-" * 50)
-    logger.warning("Entering the restart_worker_tool")
-    worker_log = worker_log_factory(
-        node_name=DIAGNOSTIC_WORKER_NAME,
-        processing_time=random.randint(50, 200),
-        token_usage=0,
-        total_cost=0,
-        llm_count=0,
-        directive_id=directive_id,
-        action=directive,
-        success="ok",
-        timestamp=datetime.now()
-    )
-    logger.info(f"[restart_worker] id={directive_id} directive={directive}")
-    logger.info("-"*50)
-    return worker_log.model_dump(mode="json")
+    return get_worker_executor().run(RESTART_WORKER_NAME, directive, directive_id, service).model_dump(mode="json")
 
 
 @tool("diagnostics_worker")
-def diagnostics_worker_tool(directive: str, directive_id: str) -> Dict[str, Any]:
+def diagnostics_worker_tool(directive: str, directive_id: str,
+                            service: Annotated[Optional[str], InjectedToolArg] = None) -> Dict[str, Any]:
     """
     Run diagnostics as requested by the directive.
 
@@ -50,27 +105,12 @@ def diagnostics_worker_tool(directive: str, directive_id: str) -> Dict[str, Any]
     Returns:
         The json representation of the worker log
     """
-    logger.info("-" * 50)
-    logger.warning("Entering the diagnostics_worker_tool")
-    worker_log = worker_log_factory(
-        node_name=DIAGNOSTIC_WORKER_NAME,
-        processing_time=random.randint(50, 200),
-        token_usage=0,
-        total_cost=0,
-        llm_count=0,
-        directive_id=directive_id,
-        action=directive,
-        success="ok",
-        timestamp=datetime.now()
-    )
-
-    logger.info(f"[diagnostics_worker] id={directive_id} directive={directive}")
-    logger.info("-"*50)
-    return worker_log.model_dump(mode="json")
+    return get_worker_executor().run(DIAGNOSTIC_WORKER_NAME, directive, directive_id, service).model_dump(mode="json")
 
 
 @tool("notify_team_worker")
-def notify_team_worker_tool(directive: str, directive_id: str) -> Dict[str, Any]:
+def notify_team_worker_tool(directive: str, directive_id: str,
+                            service: Annotated[Optional[str], InjectedToolArg] = None) -> Dict[str, Any]:
     """
     Notify the on-call team according to the directive.
 
@@ -80,26 +120,12 @@ def notify_team_worker_tool(directive: str, directive_id: str) -> Dict[str, Any]
     Returns:
         The json representation of the worker log
     """
-    logger.info("-" * 50)
-    logger.warning("Entering the notify_team_worker_tool")
-    worker_log = worker_log_factory(
-        node_name=NOTIFY_TEAM_WORKER_NAME,
-        processing_time=random.randint(50, 200),
-        token_usage=0,
-        total_cost=0,
-        llm_count=0,
-        directive_id=directive_id,
-        action=directive,
-        success="ok",
-        timestamp=datetime.now()
-    )
-    logger.info(f"[notify_team_worker] id={directive_id} directive={directive}")
-    logger.info("-"*50)
-    return worker_log.model_dump(mode="json")
+    return get_worker_executor().run(NOTIFY_TEAM_WORKER_NAME, directive, directive_id, service).model_dump(mode="json")
 
 
 @tool("log_work_note_worker")
-def log_work_note_worker_tool(directive: str, directive_id: str) -> Dict[str, Any]:
+def log_work_note_worker_tool(directive: str, directive_id: str,
+                              service: Annotated[Optional[str], InjectedToolArg] = None) -> Dict[str, Any]:
     """
     Append a work note in the incident record.
 
@@ -110,19 +136,4 @@ def log_work_note_worker_tool(directive: str, directive_id: str) -> Dict[str, An
     Returns:
         The json representation of the worker log
     """
-    logger.info("-" * 50)
-    logger.warning("Entering the log_work_note_worker_tool")
-    worker_log = worker_log_factory(
-        node_name=LOG_WORK_NOTE_WORKER_NAME,
-        processing_time=random.randint(50, 200),
-        token_usage=0,
-        total_cost=0,
-        llm_count=0,
-        directive_id=directive_id,
-        action=directive,
-        success="ok",
-        timestamp=datetime.now()
-    )
-    logger.info(f"[log_work_note_worker] id={directive_id} directive={directive}")
-    logger.info("-" * 50)
-    return worker_log.model_dump(mode="json")
+    return get_worker_executor().run(LOG_WORK_NOTE_WORKER_NAME, directive, directive_id, service).model_dump(mode="json")
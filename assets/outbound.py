@@ -0,0 +1,155 @@
+"""
+Buffer delle azioni verso l'esterno (notifiche ai team, work note sui ticket): durante uno storm
+invece di una pagina e di una scrittura per incident si fa una chiamata bulk per destinazione.
+
+Le azioni con la stessa destinazione (canale/team per le notifiche, sistema di ticketing per le
+work note) arrivate entro `window_s` dalla prima vengono inviate insieme; il batch parte prima se
+raggiunge `max_batch` elementi o a `flush()`, chiamato a fine run batch da collect_worker_logs
+(e alla chiusura del processor). In modalità servizio e follow i batch restano aperti tra un job
+e l'altro e li invia il timer, così uno storm che arriva a piccoli batch condivide le chiamate bulk.
+L'azione non attende l'invio: riceve subito l'id del batch in cui è stata accodata (finisce nel
+WorkerLog) e l'esito del batch si legge dopo il flush o, con `watch`, quando il batch viene
+inviato; così un incident non resta fermo per `window_s`.
+
+Il buffer vive sull'event loop del WorkerExecutor.
+"""
+import asyncio
+import json
+import threading
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from collections import OrderedDict
+from typing import Callable, Dict, List, Tuple
+
+from loguru import logger
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_SINK_PATH = PROJECT_ROOT / "data" / "outbound.jsonl"
+DEFAULT_WINDOW_S = 2.0
+DEFAULT_MAX_BATCH = 50
+MAX_FAILURES = 10_000  # esiti di batch falliti ricordati per la correzione dei WorkerLog
+
+
+@dataclass
+class OutboundItem:
+    directive_id: str
+    payload: str
+
+
+@dataclass
+class _PendingBatch:
+    id: str
+    items: List[OutboundItem] = field(default_factory=list)
+    done: asyncio.Future | None = None
+
+
+class OutboundSink:
+    """Destinazione delle chiamate bulk."""
+
+    async def send(self, kind: str, key: str, batch_id: str, items: List[OutboundItem]) -> None:
+        raise NotImplementedError
+
+
+class LocalOutboundSink(OutboundSink):
+    """Stand-in locale: ogni chiamata bulk diventa una riga JSON nel file indicato."""
+
+    def __init__(self, path: Path = DEFAULT_SINK_PATH):
+        self.path = path
+        self.calls = 0
+
+    async def send(self, kind: str, key: str, batch_id: str, items: List[OutboundItem]) -> None:
+        self.calls += 1
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.path.open("a", encoding="utf-8") as f:
+            f.write(json.dumps({
+                "batch_id": batch_id, "kind": kind, "key": key, "sent_at": datetime.now().isoformat(),
+                "items": [{"directive_id": item.directive_id, "payload": item.payload} for item in items],
+            }, ensure_ascii=False) + "\n")
+
+
+class OutboundBuffer:
+    def __init__(self, sink: OutboundSink, window_s: float = DEFAULT_WINDOW_S, max_batch: int = DEFAULT_MAX_BATCH):
+        self.sink = sink
+        self.window_s = window_s
+        self.max_batch = max_batch
+        self._open: Dict[Tuple[str, str], _PendingBatch] = {}
+        self._sending: Dict[str, _PendingBatch] = {}
+        self._failed: "OrderedDict[str, str]" = OrderedDict()  # batch_id -> esito
+
+    async def add(self, kind: str, key: str, directive_id: str, payload: str) -> str:
+        """Accoda l'azione senza attenderne l'invio; restituisce l'id del batch (esito dopo flush())."""
+        loop = asyncio.get_running_loop()
+        batch = self._open.get((kind, key))
+        if batch is None:
+            batch = _PendingBatch(id=f"{kind}-{uuid.uuid4().hex[:12]}", done=loop.create_future())
+            self._open[(kind, key)] = batch
+            # ritardo massimo: il batch parte comunque window_s dopo la prima azione
+            loop.call_later(self.window_s, lambda: asyncio.ensure_future(self._flush(kind, key, batch)))
+        batch.items.append(OutboundItem(directive_id, payload))
+        if len(batch.items) >= self.max_batch:
+            await self._flush(kind, key, batch)
+        return batch.id
+
+    async def flush(self) -> Dict[str, str]:
+        """Invia subito i batch aperti e attende quelli in invio; restituisce gli esiti dei batch falliti."""
+        for (kind, key), batch in list(self._open.items()):
+            await self._flush(kind, key, batch)
+        sending = [batch.done for batch in self._sending.values()]
+        if sending:
+            await asyncio.wait(sending)
+        return dict(self._failed)
+
+    def watch(self, batch_id: str, callback: Callable[[str | None], None]) -> None:
+        """
+        Chiama `callback` con l'esito del batch (None se inviato, "error: ..." se fallito) appena il
+        batch è stato inviato, subito se lo è già. Da chiamare sull'event loop del buffer.
+        """
+        batch = self._sending.get(batch_id) or next((b for b in self._open.values() if b.id == batch_id), None)
+        if batch is None:
+            callback(self._failed.get(batch_id))
+        else:
+            batch.done.add_done_callback(lambda _: callback(self._failed.get(batch_id)))
+
+    def pending(self) -> int:
+        """Azioni nei batch non ancora inviati (letto anche da altri thread, per le metriche)."""
+        return sum(len(batch.items) for batch in list(self._open.values()))
+
+    async def _flush(self, kind: str, key: str, batch: _PendingBatch) -> None:
+        if self._open.get((kind, key)) is not batch:
+            return  # già inviato (per dimensione o dal timer)
+        del self._open[(kind, key)]
+        self._sending[batch.id] = batch
+        try:
+            await self.sink.send(kind, key, batch.id, batch.items)
+            logger.info(f"Outbound {kind} batch {batch.id} to {key}: {len(batch.items)} actions in one call")
+        except Exception as e:
+            logger.error(f"Outbound {kind} batch {batch.id} to {key} failed: {e}")
+            self._failed[batch.id] = f"error: {e}"
+            while len(self._failed) > MAX_FAILURES:
+                self._failed.popitem(last=False)
+        finally:
+            del self._sending[batch.id]
+            batch.done.set_result(batch.id)
+
+
+_buffer: OutboundBuffer | None = None
+_buffer_lock = threading.Lock()
+
+
+def get_outbound_buffer(window_s: float | None = None, max_batch: int | None = None,
+                        sink_path: str | None = None) -> OutboundBuffer:
+    """Istanza di processo del buffer; i parametri indicati aggiornano la configurazione."""
+    global _buffer
+    with _buffer_lock:
+        if _buffer is None:
+            _buffer = OutboundBuffer(LocalOutboundSink(), DEFAULT_WINDOW_S, DEFAULT_MAX_BATCH)
+        if window_s is not None:
+            _buffer.window_s = window_s
+        if max_batch is not None:
+            _buffer.max_batch = max_batch
+        if sink_path is not None and isinstance(_buffer.sink, LocalOutboundSink):
+            path = Path(sink_path)
+            _buffer.sink.path = path if path.is_absolute() else PROJECT_ROOT / path
+        return _buffer
@@ -0,0 +1,213 @@
+"""
+Profiling per nodo del grafo, attivato da config (`profiling`): ogni nodo registrato in
+IncidentsGraph viene avvolto da un wrapper che ne misura il tempo e lo segnala al profiler.
+
+- sampling: un thread campiona ogni `interval_ms` lo stack dei thread che stanno eseguendo un
+  nodo; i campioni danno lo stack collassato (per i flamegraph) e la divisione del tempo del
+  nodo in fasi;
+- cprofile: in più ogni chiamata del nodo gira sotto cProfile e il profilo aggregato del nodo
+  viene salvato in formato pstats. Da Python 3.12 cProfile è unico per processo: con più
+  incident in parallelo una chiamata viene profilata solo se nessun altro nodo lo è già.
+
+Fasi (classificate dallo stack di ogni campione):
+- network: dentro la chiamata al chat model (client OpenAI/HTTP o `_generate`/`_stream`);
+- tool: attesa dell'azione di un worker invocata dall'agent;
+- render: rendering dei prompt (assets.prompt_render, template LangChain, tiktoken);
+- parse: parsing JSON, output parser e validazione pydantic;
+- log: loguru e creazione dei log dei nodi;
+- other: tutto il resto (LangGraph, logica del nodo).
+
+A `write()` (chiamato alla chiusura dell'IncidentProcessor) in `output_dir/<timestamp>_<pid>/`:
+nodes.json (chiamate, tempi e fasi per nodo), profile.txt (riepilogo leggibile, con le funzioni
+più costose in modalità cprofile), stacks.collapsed (una riga `nodo;frame;...;frame conteggio`,
+per flamegraph.pl o speedscope) e <nodo>.prof in modalità cprofile.
+"""
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List
+
+from loguru import logger
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+PHASES = ("network", "tool", "render", "parse", "log", "other")
+DEFAULT_INTERVAL_MS = 5.0
+
+_NETWORK_PATHS = ("/openai/", "/httpx/", "/httpcore/", "langchain_openai", "/ssl.py", "/socket.py")
+_NETWORK_FUNCTIONS = ("_generate", "_agenerate", "_stream", "_astream")
+_TOOL_PATHS = ("assets/worker_executor.py", "assets/nodes/workers.py")
+_PHASE_PATHS = (
+    ("render", ("assets/prompt_render.py", "langchain_core/prompts/", "/tiktoken/")),
+    ("parse", ("/json/", "/pydantic/", "/pydantic_core/", "langchain_core/output_parsers/", "assets/streaming.py")),
+    ("log", ("/loguru/", "assets/helper/logging.py")),
+)
+
+
+def classify(frames: List) -> str:
+    """
+    Fase di un campione: network se un frame è nella chiamata al modello, tool se nell'attesa
+    dell'azione di un worker, altrimenti quella del frame più interno riconosciuto.
+    """
+    for frame in frames:
+        filename = frame.f_code.co_filename.replace(os.sep, "/")
+        if any(p in filename for p in _NETWORK_PATHS) or frame.f_code.co_name in _NETWORK_FUNCTIONS:
+            return "network"
+        if any(p in filename for p in _TOOL_PATHS):
+            return "tool"
+    for frame in frames:  # dal più interno
+        filename = frame.f_code.co_filename.replace(os.sep, "/")
+        for phase, paths in _PHASE_PATHS:
+            if any(p in filename for p in paths):
+                return phase
+    return "other"
+
+
+class NodeProfiler:
+    def __init__(self, mode: str, output_dir: Path, interval_ms: float = DEFAULT_INTERVAL_MS):
+        self.mode = mode
+        self.output_dir = output_dir
+        self.interval_s = interval_ms / 1000
+        self._lock = threading.Lock()
+        self._active: Dict[int, str] = {}  # thread -> nodo in esecuzione
+        self._calls: Counter = Counter()
+        self._wall_ms: Counter = Counter()
+        self._samples: Counter = Counter()  # (nodo, fase) -> campioni
+        self._stacks: Counter = Counter()  # stack collassato -> campioni
+        self._profiles: Dict[str, cProfile.Profile] = {}
+        self._cprofile_busy = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample_loop, name="node-profiler", daemon=True)
+        self._sampler.start()
+
+    def wrap(self, name: str, node: Callable) -> Callable:
+        """Avvolge la funzione del nodo; la firma resta quella originale (LangGraph la ispeziona)."""
+        profiler = self
+
+        @functools.wraps(node)
+        def profiled_node(*args, **kwargs):
+            tid = threading.get_ident()
+            profile = None
+            if profiler.mode == "cprofile" and profiler._cprofile_busy.acquire(blocking=False):
+                profile = profiler._profiles.setdefault(name, cProfile.Profile())
+            with profiler._lock:
+                profiler._active[tid] = name
+            start = time.perf_counter()
+            try:
+                if profile is None:
+                    return node(*args, **kwargs)
+                profile.enable()
+                try:
+                    return node(*args, **kwargs)
+                finally:
+                    profile.disable()
+                    profiler._cprofile_busy.release()
+            finally:
+                elapsed = (time.perf_counter() - start) * 1000
+                with profiler._lock:
+                    profiler._active.pop(tid, None)
+                    profiler._calls[name] += 1
+                    profiler._wall_ms[name] += elapsed
+
+        return profiled_node
+
+    def _sample_loop(self) -> None:
+        wrapper_code = self.wrap("", lambda: None).__code__
+        while not self._stop.wait(self.interval_s):
+            with self._lock:
+                active = dict(self._active)
+            if not active:
+                continue
+            frames = sys._current_frames()
+            for tid, name in active.items():
+                frame = frames.get(tid)
+                stack = []
+                while frame is not None and frame.f_code is not wrapper_code:
+                    stack.append(frame)
+                    frame = frame.f_back
+                if frame is None:
+                    continue  # il nodo è appena terminato
+                collapsed = ";".join([name] + [f"{f.f_globals.get('__name__', '?')}:{f.f_code.co_name}"
+                                               for f in reversed(stack)])
+                phase = classify(stack)
+                with self._lock:
+                    self._samples[(name, phase)] += 1
+                    self._stacks[collapsed] += 1
+
+    def summary(self) -> Dict[str, Dict]:
+        """Per nodo: chiamate, tempo totale e medio, tempo stimato per fase (quota dei campioni sul tempo misurato)."""
+        with self._lock:
+            out = {}
+            for name, calls in sorted(self._calls.items()):
+                total = self._wall_ms[name]
+                samples = {phase: self._samples[(name, phase)] for phase in PHASES}
+                n = sum(samples.values())
+                out[name] = {
+                    "calls": calls,
+                    "total_ms": round(total, 1),
+                    "mean_ms": round(total / calls, 2),
+                    "samples": n,
+                    "phases_ms": {phase: round(total * count / n, 1) if n else None
+                                  for phase, count in samples.items()},
+                }
+            return out
+
+    def write(self) -> Path:
+        """Scrive i profili aggregati raccolti finora; restituisce la cartella."""
+        directory = self.output_dir / f"{datetime.now():%Y%m%d_%H%M%S}_{os.getpid()}"
+        directory.mkdir(parents=True, exist_ok=True)
+        summary = self.summary()
+        (directory / "nodes.json").write_text(json.dumps(summary, indent=2), encoding="utf-8")
+        with self._lock:
+            stacks = sorted(self._stacks.items())
+        with (directory / "stacks.collapsed").open("w", encoding="utf-8") as f:
+            for stack, count in stacks:
+                f.write(f"{stack} {count}\n")
+
+        lines = [f"{'node':30} {'calls':>6} {'mean ms':>9} " + " ".join(f"{p:>9}" for p in PHASES)]
+        for name, node in summary.items():
+            phases = " ".join(f"{'-' if v is None else f'{v / node['calls']:.1f}':>9}"
+                              for v in node["phases_ms"].values())
+            lines.append(f"{name:30} {node['calls']:6} {node['mean_ms']:9.1f} {phases}")
+        lines.append("(fasi in ms per chiamata, stimate dai campioni)")
+        for name, profile in sorted(self._profiles.items()):
+            profile.dump_stats(directory / f"{name}.prof")
+            stream = io.StringIO()
+            pstats.Stats(profile, stream=stream).sort_stats("cumulative").print_stats(15)
+            lines += ["", f"===== {name} (cProfile, top 15 per tempo cumulativo) =====", stream.getvalue()]
+        (directory / "profile.txt").write_text("\n".join(lines) + "\n", encoding="utf-8")
+        logger.info(f"Node profiles written to {directory}")
+        return directory
+
+    def close(self) -> None:
+        self._stop.set()
+        self._sampler.join()
+
+
+_profiler: NodeProfiler | None = None
+_profiler_lock = threading.Lock()
+
+
+def get_profiler(mode: str | None = None, output_dir: str | None = None,
+                 interval_ms: float | None = None) -> NodeProfiler | None:
+    """
+    Profiler di processo: con `mode` ("sampling"/"cprofile") lo attiva se non lo è già;
+    senza argomenti restituisce quello attivo (None se il profiling è spento).
+    """
+    global _profiler
+    with _profiler_lock:
+        if mode is None or mode == "off":
+            return _profiler
+        if _profiler is None:
+            location = Path(output_dir or "runs/profile")
+            location = location if location.is_absolute() else PROJECT_ROOT / location
+            _profiler = NodeProfiler(mode, location, interval_ms or DEFAULT_INTERVAL_MS)
+        return _profiler
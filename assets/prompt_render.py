@@ -0,0 +1,84 @@
+import json
+import math
+from functools import lru_cache
+from typing import Any, Dict, Iterable, Tuple
+
+from loguru import logger
+
+from assets.custom_obj import Incident
+
+# Campi dell'incident che non aiutano la classificazione dei topic
+IRRELEVANT_INCIDENT_FIELDS = {"created_at"}
+CHARS_PER_TOKEN = 4  # stima usata quando tiktoken non è disponibile
+
+
+@lru_cache(maxsize=8)
+def _encoder(model: str):
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        # tiktoken scarica le codifiche alla prima chiamata: offline si usa la stima
+        logger.warning(f"tiktoken encoding not available ({e}), using a {CHARS_PER_TOKEN} chars/token estimate")
+        return None
+
+
+def count_tokens(text: str, model: str = "gpt-4o-mini") -> int:
+    """Conta i token in locale (tiktoken se installato, altrimenti stima su caratteri)."""
+    encoder = _encoder(model)
+    if encoder is None:
+        return math.ceil(len(text) / CHARS_PER_TOKEN)
+    return len(encoder.encode(text))
+
+
+def truncate_to_tokens(text: str, budget: int, model: str = "gpt-4o-mini") -> str:
+    if budget <= 0 or count_tokens(text, model) <= budget:
+        return text
+    encoder = _encoder(model)
+    if encoder is None:
+        return text[:budget * CHARS_PER_TOKEN].rstrip() + "…"
+    return encoder.decode(encoder.encode(text)[:budget]).rstrip() + "…"
+
+
+def _compact(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+def render_incident(incident: Incident | Dict, token_budget: int = 0, model: str = "gpt-4o-mini") -> str:
+    """
+    JSON minimale dell'incident: senza campi nulli/vuoti o irrilevanti, senza short_description
+    quando è un prefisso della description, con la description troncata a `token_budget` token.
+    """
+    data = incident.model_dump(mode="json") if isinstance(incident, Incident) else dict(incident or {})
+    data = {k: v for k, v in data.items() if v not in (None, "") and k not in IRRELEVANT_INCIDENT_FIELDS}
+    description = data.get("description", "")
+    short = data.get("short_description", "")
+    if short and description.startswith(short.rstrip()):
+        data.pop("short_description")
+    if description:
+        data["description"] = truncate_to_tokens(description, token_budget, model)
+    return _compact(data)
+
+
+def render_topics(topics: Dict[str, float] | Iterable[str] | None) -> str:
+    """Topic in JSON compatto: lista ordinata per un insieme di nomi, score arrotondati per un dict."""
+    if isinstance(topics, dict):
+        return _compact({k: round(float(v), 2) for k, v in topics.items()})
+    return _compact(sorted(topics or []))
+
+
+def prompt_tokens(template: str, compact_input: Dict[str, Any], verbose_input: Dict[str, Any],
+                  model: str = "gpt-4o-mini") -> Tuple[int, int]:
+    """
+    Token del prompt renderizzato e token risparmiati rispetto alla serializzazione verbosa
+    (repr python di Incident, set e dict) usata in precedenza.
+    """
+    compact = count_tokens(template.format(**compact_input), model)
+    verbose = count_tokens(template.format(**verbose_input), model)
+    return compact, max(0, verbose - compact)
@@ -74,6 +74,32 @@ Existing topics in state (may be empty):
 {existing_topics}
 """
 
+# con service_graph_mode "context": le dipendenze arrivano dal grafo dei service, non vanno dedotte dal testo
+ENTITY_GRAPH_CONSULTANT_GRAPH_PROMPT = """
+You are the Entity-Graph Consultant in an incident triage pipeline.
+Goals:
+1) Read the incident, the existing topics (if any) and the service dependency graph facts.
+2) Re-score topics related to dependencies/context/release coordination.
+3) Trust the graph facts for "dependency" and the blast radius; use the incident text for the rest.
+
+Focus topics to consider:
+["dependency","deployment","incident_management","database","network","config","notification_required","diagnostics"]
+
+STRICT OUTPUT FORMAT:
+Return ONLY a single flat JSON object that maps topic names to scores in [0,1], no other keys, no prose, no markdown.
+Example:
+{{"dependency": 0.8, "deployment": 0.7}}
+
+Incident JSON:
+{incident_json}
+
+Service dependency graph:
+{service_graph}
+
+Existing topics in state (may be empty):
+{existing_topics}
+"""
+
 TOOL_SUPERVISOR_PROMPT = """
 You are the Tool Invocation Supervisor.
 Tool to call: {tool_name}
@@ -83,14 +109,7 @@ Directive (pass this string verbatim to the tool):
 
 Directive id (pass this string verbatim to the tool):
 {directive_id}
-
-Context (read-only):
-Incident JSON:
-{incident_json}
-
-Topics:
-{topics}
-
+{context}
 Rules:
 - You MUST call exactly one tool: {tool_name}.
 - Pass both `directive` and `directive_id`.
@@ -103,6 +122,16 @@ Rules:
 Do not add explanations.
 """
 
+# Contesto di TOOL_SUPERVISOR_PROMPT: solo se incident e topics non sono già passati dal Tool Decider
+TOOL_SUPERVISOR_CONTEXT = """
+Context (read-only):
+Incident JSON:
+{incident_json}
+
+Topics:
+{topics}
+"""
+
 ROUTER_SUPERVISOR_PROMPT = """
 You are the Router Supervisor. Your task is to choose ONE route for the next node.
 
@@ -1,26 +1,269 @@
+from contextlib import nullcontext
 from datetime import date
-from typing import Dict, List
+from typing import Any, Dict, List, Tuple
 
 from loguru import logger
 
-from assets.custom_obj import BaseLog
+from assets.coalescing import coalesce_incidents, apply_group_directive
+from assets.custom_obj import AgentState, BaseLog, Incident
 from assets.graph import IncidentsGraph
-from assets.utils import set_environment_variables, upload_json_incidents, upload_topics
+from assets.helper.config_helper import AppSettings
+from assets.log_setup import logging_options
+from assets.memory_profiling import get_memory_profiler
+from assets.metrics import get_metrics, start_metrics_server
+from assets.nodes.workers import seed_simulated_latency
+from assets.profiling import get_profiler
+from assets.tracing import get_tracer
+from assets.shadow import ShadowRunner
+from assets.service_graph import DEFAULT_SERVICE_GRAPH_PATH, get_service_graph
+from assets.similarity import SimilarityIndex, analysis_from_state
+from assets.streaming import wait_for_stream_drains
+from assets.utils import set_environment_variables, upload_json_incidents
+from assets.vocabulary import get_vocabulary
+from assets.outbound import get_outbound_buffer
+from assets.worker_executor import apply_outbound_failures, collect_worker_logs, get_worker_executor
 
 
-def process_input(llm_call: bool = False, n_items: int = 50, temperature: float = 0.5, model: str = "gpt-4o-mini") -> List[Dict[str, Dict[str, List[BaseLog]]]]:
-    logs: List[Dict[str, Dict[str, List[BaseLog]]]] = []
+class IncidentProcessor:
+    """
+    Tiene "caldi" il grafo compilato, l'indice di similarità, il runner shadow e il vocabolario dei
+    topic, così da poter processare più batch di incident senza ripetere il setup
+    (usato sia dalla run batch che dalla modalità servizio).
+
+    Si costruisce con `IncidentProcessor.from_settings(settings)`: è il punto d'ingresso di tutte le
+    modalità (batch, shard, work queue, serve, follow) e di benchmark.py. Il costruttore a keyword
+    resta per i test e per chi usa solo poche opzioni; i default coincidono con quelli di AppSettings.
+    """
+
+    def __init__(self, llm_call: bool = False, coalesce_window_minutes: int = 0, similarity_threshold: float = 0.0,
+                 local_classifier_threshold: float | None = None, direct_tool_dispatch: bool = False,
+                 shadow_sample_rate: float = 0.0, max_topics: int | None = None, prompt_token_budget: int = 256,
+                 streaming: bool = False, stream_early_exit: bool = False, fast_state: bool = False,
+                 worker_concurrency: Dict[str, int] | None = None, worker_timeout_s: float | None = None,
+                 outbound_window_s: float | None = None, outbound_max_batch: int | None = None,
+                 outbound_sink_path: str | None = None, cassette_mode: str = "off",
+                 cassette_path: str | None = None, cassette_replay_latency: bool = True,
+                 worker_random_seed: int | None = None, profiling: str = "off", profiling_dir: str | None = None,
+                 profiling_interval_ms: float | None = None, metrics_port: int | None = None,
+                 tracing_sample_rate: float = 0.0, tracing_dir: str | None = None,
+                 memory_profiling_every: int = 0, memory_profiling_dir: str | None = None,
+                 memory_leak_bytes_per_incident: int | None = None, service_graph_mode: str = "off",
+                 service_graph_path: str | None = None, persist: bool = True, record_labels: bool = True):
+        # persist False nei processi shard: vocabolario e indice di similarità non scrivono i file
+        # condivisi, il processo padre ne unisce i delta (vedi persistence_delta e assets.sharded).
+        # record_labels False (benchmark): gli output dei consultant LLM non finiscono nel training set
+        self.persist = persist
+        self.coalesce_window_minutes = coalesce_window_minutes
+        # profiler e tracer vanno attivati prima di costruire il grafo, che ne avvolge i nodi
+        self.profiler = get_profiler(profiling, profiling_dir, profiling_interval_ms)
+        self.tracer = get_tracer(tracing_sample_rate, tracing_dir)
+        # Snapshot tracemalloc e RSS ogni N incident, per trovare le strutture che crescono
+        self.memory = get_memory_profiler(memory_profiling_every, memory_profiling_dir,
+                                          memory_leak_bytes_per_incident)
+        self.similarity_threshold = similarity_threshold
+        self.graph = IncidentsGraph(llm_call=llm_call,
+                                    local_classifier_threshold=local_classifier_threshold,
+                                    direct_tool_dispatch=direct_tool_dispatch,
+                                    prompt_token_budget=prompt_token_budget,
+                                    streaming=streaming, stream_early_exit=stream_early_exit,
+                                    fast_state=fast_state, service_graph_mode=service_graph_mode,
+                                    record_labels=record_labels)
+        # Grafo delle dipendenze tra service usato dall'entity_graph_consultant
+        self.service_graph = get_service_graph(service_graph_path or DEFAULT_SERVICE_GRAPH_PATH) \
+            if service_graph_mode != "off" else None
+        # Indice degli incident già analizzati: sopra soglia si riusa l'analisi del vicino
+        self.index = SimilarityIndex(record_new=not persist) if similarity_threshold > 0 else None
+        # Campione di incident rieseguiti in background con il percorso LLM originale
+        self.shadow = ShadowRunner(shadow_sample_rate) if shadow_sample_rate > 0 else None
+        self.vocabulary = get_vocabulary(max_topics)
+        self.vocabulary.persist = persist
+        # Azioni dei worker eseguite in background, con limiti di concorrenza per tool/service
+        executor = get_worker_executor(worker_concurrency, worker_timeout_s)
+        # Notifiche e work note raggruppate per destinazione e inviate con chiamate bulk
+        outbound = get_outbound_buffer(outbound_window_s, outbound_max_batch, outbound_sink_path)
+        # Metriche di processo, esposte su 127.0.0.1:metrics_port (e su /metrics in modalità serve)
+        if metrics_port is not None:
+            start_metrics_server(metrics_port)
+        self.metrics = get_metrics()
+        if self.metrics is not None:
+            self.metrics.gauge_callback("incident_queue_depth", "Pending items per queue", executor.pending,
+                                        queue="worker_actions")
+            self.metrics.gauge_callback("incident_queue_depth", "Pending items per queue", outbound.pending,
+                                        queue="outbound")
+        # Chiamate LLM registrate o riprodotte da una cassette e latenze dei worker ripetibili
+        if cassette_mode != "off":
+            from assets.cassette import get_cassette
+
+            get_cassette(cassette_mode, cassette_path, cassette_replay_latency)
+        if worker_random_seed is not None:
+            seed_simulated_latency(worker_random_seed)
+
+    @classmethod
+    def from_settings(cls, settings: AppSettings, persist: bool = True,
+                      record_labels: bool = True) -> "IncidentProcessor":
+        """Unico punto in cui le impostazioni diventano argomenti del processor (batch, shard, serve, follow)."""
+        return cls(
+            llm_call=settings.llm_call,
+            coalesce_window_minutes=settings.coalesce_window_minutes,
+            similarity_threshold=settings.similarity_threshold,
+            local_classifier_threshold=settings.local_classifier_threshold,
+            direct_tool_dispatch=settings.direct_tool_dispatch,
+            shadow_sample_rate=settings.shadow_sample_rate,
+            max_topics=settings.max_topics,
+            prompt_token_budget=settings.prompt_token_budget,
+            streaming=settings.streaming,
+            stream_early_exit=settings.stream_early_exit,
+            fast_state=settings.fast_state,
+            worker_concurrency=settings.worker_concurrency,
+            worker_timeout_s=settings.worker_timeout_s,
+            outbound_window_s=settings.outbound_window_s,
+            outbound_max_batch=settings.outbound_max_batch,
+            outbound_sink_path=settings.outbound_sink_path,
+            cassette_mode=settings.cassette_mode,
+            cassette_path=settings.cassette_path,
+            cassette_replay_latency=settings.cassette_replay_latency,
+            worker_random_seed=settings.worker_random_seed,
+            profiling=settings.profiling,
+            profiling_dir=settings.profiling_dir,
+            profiling_interval_ms=settings.profiling_interval_ms,
+            metrics_port=settings.metrics_port,
+            tracing_sample_rate=settings.tracing_sample_rate,
+            tracing_dir=settings.tracing_dir,
+            memory_profiling_every=settings.memory_profiling_every,
+            memory_profiling_dir=settings.memory_profiling_dir,
+            memory_leak_bytes_per_incident=settings.memory_leak_bytes_per_incident,
+            service_graph_mode=settings.service_graph_mode,
+            service_graph_path=settings.service_graph_path,
+            persist=persist,
+            record_labels=record_labels,
+        )
+
+    def process(self, incidents: List[Incident],
+                flush_outbound: bool = True) -> List[Tuple[str, AgentState, Dict[str, List[BaseLog]]]]:
+        """
+        Analizza un batch di incident. Con `flush_outbound` False (servizio, follow, work queue) le
+        notifiche e le work note restano nei batch outbound aperti, inviati dal timer della finestra
+        o da un flush successivo: l'esito arriva nei WorkerLog all'invio.
+        :return: per ogni incident, nell'ordine di input: (id, stato finale del leader del suo gruppo, nodes_logs)
+        """
+        if self.metrics is None:
+            return self._process(incidents, flush_outbound)
+        self.metrics.add("incident_in_flight", "Incidents being analyzed", len(incidents))
+        try:
+            results = self._process(incidents, flush_outbound)
+        finally:
+            self.metrics.add("incident_in_flight", "Incidents being analyzed", -len(incidents))
+        self.metrics.inc("incident_processed_total", "Incidents analyzed", len(results))
+        return results
+
+    def _process(self, incidents: List[Incident],
+                 flush_outbound: bool) -> List[Tuple[str, AgentState, Dict[str, List[BaseLog]]]]:
+        if self.shadow is not None:
+            # ShadowLog dei batch precedenti (servizio, follow): aggiunti da questo thread
+            self.shadow.collect()
+        # posizione per oggetto e non per id: incident con lo stesso id restano distinti
+        positions = {id(inc): i for i, inc in enumerate(incidents)}
+        # Gli incident di uno stesso storm vengono analizzati una sola volta (leader)
+        groups = coalesce_incidents(incidents, self.coalesce_window_minutes)
+        if self.service_graph is not None:
+            # tutto il batch prima delle analisi: la correlazione con le dipendenze non dipende dall'ordine
+            for incident in incidents:
+                self.service_graph.observe(incident)
+        results: Dict[int, Tuple[str, AgentState, Dict[str, List[BaseLog]]]] = {}
+        for group in groups:
+            topics = self.vocabulary.topics()
+            reused = self.index.query(group.leader, self.similarity_threshold) if self.index is not None else None
+            with self.tracer.incident(group.leader.id) if self.tracer is not None else nullcontext():
+                response = self.graph.run(group.leader, reused=reused, topics=topics)
+            logger.debug(response)
+            if self.shadow is not None:
+                self.shadow.maybe_submit(group.leader, response, topics)
+            if self.index is not None and reused is None:
+                analysis = analysis_from_state(response)
+                if analysis is not None:
+                    self.index.insert(group.leader, *analysis)
+            if group.members:
+                group_logs = apply_group_directive(group, response)
+            else:
+                group_logs = {group.leader.id: response.nodes_logs}
+            for incident in group.incidents:
+                i = positions[id(incident)]
+                results[i] = (incident.id, response, group_logs[incident.id])
+                log_str = "*"*35 + f"INC {i} ANALYZED" + "*"*35
+                logger.info(log_str)
+            logger.info(" - "*30)
+            if self.memory is not None:
+                self.memory.incident_done(len(group_logs))
+        # i tool girano mentre il batch prosegue: qui si attendono e i WorkerLog tornano nei nodes_logs
+        collect_worker_logs({inc_id: nodes_logs for inc_id, _, nodes_logs in results.values()}, flush=flush_outbound)
+        # stream letti in background dopo una decisione anticipata: l'usage deve essere nei log prima del riepilogo
+        wait_for_stream_drains()
+        return [results[i] for i in sorted(results)]
+
+    def flush_outbound(self, logs_by_incident: Dict[str, Dict[str, List[BaseLog]]]) -> None:
+        """Invia i batch outbound aperti e riporta nei nodes_logs indicati l'esito dei batch falliti."""
+        apply_outbound_failures(logs_by_incident)
+
+    def persistence_delta(self) -> Dict[str, Any]:
+        """Con persist False: usi dei topic e nuove righe dell'indice di similarità da salvare nel processo padre."""
+        return {"vocabulary": self.vocabulary.delta(),
+                "similarity": list(self.index.new_rows) if self.index is not None else []}
+
+    def close(self) -> None:
+        # batch outbound lasciati aperti da process(flush_outbound=False)
+        self.flush_outbound({})
+        if self.shadow is not None:
+            self.shadow.close()
+        self.vocabulary.flush()
+        if self.profiler is not None:
+            self.profiler.write()
+        if self.tracer is not None:
+            self.tracer.write()
+        if self.memory is not None:
+            self.memory.write()
+        logger.info(f"Topic vocabulary: {self.vocabulary.stats()}")
+
+
+def process_input(settings: AppSettings) -> List[Dict[str, Dict[str, List[BaseLog]]]]:
+    """Modalità batch: i primi `n_items` incident di data/incidents.json, in un processo, su più shard o da una work queue."""
     set_environment_variables(f"incidents_analyzer_{date.today()}")
     incidents = upload_json_incidents()
-    n_items = len(incidents) if n_items > len(incidents) else n_items
-    for i, inc in enumerate(incidents[:n_items] or []):
-        topics = set(upload_topics())
-        agent_graph = IncidentsGraph(topics=topics, llm_call=llm_call)
-        response = agent_graph.run(inc)
-        logger.debug(response)
-        logs.append({f"Inc{i}": response.nodes_logs})
-        log_str = "*"*35 + f"INC {i} ANALYZED" + "*"*35
-        logger.info(log_str)
-        logger.info(" - "*30)
-    return logs
+    n_items = len(incidents) if settings.n_items > len(incidents) else settings.n_items
+    incidents = [Incident.model_validate(inc) for inc in incidents[:n_items] or []]
+    if settings.work_queue:
+        return _process_with_work_queue(incidents, settings)
+    if settings.processes > 1:
+        from assets.sharded import run_sharded
+
+        logs, _ = run_sharded(incidents, settings.processes, settings, logging_options(settings))
+        return logs
+    processor = IncidentProcessor.from_settings(settings)
+    try:
+        results = processor.process(incidents)
+    finally:
+        processor.close()
+    return [{f"Inc{i}": nodes_logs} for i, (_, _, nodes_logs) in enumerate(results)]
+
+
+def _process_with_work_queue(incidents: List[Incident], settings: AppSettings
+                             ) -> List[Dict[str, Dict[str, List[BaseLog]]]]:
+    """
+    Accoda gli incident (idempotente: più runner possono accodare lo stesso input), processa la
+    coda insieme agli altri runner e restituisce tutti i risultati del results store.
+    """
+    from assets.work_queue import aggregate_results, drain_queue, open_work_queue
 
+    queue = open_work_queue(settings.work_queue, settings.work_queue_visibility_timeout,
+                            settings.work_queue_max_attempts)
+    try:
+        added = queue.enqueue(incidents)
+        logger.info(f"Enqueued {added} new incidents ({len(incidents) - added} already in the queue)")
+        processor = IncidentProcessor.from_settings(settings)
+        try:
+            completed = drain_queue(queue, processor, lease_size=settings.work_queue_lease_size)
+        finally:
+            processor.close()
+        logger.info(f"Completed {completed} incidents; work queue: {queue.stats()}")
+        return aggregate_results(queue)
+    finally:
+        queue.close()
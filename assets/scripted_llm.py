@@ -0,0 +1,115 @@
+"""
+Chat model finto per benchmark e prove in locale: nessuna chiamata di rete, risposte scritte a
+mano per ogni prompt della pipeline (consultant, router, tool decider, agent del tool) e latenza
+per chiamata configurabile. Le risposte dipendono solo dal prompt, quindi la stessa run dà le
+stesse decisioni; l'usage (stimato dalla lunghezza del testo) alimenta il callback OpenAI come
+una risposta vera.
+
+Attivato con `set_scripted_llm(model)`: da lì `create_llm` restituisce questo modello.
+"""
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from typing import Any, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from pydantic import PrivateAttr
+
+from assets.helper.costants import DIAGNOSTIC_WORKER_NAME, ENTITY_GRAPH_CONSULTANT_NAME, LOG_WORK_NOTE_WORKER_NAME, \
+    NOTIFY_TEAM_WORKER_NAME, RESTART_WORKER_NAME, ROOT_CAUSE_CONSULTANT_NAME
+
+# topic dei consultant: sottoinsiemi scelti in modo deterministico dal prompt
+TOPIC_POOL = ("availability", "latency", "auth", "database", "network", "config", "capacity", "dependency",
+              "deployment", "incident_management", "diagnostics", "restart_candidate", "notification_required")
+TOOLS = (DIAGNOSTIC_WORKER_NAME, LOG_WORK_NOTE_WORKER_NAME, NOTIFY_TEAM_WORKER_NAME, RESTART_WORKER_NAME)
+_DIRECTIVE_RE = re.compile(r"Directive \(pass this string verbatim to the tool\):\n(.*)\n")
+_DIRECTIVE_ID_RE = re.compile(r"Directive id \(pass this string verbatim to the tool\):\n(.*)\n")
+
+_active_model = None
+
+
+def set_scripted_llm(model: Optional["ScriptedChatModel"]) -> None:
+    """Attiva (o con None disattiva) il modello finto per tutti i nodi del processo."""
+    global _active_model
+    _active_model = model
+
+
+def scripted_llm() -> Optional["ScriptedChatModel"]:
+    return _active_model
+
+
+def _digest(text: str) -> int:
+    return int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big")
+
+
+class ScriptedChatModel(BaseChatModel):
+    model: str = "gpt-4o-mini"
+    latency_ms: float = 0.0  # latenza di ogni chiamata
+    jitter_ms: float = 0.0  # variazione uniforme +/- attorno a latency_ms
+    seed: int = 0
+    _calls: int = PrivateAttr(default=0)
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    _rng: random.Random = PrivateAttr(default=None)
+
+    def model_post_init(self, __context: Any) -> None:
+        self._rng = random.Random(self.seed)
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted"
+
+    @property
+    def calls(self) -> int:
+        return self._calls
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        with self._lock:
+            self._calls += 1
+            delay = self.latency_ms + (self._rng.uniform(-self.jitter_ms, self.jitter_ms) if self.jitter_ms else 0)
+        if delay > 0:
+            time.sleep(delay / 1000)
+        text = "\n".join(str(m.content) for m in messages)
+        tools = kwargs.get("tools")
+        if tools and not any(isinstance(m, ToolMessage) for m in messages):
+            message = self._tool_call(text, tools[0]["function"]["name"])
+        else:
+            content = json.dumps(self._answer(text, messages), ensure_ascii=False)
+            message = AIMessage(content=content)
+        message.usage_metadata = {
+            "input_tokens": len(text) // 4,
+            "output_tokens": len(str(message.content)) // 4 + 1,
+            "total_tokens": len(text) // 4 + len(str(message.content)) // 4 + 1,
+        }
+        message.response_metadata = {"model_name": self.model}
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    @staticmethod
+    def _tool_call(text: str, tool_name: str) -> AIMessage:
+        directive, directive_id = _DIRECTIVE_RE.search(text), _DIRECTIVE_ID_RE.search(text)
+        args = {"directive": directive.group(1) if directive else "",
+                "directive_id": directive_id.group(1) if directive_id else ""}
+        return AIMessage(content="", tool_calls=[{"name": tool_name, "args": args, "id": f"call_{_digest(text):x}"}])
+
+    @staticmethod
+    def _answer(text: str, messages: List[BaseMessage]) -> dict:
+        h = _digest(text)
+        if isinstance(messages[-1], ToolMessage):
+            # risposta finale dell'agent: output del tool riportato verbatim
+            return {"executed_tool": messages[-1].name or "", "status": "ok",
+                    "tool_output": json.loads(messages[-1].content)}
+        if "Router Supervisor" in text:
+            route = ROOT_CAUSE_CONSULTANT_NAME if h % 2 else ENTITY_GRAPH_CONSULTANT_NAME
+            return {"route": route, "reason": "scripted", "rc_score": 0.8 if h % 2 else 0.3,
+                    "eg_score": 0.3 if h % 2 else 0.8}
+        if "Tool Decider" in text:
+            tool_name = TOOLS[h % len(TOOLS)]
+            return {"tool_name": tool_name, "confidence": 0.7, "reason": "scripted",
+                    "directive_text": f"[Directive] Execute tool '{tool_name}'"}
+        topics = [TOPIC_POOL[(h >> (4 * i)) % len(TOPIC_POOL)] for i in range(3)]
+        return {topic: round(0.5 + (h >> (8 * i)) % 50 / 100, 2) for i, topic in enumerate(topics)}
@@ -0,0 +1,264 @@
+"""
+Modalità servizio: un processo a lunga vita che mantiene caldi grafo compilato, client, vocabolario
+dei topic e cache, e accetta incident (singoli o batch) via HTTP su TCP o Unix socket.
+
+Endpoint:
+    POST /incidents[?wait=0]  body: incident, lista di incident o {"incidents": [...]}
+                              200 con il riepilogo (o 202 con l'id del job se wait=0 / timeout),
+                              400 se il payload non è valido, 503 + Retry-After se la coda è piena
+    GET  /jobs/<id>           stato e, se completato, riepilogo del job
+    GET  /health              profondità della coda e contatori
+    GET  /metrics             metriche in formato testo Prometheus (assets.metrics)
+
+Le notifiche e le work note dei job restano nei batch outbound aperti finché li invia il timer
+della finestra (`outbound_window_s`), così più job di uno storm condividono le chiamate bulk:
+`worker_success` di un job mostra l'esito del batch quando questo è stato inviato.
+"""
+import json
+import os
+import queue
+import socketserver
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import date
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List
+from urllib.parse import parse_qs, urlparse
+
+from loguru import logger
+from pydantic import ValidationError
+
+from assets.custom_obj import AgentRole, AgentState, BaseLog, Incident
+from assets.helper.config_helper import AppSettings
+from assets.metrics import CONTENT_TYPE, get_metrics
+from assets.run import IncidentProcessor
+from assets.similarity import analysis_from_state
+from assets.utils import set_environment_variables
+
+MAX_FINISHED_JOBS = 1000  # job completati consultabili via /jobs/<id>
+
+
+def summarize_result(incident_id: str, state: AgentState, nodes_logs: Dict[str, List[BaseLog]]) -> Dict[str, Any]:
+    """Riepilogo JSON dello stato finale di un incident: topic, route, tool, esito del worker e costi."""
+    topics, route, tool = analysis_from_state(state) or ({}, None, None)
+    entries = [entry for role, logs in nodes_logs.items() if role != AgentRole.shadow.value for entry in logs]
+    workers = nodes_logs.get(AgentRole.worker.value, [])
+    return {
+        "incident_id": incident_id,
+        "topics": topics,
+        "route": route,
+        "tool": tool,
+        "directive": state.directives[-1].action if state.directives else None,
+        "worker_success": getattr(workers[-1], "success", None) if workers else None,
+        "llm_calls": sum(entry.llm_count for entry in entries),
+        "total_cost": sum(entry.total_cost for entry in entries),
+        "processing_time_ms": sum(entry.processing_time for entry in entries),
+    }
+
+
+class Job:
+    def __init__(self, incidents: List[Incident]):
+        self.id = str(uuid.uuid4())
+        self.incidents = incidents
+        self.status = "queued"  # "queued", "running", "done", "failed"
+        self.result: List[Dict[str, Any]] | None = None
+        self.worker_logs: List[BaseLog | None] = []  # ultimo WorkerLog per incident, letto in to_dict
+        self.error: str | None = None
+        self.submitted_at = time.time()
+        self.done = threading.Event()
+
+    def to_dict(self) -> Dict[str, Any]:
+        results = self.result
+        if results is not None:
+            # l'esito dei batch outbound arriva nei WorkerLog dopo la fine del job
+            results = [{**summary, "worker_success": getattr(log, "success", summary["worker_success"])}
+                       for summary, log in zip(results, self.worker_logs)]
+        return {"job_id": self.id, "status": self.status, "incidents": len(self.incidents),
+                "results": results, "error": self.error}
+
+
+class AnalysisService:
+    """
+    Coda limitata di job processati in ordine da un solo worker thread, che riusa lo stesso
+    IncidentProcessor: a coda piena `submit` solleva queue.Full (backpressure verso il chiamante).
+    """
+
+    def __init__(self, processor: IncidentProcessor, queue_size: int = 64):
+        self.processor = processor
+        self._queue: queue.Queue[Job | None] = queue.Queue(maxsize=queue_size)
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.processed = 0
+        self.rejected = 0
+        self.failed = 0
+        metrics = get_metrics()
+        if metrics is not None:
+            metrics.gauge_callback("incident_queue_depth", "Pending items per queue", self._queue.qsize,
+                                   queue="service")
+        self._worker = threading.Thread(target=self._loop, name="analysis-worker", daemon=True)
+        self._worker.start()
+
+    def submit(self, incidents: List[Incident]) -> Job:
+        job = Job(incidents)
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            raise
+        with self._lock:
+            self._jobs[job.id] = job
+        return job
+
+    def get(self, job_id: str) -> Job | None:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _loop(self) -> None:
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            job.status = "running"
+            try:
+                # batch outbound inviati dal timer: nessuna attesa della finestra per job
+                results = self.processor.process(job.incidents, flush_outbound=False)
+                job.result = [summarize_result(*result) for result in results]
+                job.worker_logs = [(nodes_logs.get(AgentRole.worker.value) or [None])[-1]
+                                   for _, _, nodes_logs in results]
+                job.status = "done"
+                with self._lock:
+                    self.processed += len(job.incidents)
+            except Exception as e:
+                logger.exception(f"Job {job.id} failed: {e}")
+                job.status, job.error = "failed", str(e)
+                with self._lock:
+                    self.failed += 1
+            finally:
+                job.done.set()
+                self._forget_finished()
+
+    def _forget_finished(self) -> None:
+        with self._lock:
+            finished = [job_id for job_id, job in self._jobs.items() if job.done.is_set()]
+            for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+                del self._jobs[job_id]
+
+    def health(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"status": "ok", "queue_depth": self._queue.qsize(), "queue_size": self._queue.maxsize,
+                    "processed": self.processed, "rejected": self.rejected, "failed": self.failed}
+
+    def close(self) -> None:
+        self._queue.put(None)
+        self._worker.join()
+        self.processor.close()
+
+
+def parse_incidents(payload: Any) -> List[Incident]:
+    if isinstance(payload, dict) and "incidents" in payload:
+        payload = payload["incidents"]
+    items = payload if isinstance(payload, list) else [payload]
+    if not items:
+        raise ValueError("no incidents in request")
+    return [Incident.model_validate(item) for item in items]
+
+
+class IncidentRequestHandler(BaseHTTPRequestHandler):
+    server_version = "IncidentsAnalyzer/1.0"
+
+    @property
+    def service(self) -> AnalysisService:
+        return self.server.service  # type: ignore[attr-defined]
+
+    def _send(self, status: HTTPStatus, body: Dict[str, Any], headers: Dict[str, str] | None = None) -> None:
+        data = json.dumps(body, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self) -> None:
+        path = urlparse(self.path).path
+        if path == "/health":
+            self._send(HTTPStatus.OK, self.service.health())
+        elif path == "/metrics":
+            data = get_metrics(enable=True).render_all().encode("utf-8")
+            self.send_response(HTTPStatus.OK)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        elif path.startswith("/jobs/"):
+            job = self.service.get(path.removeprefix("/jobs/"))
+            if job is None:
+                self._send(HTTPStatus.NOT_FOUND, {"error": "unknown job"})
+            else:
+                self._send(HTTPStatus.OK, job.to_dict())
+        else:
+            self._send(HTTPStatus.NOT_FOUND, {"error": "not found"})
+
+    def do_POST(self) -> None:
+        url = urlparse(self.path)
+        if url.path != "/incidents":
+            self._send(HTTPStatus.NOT_FOUND, {"error": "not found"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            incidents = parse_incidents(json.loads(self.rfile.read(length) or b"null"))
+        except (ValueError, ValidationError) as e:
+            self._send(HTTPStatus.BAD_REQUEST, {"error": str(e)})
+            return
+        try:
+            job = self.service.submit(incidents)
+        except queue.Full:
+            self._send(HTTPStatus.SERVICE_UNAVAILABLE, {"error": "queue full"}, {"Retry-After": "1"})
+            return
+        wait = parse_qs(url.query).get("wait", ["1"])[0] not in ("0", "false")
+        if wait and job.done.wait(self.server.wait_timeout):  # type: ignore[attr-defined]
+            status = HTTPStatus.OK if job.status == "done" else HTTPStatus.INTERNAL_SERVER_ERROR
+            self._send(status, job.to_dict())
+        else:
+            self._send(HTTPStatus.ACCEPTED, job.to_dict(), {"Location": f"/jobs/{job.id}"})
+
+    def log_message(self, format: str, *args: Any) -> None:
+        # su Unix socket client_address è vuoto: niente address_string()
+        logger.debug(f"{self.command} {self.path} - " + format % args)
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self) -> None:
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+        super().server_bind()
+
+
+def serve(settings: AppSettings) -> None:
+    """Avvia il servizio e resta in ascolto fino a Ctrl+C."""
+    set_environment_variables(f"incidents_analyzer_{date.today()}")
+    get_metrics(enable=True)
+    service = AnalysisService(IncidentProcessor.from_settings(settings), settings.serve_queue_size)
+    if settings.serve_unix_socket:
+        server = UnixHTTPServer(settings.serve_unix_socket, IncidentRequestHandler)
+        address = settings.serve_unix_socket
+    else:
+        server = ThreadingHTTPServer((settings.serve_host, settings.serve_port), IncidentRequestHandler)
+        address = f"http://{settings.serve_host}:{settings.serve_port}"
+    server.service = service
+    server.wait_timeout = settings.serve_wait_timeout
+    logger.info(f"Incident analysis service listening on {address}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Shutting down the incident analysis service")
+    finally:
+        server.server_close()
+        service.close()
@@ -0,0 +1,181 @@
+"""
+Indice in memoria del grafo delle dipendenze tra service, caricato da un file JSON locale
+(`service_graph_path`, default data/service_graph.json):
+
+    {"services": {"order-api": {"kind": "api", "depends_on": ["inventory-db", ...]}, ...}}
+
+Al caricamento vengono precalcolate per ogni service le chiusure transitive upstream (i service
+da cui dipende) e downstream (quelli che dipendono da lui, cioè il blast radius): le query sono
+lookup su frozenset. L'indice registra anche gli incident visti per service (per created_at),
+così da riconoscere gli incident contemporanei sulle dipendenze.
+
+Usato dall'entity_graph_consultant secondo `service_graph_mode`:
+- direct: per i service presenti nel grafo i topic strutturali (dependency, database,
+  incident_management, notification_required) arrivano dal grafo e la chiamata LLM viene
+  saltata (topic_source "graph");
+- context: la chiamata LLM resta, con un riassunto compatto del grafo nel prompt.
+Un incident su un service assente dal grafo passa sempre dall'LLM.
+"""
+import bisect
+import json
+import threading
+from datetime import timedelta
+from pathlib import Path
+from typing import Any, Dict, FrozenSet, List, Tuple
+
+from loguru import logger
+
+from assets.custom_obj import Incident
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_SERVICE_GRAPH_PATH = "data/service_graph.json"
+CORRELATION_WINDOW_MINUTES = 30  # incident sulle dipendenze entro questa distanza sono "contemporanei"
+NOTIFY_BLAST_RADIUS = 3  # service a valle oltre i quali l'incident va notificato
+MAX_SEEN_PER_SERVICE = 1000  # incident ricordati per service (i più vecchi vengono scartati)
+MIN_SIGNAL = 0.30  # sotto questa soglia il topic non viene restituito, come nel classificatore locale
+
+
+def _key(service: str | None) -> str:
+    return (service or "").strip().lower()
+
+
+def _closure(start: str, edges: Dict[str, Tuple[str, ...]]) -> FrozenSet[str]:
+    """Nodi raggiungibili da `start` (escluso, anche in presenza di cicli)."""
+    seen = set()
+    stack = list(edges.get(start, ()))
+    while stack:
+        node = stack.pop()
+        if node not in seen and node != start:
+            seen.add(node)
+            stack.extend(edges.get(node, ()))
+    return frozenset(seen)
+
+
+class ServiceGraph:
+    def __init__(self, services: Dict[str, Dict[str, Any]],
+                 correlation_window_minutes: int = CORRELATION_WINDOW_MINUTES):
+        self.kinds: Dict[str, str] = {}
+        self.depends_on: Dict[str, Tuple[str, ...]] = {}
+        for name, spec in services.items():
+            self.kinds[_key(name)] = spec.get("kind", "service")
+            self.depends_on[_key(name)] = tuple(_key(d) for d in spec.get("depends_on", ()))
+        # service citati solo come dipendenza
+        for deps in list(self.depends_on.values()):
+            for dep in deps:
+                self.kinds.setdefault(dep, "service")
+                self.depends_on.setdefault(dep, ())
+        dependents: Dict[str, List[str]] = {name: [] for name in self.depends_on}
+        for name, deps in self.depends_on.items():
+            for dep in deps:
+                dependents[dep].append(name)
+        self.dependents = {name: tuple(sorted(names)) for name, names in dependents.items()}
+        self.upstream = {name: _closure(name, self.depends_on) for name in self.depends_on}
+        self.downstream = {name: _closure(name, self.dependents) for name in self.dependents}
+        self.window = timedelta(minutes=correlation_window_minutes)
+        self._lock = threading.Lock()
+        self._seen: Dict[str, List[Tuple[Any, str]]] = {}  # service -> [(created_at, id)] ordinati
+
+    @classmethod
+    def load(cls, path: Path) -> "ServiceGraph":
+        data = json.loads(path.read_text(encoding="utf-8"))
+        return cls(data.get("services", {}))
+
+    def __contains__(self, service: str | None) -> bool:
+        return _key(service) in self.depends_on
+
+    def __len__(self) -> int:
+        return len(self.depends_on)
+
+    def blast_radius(self, service: str | None) -> FrozenSet[str]:
+        """Service a valle (diretti e transitivi) impattati da un guasto di `service`."""
+        return self.downstream.get(_key(service), frozenset())
+
+    def observe(self, incident: Incident) -> None:
+        """Registra l'incident sul suo service (idempotente sull'id)."""
+        service = _key(incident.service)
+        if service not in self.depends_on:
+            return
+        entry = (incident.created_at, incident.id)
+        with self._lock:
+            seen = self._seen.setdefault(service, [])
+            i = bisect.bisect_left(seen, entry)
+            if i < len(seen) and seen[i] == entry:
+                return
+            seen.insert(i, entry)
+            if len(seen) > MAX_SEEN_PER_SERVICE:
+                del seen[:len(seen) - MAX_SEEN_PER_SERVICE]
+
+    def concurrent_incidents(self, incident: Incident) -> Dict[str, List[str]]:
+        """Incident registrati sui service upstream entro la finestra di correlazione: service -> id."""
+        low, high = incident.created_at - self.window, incident.created_at + self.window
+        found = {}
+        with self._lock:
+            for service in self.upstream.get(_key(incident.service), ()):
+                seen = self._seen.get(service)
+                if not seen:
+                    continue
+                start = bisect.bisect_left(seen, (low, ""))
+                ids = [inc_id for created_at, inc_id in seen[start:] if created_at <= high]
+                if ids:
+                    found[service] = ids
+        return found
+
+    def signals(self, incident: Incident) -> Dict[str, float]:
+        """Score dei topic strutturali dell'incident derivati dal grafo (vuoto se il service non è nel grafo)."""
+        service = _key(incident.service)
+        if service not in self.depends_on:
+            return {}
+        concurrent = self.concurrent_incidents(incident)
+        scores: Dict[str, float] = {}
+        if concurrent:
+            scores["dependency"] = 0.9
+        elif self.upstream[service]:
+            scores["dependency"] = min(0.3 + 0.1 * len(self.depends_on[service]), 0.6)
+        if self.kinds[service] == "database":
+            scores["database"] = 0.8
+        elif any(self.kinds[s] == "database" for s in concurrent):
+            scores["database"] = 0.7
+        radius = len(self.downstream[service])
+        if radius:
+            scores["incident_management"] = min(0.4 + 0.1 * radius, 0.9)
+        if radius >= NOTIFY_BLAST_RADIUS:
+            scores["notification_required"] = 0.7
+        return {topic: round(score, 2) for topic, score in scores.items() if score >= MIN_SIGNAL}
+
+    def prompt_context(self, incident: Incident) -> str:
+        """Riassunto compatto del grafo per il prompt dell'entity_graph_consultant."""
+        service = _key(incident.service)
+        if service not in self.depends_on:
+            return f"{service or 'unknown service'}: not in the dependency graph"
+        lines = [f"{service} ({self.kinds[service]})",
+                 f"depends on: {', '.join(self.depends_on[service]) or 'nothing'}"
+                 f" ({len(self.upstream[service])} upstream in total)",
+                 f"blast radius: {', '.join(sorted(self.downstream[service])) or 'none'}"]
+        concurrent = self.concurrent_incidents(incident)
+        if concurrent:
+            lines.append("concurrent upstream incidents: " +
+                         "; ".join(f"{s} {', '.join(ids)}" for s, ids in sorted(concurrent.items())))
+        return "\n".join(lines)
+
+
+_service_graph: ServiceGraph | None = None
+_service_graph_lock = threading.Lock()
+
+
+def get_service_graph(path: str | None = None) -> ServiceGraph | None:
+    """
+    Grafo dei service di processo: con `path` lo carica se non lo è già; senza argomenti
+    restituisce quello attivo (None se non caricato o se il file non esiste).
+    """
+    global _service_graph
+    with _service_graph_lock:
+        if path is None or _service_graph is not None:
+            return _service_graph
+        location = Path(path)
+        location = location if location.is_absolute() else PROJECT_ROOT / location
+        if not location.exists():
+            logger.warning(f"{location.name} non trovato: il grafo dei service non è disponibile")
+            return None
+        _service_graph = ServiceGraph.load(location)
+        logger.info(f"Service graph loaded from {location}: {len(_service_graph)} services")
+        return _service_graph
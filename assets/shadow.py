@@ -0,0 +1,128 @@
+import queue
+import random
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+from loguru import logger
+
+from assets.custom_obj import AgentState, AgentRole, Incident, ShadowLog, BaseLog
+from assets.graph import IncidentsGraph
+from assets.similarity import analysis_from_state
+
+
+def fast_paths(state: AgentState) -> List[str]:
+    """I percorsi economici usati dal run primario (vuoto se è stato usato il percorso LLM originale)."""
+    paths = set()
+    if not state.llm_supervisor:
+        paths.add("deterministic_router")
+    if state.direct_tool_dispatch or state.reused is not None:
+        paths.add("direct_tool_dispatch")
+    for log in state.nodes_logs.get(AgentRole.consultant.value, []):
+        source = getattr(log, "topic_source", "llm")
+        if source != "llm":
+            paths.add(f"{source}_topics")
+    return sorted(paths)
+
+
+class ShadowRunner:
+    """
+    Riesegue in background, su un campione di incident, il grafo con il percorso LLM originale
+    (supervisor LLM, nessun riuso/classificatore locale, tool non eseguito) e confronta route,
+    tool selezionato e topic con quelli del run primario.
+
+    I ShadowLog completati restano in coda finché il thread che processa gli incident non li
+    aggiunge ai nodes_logs del run primario (`collect`, `drain`): i thread shadow non modificano
+    log che nel frattempo possono essere iterati o serializzati. I run shadow non registrano
+    esempi di training per il classificatore locale.
+    """
+
+    def __init__(self, sample_rate: float, max_workers: int = 2, seed: int | None = None):
+        self.sample_rate = sample_rate
+        self._random = random.Random(seed)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="shadow")
+        self._futures: set[Future] = set()
+        self._completed: "queue.SimpleQueue[Tuple[Dict[str, List[BaseLog]], ShadowLog]]" = queue.SimpleQueue()
+        self._lock = threading.Lock()
+
+    def maybe_submit(self, incident: Incident, primary: AgentState, topics: set[str]) -> bool:
+        """
+        Campiona l'incident e ne accoda il run shadow. Il ShadowLog viene aggiunto ai
+        nodes_logs del run primario dal primo `collect` (o `drain`) dopo la fine del confronto.
+        """
+        if self.sample_rate <= 0 or self._random.random() >= self.sample_rate:
+            return False
+        paths = fast_paths(primary)
+        future = self._executor.submit(self._run, incident, primary, set(topics), paths)
+        with self._lock:
+            self._futures.add(future)
+        future.add_done_callback(self._forget)
+        logger.debug(f"Shadow run queued for {incident.id} (fast paths: {paths})")
+        return True
+
+    def _run(self, incident: Incident, primary: AgentState, topics: set[str], paths: List[str]) -> None:
+        start_time = time.perf_counter()
+        try:
+            graph = IncidentsGraph(topics=topics, llm_call=True, shadow=True, record_labels=False)
+            shadow = graph.run(incident)
+        except Exception as e:
+            logger.error(f"Shadow run failed for {incident.id}: {e}")
+            return
+        primary_analysis = analysis_from_state(primary) or ({}, None, None)
+        shadow_analysis = analysis_from_state(shadow) or ({}, None, None)
+        p_topics, s_topics = set(primary_analysis[0]), set(shadow_analysis[0])
+        union = p_topics | s_topics
+        shadow_entries: List[BaseLog] = [
+            entry for role, entries in shadow.nodes_logs.items() if role != AgentRole.shadow.value for entry in entries
+        ]
+        log = ShadowLog(
+            node_name=AgentRole.shadow.value,
+            token_usage=sum(e.token_usage for e in shadow_entries),
+            processing_time=round((time.perf_counter() - start_time) * 1000),
+            total_cost=sum(e.total_cost for e in shadow_entries),
+            llm_count=sum(e.llm_count for e in shadow_entries),
+            incident_id=incident.id,
+            fast_paths=paths,
+            primary_route=primary_analysis[1],
+            shadow_route=shadow_analysis[1],
+            primary_tool=primary_analysis[2],
+            shadow_tool=shadow_analysis[2],
+            route_match=primary_analysis[1] == shadow_analysis[1],
+            tool_match=primary_analysis[2] == shadow_analysis[2],
+            topic_overlap=len(p_topics & s_topics) / len(union) if union else 1.0,
+        )
+        self._completed.put((primary.nodes_logs, log))
+        logger.info(f"Shadow {incident.id}: route_match={log.route_match} tool_match={log.tool_match} "
+                    f"topic_overlap={log.topic_overlap:.2f}")
+
+    def _forget(self, future: Future) -> None:
+        with self._lock:
+            self._futures.discard(future)
+
+    def collect(self) -> int:
+        """
+        Aggiunge i ShadowLog completati ai nodes_logs dei rispettivi run primari, senza attendere
+        quelli in corso; da chiamare dal thread che processa gli incident.
+        :return: numero di ShadowLog aggiunti
+        """
+        added = 0
+        while True:
+            try:
+                nodes_logs, log = self._completed.get_nowait()
+            except queue.Empty:
+                return added
+            nodes_logs.setdefault(AgentRole.shadow.value, []).append(log)
+            added += 1
+
+    def drain(self) -> None:
+        """Attende i run shadow ancora in corso e ne aggiunge i log; da chiamare a fine batch, fuori dal percorso critico."""
+        with self._lock:
+            futures = list(self._futures)
+        for future in futures:
+            future.result()
+        self.collect()
+
+    def close(self) -> None:
+        self.drain()
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,206 @@
+"""
+Runner multi-processo: distribuisce gli incident su N processi worker, ognuno con il proprio
+IncidentProcessor caldo, e raccoglie i nodes_logs che i worker rimandano su una pipe in formato
+JSON compatto, un blocco di gruppi alla volta.
+
+- lo sharding tiene nello stesso processo gli incident con lo stesso fingerprint, così il
+  coalescing non viene spezzato tra processi;
+- ogni worker processa lo shard in blocchi di almeno SHARD_CHUNK_SIZE incident (gruppi interi):
+  le azioni dei tool di un blocco girano in parallelo e le notifiche partono in bulk, invece di
+  attendere i tool e inviare le chiamate outbound un gruppo alla volta;
+- il merge è indipendente dall'ordine di arrivo: i log vengono ricollocati per posizione e
+  l'aggregazione in Processed_Logs è fatta su quell'ordine;
+- ogni worker riporta il tempo effettivamente occupato, da cui l'efficienza di scaling;
+- i file condivisi (vocabolario dei topic, indice di similarità) li scrive solo il processo
+  padre: i worker gli rimandano a fine shard gli usi dei topic e le nuove righe dell'indice.
+
+I processi sono avviati con "spawn": il processo principale può avere thread attivi (loguru,
+runner shadow) che con fork verrebbero copiati in uno stato incoerente.
+"""
+import json
+import multiprocessing
+import time
+import traceback
+import zlib
+from multiprocessing.connection import Connection, wait
+from typing import Any, Dict, List, Tuple
+
+from loguru import logger
+
+from assets.coalescing import coalesce_incidents, incident_fingerprint
+from assets.custom_obj import (
+    AgentRole,
+    BaseLog,
+    CoalescedLog,
+    ConsultantLog,
+    Incident,
+    ShadowLog,
+    SupervisorLog,
+    WorkerLog,
+    merge_nodes_logs,
+)
+from assets.helper.config_helper import AppSettings
+from assets.log_setup import configure_logging, logging_options
+from assets.similarity import append_index_rows
+from assets.vocabulary import get_vocabulary
+
+SHARD_CHUNK_SIZE = 32  # incident per chiamata a process() nei worker (gruppi mai spezzati)
+LOG_TYPES = {cls.__name__: cls for cls in (BaseLog, ConsultantLog, SupervisorLog, WorkerLog, ShadowLog, CoalescedLog)}
+
+
+def encode_nodes_logs(nodes_logs: Dict[str, List[BaseLog]], exclude: Tuple[str, ...] = ()) -> Dict[str, list]:
+    """nodes_logs -> {ruolo: [[tipo, campi], ...]}, serializzabile in JSON."""
+    return {role: [[type(entry).__name__, entry.model_dump(mode="json")] for entry in entries]
+            for role, entries in nodes_logs.items() if role not in exclude}
+
+
+def decode_nodes_logs(data: Dict[str, list]) -> Dict[str, List[BaseLog]]:
+    return {role: [LOG_TYPES[kind].model_validate(fields) for kind, fields in entries]
+            for role, entries in data.items()}
+
+
+def shard_of(incident: Incident, position: int, processes: int, coalesce_window_minutes: int) -> int:
+    if coalesce_window_minutes > 0:
+        fingerprint = incident_fingerprint(incident, coalesce_window_minutes)
+        return zlib.crc32(fingerprint.encode("utf-8")) % processes
+    return position % processes
+
+
+def _send(conn: Connection, message: Dict[str, Any]) -> None:
+    conn.send_bytes(json.dumps(message, separators=(",", ":")).encode("utf-8"))
+
+
+def _shard_worker(conn: Connection, shard: List[Tuple[int, dict]], settings: AppSettings,
+                  log_options: Dict[str, Any], record_labels: bool) -> None:
+    configure_logging(**log_options)
+    try:
+        # import locale: nel processo padre il modulo non deve caricare il grafo
+        from assets.run import IncidentProcessor
+
+        processor = IncidentProcessor.from_settings(settings, persist=False, record_labels=record_labels)
+        # posizione per oggetto e non per id: incident con lo stesso id restano distinti
+        positions: Dict[int, int] = {}
+        incidents = []
+        for position, data in shard:
+            incident = Incident.model_validate(data)
+            positions[id(incident)] = position
+            incidents.append(incident)
+        busy = 0.0
+        pending_shadow: List[Tuple[int, Dict[str, List[BaseLog]]]] = []
+        chunks: List[List[Incident]] = [[]]
+        for group in coalesce_incidents(incidents, processor.coalesce_window_minutes):
+            if len(chunks[-1]) >= SHARD_CHUNK_SIZE:
+                chunks.append([])
+            chunks[-1] += group.incidents
+        for chunk in chunks:
+            if not chunk:
+                continue
+            start = time.perf_counter()
+            results = processor.process(chunk)
+            busy += time.perf_counter() - start
+            # process restituisce i risultati nell'ordine degli incident in input
+            positioned = [(positions[id(incident)], nodes_logs)
+                          for incident, (_, _, nodes_logs) in zip(chunk, results)]
+            _send(conn, {"results": [
+                [position, encode_nodes_logs(nodes_logs, exclude=(AgentRole.shadow.value,))]
+                for position, nodes_logs in positioned
+            ]})
+            pending_shadow += positioned
+        start = time.perf_counter()
+        processor.close()
+        busy += time.perf_counter() - start
+        # i ShadowLog arrivano in background: inviati a parte quando tutti i run shadow sono finiti
+        late = [[position, encode_nodes_logs({AgentRole.shadow.value: nodes_logs[AgentRole.shadow.value]})]
+                for position, nodes_logs in pending_shadow if nodes_logs.get(AgentRole.shadow.value)]
+        if late:
+            _send(conn, {"results": late})
+        # vocabolario e indice di similarità: li salva solo il processo padre
+        _send(conn, {"done": True, "busy_s": busy, **processor.persistence_delta()})
+    except Exception:
+        _send(conn, {"error": traceback.format_exc()})
+    finally:
+        conn.close()
+        # i sink accodati (async_logging, output LLM compressi) vanno svuotati prima dell'uscita del processo
+        logger.remove()
+
+
+def run_sharded(incidents: List[Incident], processes: int, settings: AppSettings,
+                log_options: Dict[str, Any] | None = None,
+                persist: bool = True) -> Tuple[List[Dict[str, Dict[str, List[BaseLog]]]], Dict[str, Any]]:
+    """
+    Processa gli incident su `processes` processi, ognuno con IncidentProcessor.from_settings(settings).
+    `log_options` (argomenti di configure_logging) se assenti sono ricavati da `settings`.
+    Con `persist` False (benchmark) i file condivisi non vengono aggiornati e i worker non
+    registrano esempi per il classificatore locale.
+    :return: (log nel formato di process_input, statistiche: wall_s, busy_s per worker, efficiency)
+    """
+    log_options = log_options or logging_options(settings)
+    window = settings.coalesce_window_minutes
+    shards: List[List[Tuple[int, dict]]] = [[] for _ in range(processes)]
+    for position, incident in enumerate(incidents):
+        shards[shard_of(incident, position, processes, window)].append((position, incident.model_dump(mode="json")))
+
+    context = multiprocessing.get_context("spawn")
+    start = time.perf_counter()
+    readers: Dict[Connection, int] = {}
+    workers = []
+    for i, shard in enumerate(shards):
+        if not shard:
+            continue
+        reader, writer = context.Pipe(duplex=False)
+        process = context.Process(target=_shard_worker, args=(writer, shard, settings, log_options, persist),
+                                  name=f"shard-{i}", daemon=True)
+        process.start()
+        writer.close()
+        readers[reader] = i
+        workers.append(process)
+    logger.info(f"Started {len(workers)} shard workers for {len(incidents)} incidents")
+
+    logs_by_position: Dict[int, Dict[str, List[BaseLog]]] = {}
+    busy: Dict[int, float] = {}
+    vocabulary_deltas: List[Dict[str, int]] = []
+    similarity_rows: List[dict] = []
+    errors = []
+    while readers:
+        for reader in wait(list(readers)):
+            shard_id = readers[reader]
+            try:
+                message = json.loads(reader.recv_bytes())
+            except EOFError:
+                errors.append(f"shard {shard_id} exited without completing")
+                del readers[reader]
+                continue
+            if "results" in message:
+                for position, data in message["results"]:
+                    logs_by_position[position] = merge_nodes_logs(logs_by_position.get(position),
+                                                                  decode_nodes_logs(data))
+            elif "done" in message:
+                busy[shard_id] = message["busy_s"]
+                vocabulary_deltas.append(message["vocabulary"])
+                similarity_rows += message["similarity"]
+                del readers[reader]
+            elif "error" in message:
+                errors.append(f"shard {shard_id} failed:\n{message['error']}")
+                del readers[reader]
+    for process in workers:
+        process.join()
+    # un solo processo scrive i file condivisi (anche con shard falliti: il lavoro concluso non va perso)
+    if persist:
+        vocabulary = get_vocabulary(settings.max_topics)
+        for delta in vocabulary_deltas:
+            vocabulary.merge(delta)
+        append_index_rows(similarity_rows)
+    if errors:
+        raise RuntimeError("\n".join(errors))
+
+    wall = time.perf_counter() - start
+    stats = {
+        "processes": len(workers),
+        "wall_s": wall,
+        "busy_s": [busy[i] for i in sorted(busy)],
+        # quota del tempo-processo disponibile effettivamente spesa ad analizzare incident
+        "efficiency": sum(busy.values()) / (len(workers) * wall) if workers and wall else 0.0,
+    }
+    logger.info(f"Sharded run: {len(incidents)} incidents on {stats['processes']} processes in {wall:.2f}s "
+                f"(efficiency {stats['efficiency']:.0%})")
+    return [{f"Inc{i}": logs_by_position[i]} for i in sorted(logs_by_position)], stats
@@ -0,0 +1,158 @@
+import hashlib
+import json
+import threading
+from array import array
+from collections import Counter, deque
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from assets.coalescing import normalize_description
+from assets.custom_obj import AgentState, Incident, SimilarAnalysis
+
+PROJECT_ROOT = Path(__file__).resolve().parent
+DEFAULT_INDEX_PATH = PROJECT_ROOT.parent / "data" / "similarity_index.jsonl"
+
+NUM_BINS = 64       # lunghezza della signature
+BANDS = 16          # NUM_BINS / BANDS righe per banda -> soglia LSH ~ (1/16)^(1/4) = 0.5
+SHINGLE_SIZE = 4    # shingle di caratteri
+BUCKET_CAP = 64     # massimo numero di candidati per bucket (i più recenti)
+MAX_CANDIDATES = 8  # candidati verificati sulla signature completa
+_EMPTY = 0xFFFFFFFF
+
+
+def shingles(text: str, size: int = SHINGLE_SIZE) -> set[str]:
+    text = normalize_description(text)
+    if len(text) <= size:
+        return {text} if text else set()
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+def signature(text: str) -> array:
+    """
+    Signature MinHash a permutazione singola (one-permutation hashing): ogni shingle
+    viene hashato una sola volta e assegnato ad uno dei NUM_BINS bin, di cui si tiene
+    il minimo. I bin vuoti vengono densificati copiando il bin pieno successivo.
+    """
+    sig = array("I", [_EMPTY]) * NUM_BINS
+    for sh in shingles(text):
+        h = int.from_bytes(hashlib.blake2b(sh.encode("utf-8"), digest_size=8).digest(), "little")
+        b = h % NUM_BINS
+        v = (h >> 32) & 0xFFFFFFFE
+        if v < sig[b]:
+            sig[b] = v
+    if any(v != _EMPTY for v in sig):
+        for b in range(NUM_BINS):
+            if sig[b] == _EMPTY:
+                step = 1
+                while sig[(b + step) % NUM_BINS] == _EMPTY:
+                    step += 1
+                sig[b] = sig[(b + step) % NUM_BINS] | 1  # marcato per non collidere con bin reali
+    return sig
+
+
+def incident_text(incident: Incident) -> str:
+    return f"{incident.short_description} {incident.description}"
+
+
+class SimilarityIndex:
+    """
+    Indice LSH degli incident già analizzati. Ogni entry conserva topic finali, route
+    e worker tool selezionato; le entry vengono aggiunte in append al file JSONL. Con
+    `record_new` (processi shard) il file viene solo letto: le nuove righe restano in `new_rows`
+    e le scrive il processo padre con append_index_rows.
+    """
+
+    def __init__(self, path: Path | None = DEFAULT_INDEX_PATH, record_new: bool = False):
+        self.path = path
+        self.new_rows: List[dict] | None = [] if record_new else None
+        self._lock = threading.Lock()
+        self._signatures: List[array] = []
+        self._entries: List[Tuple[str, Dict[str, float], str, str]] = []
+        self._buckets: List[Dict[int, deque]] = [{} for _ in range(BANDS)]
+        if path is not None and path.exists():
+            self._load()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _load(self) -> None:
+        logger.debug(f"loading similarity index: {self.path.name}")
+        with self.path.open("r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                row = json.loads(line)
+                sig = array("I")
+                sig.frombytes(bytes.fromhex(row["sig"]))
+                self._add(sig, (row["id"], row["topics"], row["route"], row["tool"]))
+        logger.info(f"Similarity index loaded with {len(self)} entries")
+
+    @staticmethod
+    def _band_keys(sig: array) -> List[int]:
+        rows = NUM_BINS // BANDS
+        return [hash(tuple(sig[i * rows:(i + 1) * rows])) for i in range(BANDS)]
+
+    def _add(self, sig: array, entry: Tuple[str, Dict[str, float], str, str]) -> None:
+        idx = len(self._entries)
+        self._signatures.append(sig)
+        self._entries.append(entry)
+        for band, key in zip(self._buckets, self._band_keys(sig)):
+            bucket = band.get(key)
+            if bucket is None:
+                bucket = band[key] = deque(maxlen=BUCKET_CAP)
+            bucket.append(idx)
+
+    def insert(self, incident: Incident, topics: Dict[str, float], route: str, tool: str) -> None:
+        sig = signature(incident_text(incident))
+        entry = (incident.id, dict(topics), route, tool)
+        row = {"id": entry[0], "topics": entry[1], "route": route, "tool": tool, "sig": sig.tobytes().hex()}
+        with self._lock:
+            self._add(sig, entry)
+            if self.new_rows is not None:
+                self.new_rows.append(row)
+            elif self.path is not None:
+                append_index_rows([row], self.path)
+
+    def query(self, incident: Incident, threshold: float) -> Optional[SimilarAnalysis]:
+        """
+        Ritorna l'analisi dell'incident più simile con similarità stimata >= threshold, altrimenti None.
+        """
+        sig = signature(incident_text(incident))
+        best_idx, best_sim = -1, 0.0
+        with self._lock:
+            # i candidati che collidono su più bande sono i più simili: si verificano solo quelli
+            hits: Counter = Counter()
+            for band, key in zip(self._buckets, self._band_keys(sig)):
+                hits.update(band.get(key, ()))
+            for idx, _ in hits.most_common(MAX_CANDIDATES):
+                sim = sum(1 for a, b in zip(sig, self._signatures[idx]) if a == b) / NUM_BINS
+                if sim > best_sim:
+                    best_idx, best_sim = idx, sim
+            if best_idx < 0 or best_sim < threshold:
+                return None
+            inc_id, topics, route, tool = self._entries[best_idx]
+        return SimilarAnalysis(incident_id=inc_id, topics=dict(topics), route=route, tool=tool, similarity=best_sim)
+
+
+def append_index_rows(rows: List[dict], path: Path = DEFAULT_INDEX_PATH) -> None:
+    """Aggiunge righe al file JSONL dell'indice con una sola scrittura."""
+    if not rows:
+        return
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("a", encoding="utf-8") as f:
+        f.write("".join(json.dumps(row, separators=(",", ":")) + "\n" for row in rows))
+
+
+def analysis_from_state(state: AgentState) -> Tuple[Dict[str, float], str, str] | None:
+    """
+    Estrae (topic finali, route, tool selezionato) dallo stato finale del grafo.
+    """
+    if state.token is None or not state.directives:
+        return None
+    route = state.token.metadata.get("agent")
+    tool = (state.directives[-1].metadata or {}).get("selected_tool")
+    if not route or not tool:
+        return None
+    return dict(state.token.topics), route, tool
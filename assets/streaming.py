@@ -0,0 +1,247 @@
+import json
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from contextlib import closing
+from typing import Any, Dict, Iterable, Iterator, List, Tuple, TYPE_CHECKING
+
+from loguru import logger
+
+from assets.log_setup import log_llm_output
+
+if TYPE_CHECKING:
+    from langchain_core.runnables import RunnableSerializable
+
+DRAIN_WORKERS = 8  # stream letti in background dopo una decisione anticipata
+
+_drain_executor: ThreadPoolExecutor | None = None
+_drain_lock = threading.Lock()
+_pending_drains: set[Future] = set()
+
+
+class IncrementalJSONParser:
+    """
+    Parser incrementale per l'oggetto JSON restituito dagli LLM: riceve i chunk dello stream e
+    rende disponibile ogni campo di primo livello non appena il suo valore è completo.
+    Il testo prima della prima `{` (es. ```json) e quello dopo la chiusura dell'oggetto è ignorato.
+    """
+
+    def __init__(self):
+        self.fields: Dict[str, Any] = {}
+        self.closed = False
+        self._started = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._member: list[str] = []
+        self._raw: list[str] = []
+
+    def feed(self, chunk: str) -> None:
+        self._raw.append(chunk)
+        for char in chunk:
+            if self.closed:
+                return
+            if not self._started:
+                if char == "{":
+                    self._started, self._depth = True, 1
+                continue
+            if self._in_string:
+                self._member.append(char)
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        # un valore stringa di primo livello è completo appena si chiude
+                        self._parse_member(final=False)
+                continue
+            if char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._parse_member(final=True)
+                    self.closed = True
+                    return
+            elif char == "," and self._depth == 1:
+                self._parse_member(final=True)
+                self._member = []
+                continue
+            self._member.append(char)
+
+    def _parse_member(self, final: bool) -> None:
+        segment = "".join(self._member).strip()
+        if not segment:
+            return
+        try:
+            self.fields.update(json.loads("{" + segment + "}"))
+        except json.JSONDecodeError:
+            if final:
+                logger.debug(f"Skipping unparsable JSON member: {segment[:80]}")
+
+    def text(self) -> str:
+        """Tutto il testo ricevuto finora."""
+        return "".join(self._raw)
+
+    def has(self, keys: Iterable[str]) -> bool:
+        return all(key in self.fields for key in keys)
+
+    def result(self) -> Dict[str, Any]:
+        """I campi letti; se l'oggetto non si è mai chiuso si tenta il parse dell'intero testo."""
+        if self.closed or self.fields:
+            return dict(self.fields)
+        try:
+            parsed = json.loads(self.text())
+        except json.JSONDecodeError:
+            return {}
+        return parsed if isinstance(parsed, dict) else {}
+
+
+def _drain_pool() -> ThreadPoolExecutor:
+    global _drain_executor
+    with _drain_lock:
+        if _drain_executor is None:
+            _drain_executor = ThreadPoolExecutor(max_workers=DRAIN_WORKERS, thread_name_prefix="stream-drain")
+        return _drain_executor
+
+
+def _submit_drain(*args) -> Future:
+    future = _drain_pool().submit(_finish_stream, *args)
+    with _drain_lock:
+        _pending_drains.add(future)
+    future.add_done_callback(_forget_drain)
+    return future
+
+
+def _forget_drain(future: Future) -> None:
+    with _drain_lock:
+        _pending_drains.discard(future)
+
+
+def wait_for_stream_drains() -> None:
+    """
+    Attende gli stream ancora letti in background dopo una decisione anticipata, così token e costo
+    sono nei log prima del riepilogo; da chiamare a fine batch, fuori dal percorso dei nodi.
+    """
+    with _drain_lock:
+        futures = list(_pending_drains)
+    if futures:
+        wait(futures)
+
+
+def _record_estimated_usage(chain: "RunnableSerializable", input: dict, handlers: list, completion: str) -> None:
+    """
+    Stima l'usage di uno stream che non l'ha riportato: token del prompt renderizzato e del testo
+    ricevuto, contati in locale e passati ai callback OpenAI come una risposta vera.
+    """
+    from langchain_core.outputs import LLMResult
+
+    from assets.prompt_render import count_tokens
+
+    llm = next((step for step in getattr(chain, "steps", ()) if hasattr(step, "model_name")), None)
+    model = getattr(llm, "model_name", None) or "gpt-4o-mini"
+    prompt_tokens = count_tokens(chain.first.invoke(input).to_string(), model)
+    completion_tokens = count_tokens(completion, model)
+    response = LLMResult(generations=[[]], llm_output={"model_name": model, "token_usage": {
+        "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens}})
+    for handler in handlers:
+        handler.on_llm_end(response)
+
+
+def _ensure_usage(parser: IncrementalJSONParser, chain: "RunnableSerializable", input: dict, handlers: list,
+                  requests_before: List[int]) -> bool:
+    """Stima l'usage se lo stream è finito senza riportarlo ai callback; True se stimato."""
+    if all(h.successful_requests == before for h, before in zip(handlers, requests_before)):
+        _record_estimated_usage(chain, input, handlers, parser.text())
+        return True
+    return False
+
+
+def _finish_stream(stream: Iterator, parser: IncrementalJSONParser, chain: "RunnableSerializable", input: dict,
+                   handlers: list, requests_before: List[int]) -> bool:
+    """
+    Legge il resto dello stream dopo la decisione, così l'ultimo chunk con l'usage arriva ai callback.
+    :return: True se l'usage non è arrivato ed è stato stimato in locale
+    """
+    with closing(stream):
+        try:
+            for chunk in stream:
+                if chunk:
+                    parser.feed(chunk)
+        except Exception as e:
+            logger.warning(f"Stream interrupted after the decision: {e}")
+    return _ensure_usage(parser, chain, input, handlers, requests_before)
+
+
+def stream_json(chain: "RunnableSerializable", input: dict, config: dict, required_keys: Tuple[str, ...] = (),
+                stop_on_decision: bool = False) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Esegue la chain in streaming interpretando il JSON man mano che arriva; lo stream è sempre letto
+    fino alla fine, perché l'ultimo chunk porta l'usage (token e costo). Se l'usage non arriva ai
+    callback OpenAI viene stimato in locale (`usage_estimated`).
+    Con `stop_on_decision` la funzione ritorna appena tutti i `required_keys` sono completi e il resto
+    dello stream viene letto in background: `usage_pending` è il Future che si completa quando il
+    callback ha l'usage (restituisce `usage_estimated`); create_node_log non lo attende ma completa
+    il log a fine lettura, e wait_for_stream_drains lo attende a fine batch.
+    :return: (campi JSON, {"ttft_ms": tempo al primo token, "decision_ms": tempo ai campi richiesti,
+             "usage_estimated": bool} oppure {..., "usage_pending": Future})
+    """
+    parser = IncrementalJSONParser()
+    handlers = [h for h in config.get("callbacks") or () if hasattr(h, "successful_requests")]  # OpenAI callback
+    requests_before = [h.successful_requests for h in handlers]
+    start = time.perf_counter()
+    ttft_ms = decision_ms = None
+    stream = iter(chain.stream(input, config=config))
+    try:
+        for chunk in stream:
+            if not chunk or parser.closed:
+                continue
+            if ttft_ms is None:
+                ttft_ms = round((time.perf_counter() - start) * 1000)
+            parser.feed(chunk)
+            if decision_ms is None and parser.has(required_keys) and (required_keys or parser.closed):
+                decision_ms = round((time.perf_counter() - start) * 1000)
+                if stop_on_decision and not parser.closed:
+                    logger.debug(f"Decision ready: {list(required_keys)} complete, reading the rest of the stream "
+                                 f"in background")
+                    result = parser.result()  # prima del submit: il parser continua a ricevere chunk in background
+                    pending = _submit_drain(stream, parser, chain, input, handlers, requests_before)
+                    return result, {"ttft_ms": ttft_ms, "decision_ms": decision_ms, "usage_pending": pending}
+    except BaseException:
+        stream.close()
+        raise
+    if decision_ms is None:
+        decision_ms = round((time.perf_counter() - start) * 1000)
+    estimated = _ensure_usage(parser, chain, input, handlers, requests_before)
+    return parser.result(), {"ttft_ms": ttft_ms, "decision_ms": decision_ms, "usage_estimated": estimated}
+
+
+def invoke_json_chain(chain: "RunnableSerializable", input: dict, config: dict, label: str, streaming: bool = False,
+                      required_keys: Tuple[str, ...] = (), stop_on_decision: bool = False, node: str | None = None
+                      ) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Invoca una chain che deve restituire un oggetto JSON, in streaming o meno.
+    Un output non interpretabile diventa `{}`; i tempi sono None senza streaming.
+    L'output è registrato con log_llm_output (campionato per `node`).
+    """
+    if streaming:
+        result_json, timing = stream_json(chain, input, config, required_keys, stop_on_decision)
+        log_llm_output(node or label, f"{label} streamed result (ttft={timing['ttft_ms']}ms, "
+                                      f"decision={timing['decision_ms']}ms): ", result_json)
+        return result_json, timing
+
+    result = chain.invoke(input, config=config)
+    log_llm_output(node or label, f"{label} raw result: ", result)
+    try:
+        result_json = json.loads(result) if isinstance(result, str) else result
+        if not isinstance(result_json, dict):
+            result_json = {}
+    except Exception as e:
+        logger.error(f"Failed to parse {label} JSON: {e}")
+        result_json = {}
+    return result_json, {"ttft_ms": None, "decision_ms": None}
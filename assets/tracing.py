@@ -0,0 +1,204 @@
+"""
+Tracing per incident in formato Chrome trace-event (JSON apribile con Perfetto o chrome://tracing):
+a differenza dei nodes_logs, che hanno solo la durata di ogni nodo, gli span hanno un inizio e
+mostrano la timeline dell'incident.
+
+Una frazione `sample_rate` degli incident viene tracciata; per gli altri l'unico costo è la
+lettura di una ContextVar. Ogni incident tracciato ha la sua traccia (thread "INC...") con:
+- incident: l'intera run del grafo;
+- node: i nodi del grafo (avvolti in IncidentsGraph, come per il profiler);
+- llm: le chiamate al chat model, da un callback LangChain registrato come quello OpenAI;
+- io: letture e scritture su file (save_topics, vocabolario dei topic);
+e una traccia "INC... tools" subito sotto per le azioni dei worker, che girano sull'event loop
+dell'esecutore e si sovrappongono ai nodi successivi (args: attesa sul semaforo ed esito).
+
+A `write()` (chiamato alla chiusura dell'IncidentProcessor) gli eventi raccolti finiscono in
+`output_dir/trace_<timestamp>_<pid>.json`.
+"""
+import functools
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.tracers.context import register_configure_hook
+from loguru import logger
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_TRACE_DIR = "runs/trace"
+MAX_EVENTS = 1_000_000  # oltre, gli span vengono scartati (la traccia resta apribile)
+
+
+class IncidentTrace:
+    """Traccia di un incident: gli span registrati qui finiscono nel Tracer con la sua coppia di thread."""
+
+    def __init__(self, tracer: "Tracer", incident_id: str, track: int):
+        self.tracer = tracer
+        self.incident_id = incident_id
+        self.track = track
+
+    def add(self, name: str, cat: str, start_ns: int, end_ns: int, tools: bool = False, **args: Any) -> None:
+        self.tracer.add_event({
+            "name": name, "cat": cat, "ph": "X",
+            "ts": (start_ns - self.tracer.origin_ns) / 1000, "dur": (end_ns - start_ns) / 1000,
+            "pid": self.tracer.pid, "tid": self.track * 2 + (1 if tools else 0),
+            **({"args": args} if args else {}),
+        })
+
+
+_current: ContextVar[Optional[IncidentTrace]] = ContextVar("incident_trace", default=None)
+
+
+def current_trace() -> Optional[IncidentTrace]:
+    """Traccia dell'incident in corso nel contesto corrente (None se non campionato)."""
+    return _current.get()
+
+
+@contextmanager
+def span(name: str, cat: str, **args: Any) -> Iterator[None]:
+    """Span nel contesto dell'incident corrente; senza traccia attiva non registra nulla."""
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter_ns()
+    try:
+        yield
+    finally:
+        trace.add(name, cat, start, time.perf_counter_ns(), **args)
+
+
+class Tracer:
+    def __init__(self, sample_rate: float, output_dir: Path, seed: int | None = None):
+        self.sample_rate = sample_rate
+        self.output_dir = output_dir
+        self.pid = os.getpid()
+        self.origin_ns = time.perf_counter_ns()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._events: List[Dict[str, Any]] = []
+        self._metadata: List[Dict[str, Any]] = [
+            {"name": "process_name", "ph": "M", "pid": self.pid, "args": {"name": f"incidents-analyzer {self.pid}"}}
+        ]
+        self._tracks = 0
+        self._dropped = 0
+
+    def add_event(self, event: Dict[str, Any]) -> None:
+        with self._lock:
+            if len(self._events) >= MAX_EVENTS:
+                self._dropped += 1
+                return
+            self._events.append(event)
+
+    @contextmanager
+    def incident(self, incident_id: str) -> Iterator[Optional[IncidentTrace]]:
+        """Campiona l'incident e, se tracciato, rende la sua traccia corrente per la durata del blocco."""
+        with self._lock:
+            sampled = self._random.random() < self.sample_rate
+            if sampled:
+                track = self._tracks
+                self._tracks += 1
+                for offset, label in ((0, incident_id), (1, f"{incident_id} tools")):
+                    tid = track * 2 + offset
+                    self._metadata += [
+                        {"name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid, "args": {"name": label}},
+                        {"name": "thread_sort_index", "ph": "M", "pid": self.pid, "tid": tid,
+                         "args": {"sort_index": tid}},
+                    ]
+        if not sampled:
+            yield None
+            return
+        trace = IncidentTrace(self, incident_id, track)
+        token = _current.set(trace)
+        handler_token = _llm_handler.set(LLMSpanHandler(trace))
+        try:
+            with span("incident", "incident", incident_id=incident_id):
+                yield trace
+        finally:
+            _llm_handler.reset(handler_token)
+            _current.reset(token)
+
+    def wrap(self, name: str, node: Callable) -> Callable:
+        """Avvolge la funzione di un nodo del grafo in uno span (la firma resta quella originale)."""
+
+        @functools.wraps(node)
+        def traced_node(*args, **kwargs):
+            with span(name, "node"):
+                return node(*args, **kwargs)
+
+        return traced_node
+
+    def write(self) -> Path | None:
+        """Scrive gli eventi raccolti finora; None se nessun incident è stato tracciato."""
+        with self._lock:
+            events = self._metadata + self._events
+            traced, dropped = self._tracks, self._dropped
+        if not traced:
+            return None
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        path = self.output_dir / f"trace_{datetime.now():%Y%m%d_%H%M%S}_{self.pid}.json"
+        path.write_text(json.dumps({"traceEvents": events, "displayTimeUnit": "ms"}), encoding="utf-8")
+        if dropped:
+            logger.warning(f"Trace event limit reached: {dropped} spans dropped")
+        logger.info(f"Trace of {traced} incidents written to {path}")
+        return path
+
+
+class LLMSpanHandler(BaseCallbackHandler):
+    """Span delle chiamate al chat model dell'incident (inizio a on_*_start, fine a on_llm_end/error)."""
+
+    def __init__(self, trace: IncidentTrace):
+        self.trace = trace
+        self._starts: Dict[UUID, int] = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id: UUID, **kwargs: Any) -> None:
+        self._starts[run_id] = time.perf_counter_ns()
+
+    def on_llm_start(self, serialized, prompts, *, run_id: UUID, **kwargs: Any) -> None:
+        self._starts[run_id] = time.perf_counter_ns()
+
+    def on_llm_end(self, response, *, run_id: UUID, **kwargs: Any) -> None:
+        start = self._starts.pop(run_id, None)
+        if start is None:
+            return
+        generation = response.generations[0][0] if response.generations and response.generations[0] else None
+        usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+        self.trace.add("llm", "llm", start, time.perf_counter_ns(), total_tokens=usage.get("total_tokens", 0))
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        start = self._starts.pop(run_id, None)
+        if start is not None:
+            self.trace.add("llm", "llm", start, time.perf_counter_ns(), error=repr(error))
+
+
+# come get_openai_callback: LangChain aggiunge il callback nella ContextVar a ogni run avviata nel contesto
+_llm_handler: ContextVar[Optional[LLMSpanHandler]] = ContextVar("incident_trace_llm_handler", default=None)
+register_configure_hook(_llm_handler, True)
+
+_tracer: Tracer | None = None
+_tracer_lock = threading.Lock()
+
+
+def get_tracer(sample_rate: float | None = None, output_dir: str | None = None) -> Tracer | None:
+    """
+    Tracer di processo: con `sample_rate` > 0 lo attiva (o ne aggiorna la frequenza di
+    campionamento); senza argomenti restituisce quello attivo (None se il tracing è spento).
+    """
+    global _tracer
+    with _tracer_lock:
+        if not sample_rate:
+            return _tracer
+        if _tracer is None:
+            location = Path(output_dir or DEFAULT_TRACE_DIR)
+            location = location if location.is_absolute() else PROJECT_ROOT / location
+            _tracer = Tracer(sample_rate, location)
+        _tracer.sample_rate = sample_rate
+        return _tracer
@@ -1,25 +1,32 @@
+from __future__ import annotations
+
 import csv
 import json
 import os
+from contextlib import nullcontext
 from datetime import date, datetime
 from pathlib import Path
-from typing import Any, Union, Dict, List, Tuple
-
-from langchain_core.language_models.chat_models import BaseChatModel
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain.agents import AgentExecutor, create_openai_tools_agent
-from langchain_core.output_parsers import StrOutputParser
+from typing import Any, Union, Dict, List, Tuple, TYPE_CHECKING
 
 from decouple import config
 from langchain_core.runnables import RunnableSerializable
 
 from assets.custom_obj import AgentState, BaseLog, WorkerLog
+from assets.tracing import span
+from assets.vocabulary import get_vocabulary
+from assets.helper.costants import RESTART_WORKER_NAME, DIAGNOSTIC_WORKER_NAME, NOTIFY_TEAM_WORKER_NAME, \
+    LOG_WORK_NOTE_WORKER_NAME
 
 from langgraph.types import Command
 from loguru import logger
 
+if TYPE_CHECKING:
+    # moduli pesanti, importati solo sui percorsi che usano davvero l'LLM
+    from langchain.agents import AgentExecutor
+    from langchain_core.language_models.chat_models import BaseChatModel
+
 
-AgentLike = Union[AgentExecutor, RunnableSerializable[dict, Any]]
+AgentLike = Union["AgentExecutor", RunnableSerializable[dict, Any]]
 def create_agent(llm: BaseChatModel, tools: list, system_prompt: str) -> AgentExecutor:
     """
     Crea un agente con tools
@@ -28,6 +35,9 @@ def create_agent(llm: BaseChatModel, tools: list, system_prompt: str) -> AgentEx
     :param system_prompt:
     :return: AgentExecutor
     """
+    from langchain.agents import AgentExecutor, create_openai_tools_agent
+    from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+
     logger.debug(f"Entering create agent function")
     prompt = ChatPromptTemplate.from_messages([
         ("system", system_prompt),
@@ -38,7 +48,55 @@ def create_agent(llm: BaseChatModel, tools: list, system_prompt: str) -> AgentEx
     agent_executor = AgentExecutor(agent=agent, tools=tools)  # type: ignore
     return agent_executor
 
+def create_llm(state: AgentState) -> BaseChatModel:
+    """
+    Crea il chat model dei nodi a partire dai parametri nello stato.
+    Va chiamata solo sui percorsi che usano davvero l'LLM.
+    In streaming l'usage viene richiesto nell'ultimo chunk, così il callback OpenAI continua a contare i token.
+    Nei batch job differiti le risposte arrivano dal batch corrente (vedi assets.batch_jobs);
+    nei benchmark il modello finto attivato con set_scripted_llm (vedi assets.scripted_llm).
+    Con una cassette attiva (vedi assets.cassette) le chiamate vengono registrate o riprodotte.
+    """
+    from assets.cassette import CassetteChatModel, get_cassette
+    from assets.scripted_llm import scripted_llm
+
+    cassette = get_cassette()
+    if cassette is not None and cassette.mode == "replay":
+        return CassetteChatModel(model=state.model, cassette=cassette)
+    if scripted_llm() is not None:
+        llm = scripted_llm()
+    elif state.deferred_llm:
+        from assets.deferred_llm import DeferredChatModel, active_store
+
+        return DeferredChatModel(model=state.model, temperature=state.temperature, store=active_store())
+    else:
+        from langchain_openai import ChatOpenAI
+
+        llm = ChatOpenAI(model=state.model, temperature=state.temperature, max_retries=3,
+                         streaming=state.streaming and cassette is None, stream_usage=state.streaming)
+    return CassetteChatModel(model=state.model, cassette=cassette, inner=llm) if cassette is not None else llm
+
+def openai_callback(enabled: bool = True):
+    """
+    Context manager del callback OpenAI per contare token e costi; se il percorso non usa
+    l'LLM restituisce None senza importare langchain_community.
+    """
+    if not enabled:
+        return nullcontext(None)
+    from langchain_community.callbacks import get_openai_callback
+
+    return get_openai_callback()
+
+def llm_api_error() -> type[Exception]:
+    """openai.APIError, importato solo quando serve (es. nella clausola except di un percorso LLM)."""
+    from openai import APIError
+
+    return APIError
+
 def create_chain(llm: BaseChatModel, system_prompt: str) -> RunnableSerializable[dict, Any]:
+    from langchain_core.output_parsers import StrOutputParser
+    from langchain_core.prompts import ChatPromptTemplate
+
     logger.debug("Entering the create chain function")
     return ChatPromptTemplate.from_template(system_prompt) | llm | StrOutputParser()
 
@@ -64,11 +122,20 @@ def set_environment_variables(project_name: str = "") -> None:
     if not project_name:
         project_name = f"Test_{date.today()}"
 
-    os.environ["OPENAI_API_KEY"] = str(config("OPENAI_API_KEY"))
+    # Le chiavi mancanti non bloccano l'avvio: servono solo se viene preso un percorso LLM
+    openai_key = config("OPENAI_API_KEY", default=None)
+    if openai_key:
+        os.environ["OPENAI_API_KEY"] = str(openai_key)
+    else:
+        logger.warning("OPENAI_API_KEY not set: only the no-LLM paths will work")
 
-    os.environ["LANGCHAIN_TRACING_V2"] = "true"
-    os.environ["LANGCHAIN_API_KEY"] = str(config("LANGCHAIN_API_KEY"))
-    os.environ["LANGCHAIN_PROJECT"] = project_name
+    langchain_key = config("LANGCHAIN_API_KEY", default=None)
+    if langchain_key:
+        os.environ["LANGCHAIN_TRACING_V2"] = "true"
+        os.environ["LANGCHAIN_API_KEY"] = str(langchain_key)
+        os.environ["LANGCHAIN_PROJECT"] = project_name
+    else:
+        logger.info("LANGCHAIN_API_KEY not set: LangSmith tracing disabled")
 
 
 def upload_json_incidents() -> List[Dict]|None:
@@ -107,17 +174,13 @@ def upload_topics(strip: bool = True, drop_empty: bool = True)-> List[str]|None:
     return items if items else []
 
 def save_topics(topics: Dict[str,float])-> None:
+    """
+    Registra i topic nel vocabolario condiviso (canonicalizzazione, contatori d'uso e limite
+    massimo); il vocabolario li persiste su data/topics.txt.
+    """
     logger.debug("Entering the save topics function")
-    PROJECT_ROOT = Path(__file__).resolve().parent
-    path = PROJECT_ROOT.parent / "data" / "topics.txt"
-    new_topics = set(topics.keys())
-    saved_topics = set(upload_topics())
-    all_topics = new_topics | saved_topics
-    logger.info("Saving new topics to file")
-    with open(path, "w", newline="", encoding="utf-8") as f:
-        w = csv.writer(f)
-        w.writerow(all_topics)
-    pass
+    with span("save_topics", "io", topics=len(topics)):
+        get_vocabulary().observe(topics)
 
 def group_scores(topics: Dict[str, float]) -> tuple[float, float, str, str]:
     logger.debug("Entering the group score function")
@@ -162,21 +225,21 @@ def choose_worker_tool(topics: Dict[str, float], incident: Dict) -> Tuple[str, f
 
     # 1) Restart se forte candidato e il ticket non è chiuso
     if t.get("restart_candidate", 0.0) >= 0.70 and state not in {"resolved", "closed"}:
-        return "restart_worker", t["restart_candidate"], "restart_candidate strong and ticket open"
+        return RESTART_WORKER_NAME, t["restart_candidate"], "restart_candidate strong and ticket open"
 
     # 2) Notifica se richiesta esplicita o impatto alto + availability molto alto
     if t.get("notification_required", 0.0) >= 0.70:
-        return "notify_team_worker", t["notification_required"], "notification_required strong"
+        return NOTIFY_TEAM_WORKER_NAME, t["notification_required"], "notification_required strong"
     if impact == 1 and t.get("availability", 0.0) >= 0.85:
-        return "notify_team_worker", t["availability"], "high impact + availability signal"
+        return NOTIFY_TEAM_WORKER_NAME, t["availability"], "high impact + availability signal"
 
     # 3) Diagnostica se richiesto/utile
     if t.get("diagnostics", 0.0) >= 0.60:
-        return "diagnostics_worker", t["diagnostics"], "diagnostics indicated"
+        return DIAGNOSTIC_WORKER_NAME, t["diagnostics"], "diagnostics indicated"
 
     # 4) Fallback: log work note
     conf = max(t.get("incident_management", 0.0), 0.50)
-    return "log_work_note_worker", conf, "fallback to work note"
+    return LOG_WORK_NOTE_WORKER_NAME, conf, "fallback to work note"
 
 def parse_worker_log(raw_output: str | dict) -> WorkerLog | dict | None:
     """
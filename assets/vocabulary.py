@@ -0,0 +1,218 @@
+import csv
+import json
+import os
+import re
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List
+
+from loguru import logger
+
+from assets.tracing import span
+
+PROJECT_ROOT = Path(__file__).resolve().parent
+DATA_DIR = PROJECT_ROOT.parent / "data"
+DEFAULT_TOPICS_PATH = DATA_DIR / "topics.txt"
+DEFAULT_COUNTS_PATH = DATA_DIR / "topic_counts.json"
+DEFAULT_SYNONYMS_PATH = DATA_DIR / "topic_synonyms.json"
+
+# Ontologia dei prompt: questi topic non vengono mai rimossi dal vocabolario
+CORE_TOPICS = frozenset({
+    "availability", "latency", "auth", "database", "network", "config", "capacity",
+    "dependency", "deployment", "incident_management", "diagnostics", "restart_candidate",
+    "notification_required",
+})
+DEFAULT_MAX_TOPICS = 64
+COUNTS_FLUSH_EVERY = 50
+# osservazioni durante le quali un topic appena aggiunto non è candidato alla rimozione:
+# altrimenti, a limite raggiunto, un topic nuovo (conteggio 1) sarebbe sempre il primo rimosso
+EVICTION_GRACE = 50
+
+_SEPARATORS_RE = re.compile(r"[\s\-/.]+")
+_INVALID_RE = re.compile(r"[^a-z0-9_]")
+
+
+class TopicVocabulary:
+    """
+    Vocabolario dei topic condiviso da tutti i consultant: canonicalizza le varianti proposte
+    dagli LLM (maiuscole, plurali, sinonimi), conta l'uso di ogni topic e mantiene al massimo
+    `max_topics` voci, rimuovendo quelle meno usate tra quelle fuori dal periodo di grazia
+    (`EVICTION_GRACE` osservazioni dall'aggiunta). Persistito su topics.txt (formato invariato)
+    e topic_counts.json, sostituiti in modo atomico. Con `persist` False (processi shard) i file
+    non vengono scritti: gli incrementi restano in `delta()` e il processo padre li unisce con `merge()`.
+    """
+
+    def __init__(self, max_topics: int = DEFAULT_MAX_TOPICS, topics_path: Path = DEFAULT_TOPICS_PATH,
+                 counts_path: Path = DEFAULT_COUNTS_PATH, synonyms_path: Path = DEFAULT_SYNONYMS_PATH):
+        self.max_topics = max_topics
+        self.topics_path = topics_path
+        self.counts_path = counts_path
+        self.persist = True
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._delta: Counter = Counter()
+        # numero di osservazioni e osservazione in cui ogni topic nuovo è entrato nel vocabolario
+        self._observations = 0
+        self._added: Dict[str, int] = {}
+        self.synonyms: Dict[str, str] = {}
+        if synonyms_path.exists():
+            self.synonyms = {self._normalize(k): self._normalize(v)
+                             for k, v in json.loads(synonyms_path.read_text(encoding="utf-8")).items()}
+        self.counts: Dict[str, int] = {}
+        if counts_path.exists():
+            self.counts = {k: int(v) for k, v in json.loads(counts_path.read_text(encoding="utf-8")).items()}
+        for topic in self._read_topics() | CORE_TOPICS:
+            self.counts.setdefault(self.canonicalize(topic), 0)
+        if self._evict():
+            self._write_topics()
+
+    @staticmethod
+    def _normalize(name: str) -> str:
+        name = _SEPARATORS_RE.sub("_", str(name).lower().strip())
+        return _INVALID_RE.sub("", name).strip("_")
+
+    def _read_topics(self) -> set[str]:
+        if not self.topics_path.exists():
+            return set()
+        with self.topics_path.open("r", encoding="utf-8", newline="") as f:
+            return {cell.strip() for row in csv.reader(f) for cell in row if cell.strip()}
+
+    def canonicalize(self, name: str) -> str:
+        """Forma canonica di un topic: minuscolo snake_case, sinonimi risolti, plurali ridotti al singolare noto."""
+        topic = self._normalize(name)
+        topic = self.synonyms.get(topic, topic)
+        if topic in self.counts or topic in CORE_TOPICS:
+            return topic
+        for suffix, replacement in (("ies", "y"), ("es", ""), ("s", "")):
+            if topic.endswith(suffix):
+                singular = self.synonyms.get(topic[:-len(suffix)] + replacement, topic[:-len(suffix)] + replacement)
+                if singular in self.counts or singular in CORE_TOPICS:
+                    return singular
+        return topic
+
+    def canonicalize_scores(self, topics: Dict[str, float]) -> Dict[str, float]:
+        """Canonicalizza le chiavi di un dict topic -> score, tenendo lo score massimo in caso di collisione."""
+        out: Dict[str, float] = {}
+        for name, score in (topics or {}).items():
+            topic = self.canonicalize(name)
+            if not topic:
+                continue
+            try:
+                score = float(score)
+            except (TypeError, ValueError):
+                continue
+            out[topic] = max(score, out.get(topic, score))
+        return out
+
+    def observe(self, topics: Dict[str, float]) -> None:
+        """Registra l'uso dei topic: aggiorna i contatori, aggiunge i nuovi e applica il limite."""
+        with self._lock:
+            before = set(self.counts)
+            self._observations += 1
+            for topic in self.canonicalize_scores(topics):
+                if topic not in self.counts:
+                    self._added[topic] = self._observations
+                self.counts[topic] = self.counts.get(topic, 0) + 1
+                if not self.persist:
+                    self._delta[topic] += 1
+            evicted = self._evict()
+            self._pending += 1
+            if set(self.counts) != before or evicted:
+                self._write_topics()
+                self._write_counts()
+            elif self._pending >= COUNTS_FLUSH_EVERY:
+                self._write_counts()
+
+    def _evict(self) -> List[str]:
+        overflow = len(self.counts) - self.max_topics
+        if overflow <= 0:
+            return []
+        # prima i topic fuori dal periodo di grazia; quelli nuovi solo se non basta (il limite resta rigido)
+        candidates = sorted((t for t in self.counts if t not in CORE_TOPICS),
+                            key=lambda t: (self._in_grace(t), self.counts[t], t))
+        evicted = candidates[:overflow]
+        for topic in evicted:
+            del self.counts[topic]
+            self._added.pop(topic, None)
+        logger.info(f"Topic vocabulary capped at {self.max_topics}: evicted {evicted}")
+        return evicted
+
+    def _in_grace(self, topic: str) -> bool:
+        added = self._added.get(topic)
+        return added is not None and self._observations - added < EVICTION_GRACE
+
+    @staticmethod
+    def _replace(path: Path, write) -> None:
+        # file temporaneo + os.replace: chi legge vede sempre la versione vecchia o quella nuova completa
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        with open(tmp, "w", newline="", encoding="utf-8") as f:
+            write(f)
+        os.replace(tmp, path)
+
+    def _write_topics(self) -> None:
+        if not self.persist:
+            return
+        logger.info("Saving topic vocabulary to file")
+        with span("write_topics", "io", path=self.topics_path.name):
+            self._replace(self.topics_path, lambda f: csv.writer(f).writerow(sorted(self.counts)))
+
+    def _write_counts(self) -> None:
+        self._pending = 0
+        if not self.persist:
+            return
+        with span("write_topic_counts", "io", path=self.counts_path.name):
+            self._replace(self.counts_path, lambda f: f.write(json.dumps(self.counts, indent=2, sort_keys=True)))
+
+    def flush(self) -> None:
+        with self._lock:
+            self._write_counts()
+
+    def delta(self) -> Dict[str, int]:
+        """Usi dei topic registrati senza persistenza (`persist` False), da unire nel processo padre."""
+        with self._lock:
+            return dict(self._delta)
+
+    def merge(self, delta: Dict[str, int]) -> None:
+        """Somma gli usi registrati da un altro processo e salva il vocabolario."""
+        with self._lock:
+            for topic, count in delta.items():
+                if topic not in self.counts:
+                    self._added[topic] = self._observations
+                self.counts[topic] = self.counts.get(topic, 0) + int(count)
+            self._evict()
+            self._write_topics()
+            self._write_counts()
+
+    def topics(self) -> set[str]:
+        with self._lock:
+            return set(self.counts)
+
+    def stats(self) -> Dict[str, int]:
+        """Dimensione del vocabolario e del blocco `existing_topics` che finisce nei prompt."""
+        with self._lock:
+            return {
+                "size": len(self.counts),
+                "max_topics": self.max_topics,
+                "prompt_chars": len(json.dumps(sorted(self.counts), separators=(",", ":"))),
+            }
+
+
+_vocabulary: TopicVocabulary | None = None
+_vocabulary_lock = threading.Lock()
+
+
+def get_vocabulary(max_topics: int | None = None) -> TopicVocabulary:
+    """Istanza di processo del vocabolario; `max_topics` aggiorna il limite se indicato."""
+    global _vocabulary
+    with _vocabulary_lock:
+        if _vocabulary is None:
+            _vocabulary = TopicVocabulary(max_topics or DEFAULT_MAX_TOPICS)
+        elif max_topics is not None and max_topics != _vocabulary.max_topics:
+            _vocabulary.max_topics = max_topics
+            with _vocabulary._lock:
+                if _vocabulary._evict():
+                    _vocabulary._write_topics()
+                    _vocabulary._write_counts()
+        return _vocabulary
@@ -0,0 +1,257 @@
+"""
+Coda di lavoro condivisa per i backfill: più runner (processi o host) prelevano incident dalla
+stessa coda e scrivono i nodes_logs di ogni incident in un results store comune, da cui si
+ricava il riepilogo finale.
+
+- lease con visibility timeout: un incident preso da un runner che muore torna disponibile
+  alla scadenza del lease;
+- completamento idempotente per `Incident.id`: se due runner completano lo stesso incident
+  (lease scaduto e ripreso) vale il primo risultato;
+- ogni lease conta come tentativo: dopo `max_attempts` l'incident finisce in dead-letter
+  con l'ultimo errore;
+- un gruppo di incident (vedi coalescing) che fallisce viene rilasciato con `fail` e non
+  rieseguito subito: gli altri gruppi del lease sono completati, così le azioni già
+  dispacciate non ripartono con nuovi directive id.
+
+`WorkQueue` è l'interfaccia dei backend; `SQLiteWorkQueue` è l'implementazione locale, adatta a
+più processi sulla stessa macchina e ai test. Un backend distribuito (es. su un database di
+rete) implementa gli stessi metodi: SQLite su filesystem di rete non garantisce i lock.
+"""
+import json
+import os
+import socket
+import sqlite3
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple
+
+from loguru import logger
+
+from assets.coalescing import coalesce_incidents
+from assets.custom_obj import BaseLog, Incident
+from assets.sharded import decode_nodes_logs, encode_nodes_logs
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id TEXT PRIMARY KEY,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    lease_owner TEXT,
+    lease_expires REAL,
+    last_error TEXT,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, lease_expires);
+CREATE TABLE IF NOT EXISTS results (
+    id TEXT PRIMARY KEY,
+    logs TEXT NOT NULL,
+    worker TEXT NOT NULL,
+    completed_at REAL NOT NULL
+);
+"""
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class WorkQueue(ABC):
+    """Interfaccia dei backend della coda di lavoro."""
+
+    @abstractmethod
+    def enqueue(self, incidents: List[Incident]) -> int:
+        """Accoda gli incident non ancora presenti (per id); restituisce quanti sono stati aggiunti."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def lease(self, worker_id: str, max_items: int) -> List[Incident]:
+        """Prende in lease fino a `max_items` incident disponibili (nuovi, da ritentare o con lease scaduto)."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def complete(self, worker_id: str, incident_id: str, nodes_logs: Dict[str, List[BaseLog]]) -> bool:
+        """Salva il risultato; False se l'incident era già stato completato (il risultato viene ignorato)."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def fail(self, worker_id: str, incident_id: str, error: str) -> str:
+        """Rilascia il lease dopo un errore; restituisce il nuovo stato ("pending" o "dead")."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def stats(self) -> Dict[str, int]:
+        """Numero di incident per stato: pending, leased, done, dead."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def results(self) -> Iterator[Tuple[str, Dict[str, List[BaseLog]]]]:
+        """(id, nodes_logs) di tutti gli incident completati, in ordine di completamento."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def dead_letters(self) -> List[Tuple[str, int, str | None]]:
+        """(id, tentativi, ultimo errore) degli incident in dead-letter."""
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class SQLiteWorkQueue(WorkQueue):
+    def __init__(self, path: Path, visibility_timeout: float = 600.0, max_attempts: int = 3):
+        self.path = path
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # autocommit: le transazioni sono aperte esplicitamente con BEGIN IMMEDIATE
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+
+    def _transaction(self):
+        self._conn.execute("BEGIN IMMEDIATE")
+        return self._conn
+
+    def enqueue(self, incidents: List[Incident]) -> int:
+        now = time.time()
+        before = self._conn.total_changes
+        conn = self._transaction()
+        try:
+            conn.executemany("INSERT OR IGNORE INTO tasks (id, payload, updated_at) VALUES (?, ?, ?)",
+                             [(inc.id, inc.model_dump_json(), now) for inc in incidents])
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return self._conn.total_changes - before
+
+    def lease(self, worker_id: str, max_items: int) -> List[Incident]:
+        now = time.time()
+        conn = self._transaction()
+        try:
+            # lease scaduti senza più tentativi disponibili: dead-letter invece di un nuovo lease
+            conn.execute("UPDATE tasks SET status = 'dead', lease_owner = NULL, updated_at = ?, "
+                         "last_error = COALESCE(last_error, 'lease expired') "
+                         "WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?",
+                         (now, now, self.max_attempts))
+            rows = conn.execute("SELECT id, payload FROM tasks "
+                                "WHERE status = 'pending' OR (status = 'leased' AND lease_expires < ?) "
+                                "ORDER BY rowid LIMIT ?", (now, max_items)).fetchall()
+            conn.executemany("UPDATE tasks SET status = 'leased', lease_owner = ?, lease_expires = ?, "
+                             "attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                             [(worker_id, now + self.visibility_timeout, now, row[0]) for row in rows])
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return [Incident.model_validate_json(payload) for _, payload in rows]
+
+    def complete(self, worker_id: str, incident_id: str, nodes_logs: Dict[str, List[BaseLog]]) -> bool:
+        now = time.time()
+        conn = self._transaction()
+        try:
+            inserted = conn.execute(
+                "INSERT OR IGNORE INTO results (id, logs, worker, completed_at) VALUES (?, ?, ?, ?)",
+                (incident_id, json.dumps(encode_nodes_logs(nodes_logs), separators=(",", ":")), worker_id, now)
+            ).rowcount == 1
+            if inserted:
+                conn.execute("UPDATE tasks SET status = 'done', lease_owner = NULL, updated_at = ? WHERE id = ?",
+                             (now, incident_id))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        if not inserted:
+            logger.warning(f"{incident_id} already completed: result from {worker_id} ignored")
+        return inserted
+
+    def fail(self, worker_id: str, incident_id: str, error: str) -> str:
+        now = time.time()
+        conn = self._transaction()
+        try:
+            conn.execute("UPDATE tasks SET status = CASE WHEN attempts >= ? THEN 'dead' ELSE 'pending' END, "
+                         "lease_owner = NULL, lease_expires = NULL, last_error = ?, updated_at = ? "
+                         "WHERE id = ? AND status = 'leased' AND lease_owner = ?",
+                         (self.max_attempts, error[-2000:], now, incident_id, worker_id))
+            row = conn.execute("SELECT status FROM tasks WHERE id = ?", (incident_id,)).fetchone()
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return row[0] if row else "missing"
+
+    def stats(self) -> Dict[str, int]:
+        counts = {"pending": 0, "leased": 0, "done": 0, "dead": 0}
+        counts.update(self._conn.execute("SELECT status, COUNT(*) FROM tasks GROUP BY status").fetchall())
+        return counts
+
+    def results(self) -> Iterator[Tuple[str, Dict[str, List[BaseLog]]]]:
+        for incident_id, logs in self._conn.execute("SELECT id, logs FROM results ORDER BY completed_at, id"):
+            yield incident_id, decode_nodes_logs(json.loads(logs))
+
+    def dead_letters(self) -> List[Tuple[str, int, str | None]]:
+        return self._conn.execute("SELECT id, attempts, last_error FROM tasks WHERE status = 'dead' "
+                                  "ORDER BY rowid").fetchall()
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+def open_work_queue(location: str, visibility_timeout: float = 600.0, max_attempts: int = 3) -> WorkQueue:
+    """Apre il backend indicato da `location`: per ora un file SQLite (relativo alla root del progetto)."""
+    path = Path(location.removeprefix("sqlite:///"))
+    path = path if path.is_absolute() else PROJECT_ROOT / path
+    return SQLiteWorkQueue(path, visibility_timeout, max_attempts)
+
+
+def drain_queue(queue: WorkQueue, processor, worker_id: str | None = None, lease_size: int = 16,
+                poll_interval: float = 1.0) -> int:
+    """
+    Preleva e processa incident finché la coda non è vuota e nessun altro runner ha lease attivi
+    (un lease che scade viene ripreso da qui). `processor` è un IncidentProcessor: ogni lease è
+    processato un gruppo alla volta e un errore rilascia solo gli incident del gruppo fallito.
+    :return: numero di incident completati da questo runner
+    """
+    worker_id = worker_id or default_worker_id()
+    completed = 0
+    while True:
+        incidents = queue.lease(worker_id, lease_size)
+        if not incidents:
+            if not queue.stats()["leased"]:
+                return completed
+            time.sleep(poll_interval)
+            continue
+        if processor.service_graph is not None:
+            # tutto il lease prima delle analisi, come in process: i gruppi sono processati uno alla volta
+            for incident in incidents:
+                processor.service_graph.observe(incident)
+        results = []
+        for group in coalesce_incidents(incidents, processor.coalesce_window_minutes):
+            try:
+                results += [(inc_id, nodes_logs) for inc_id, _, nodes_logs
+                            in processor.process(group.incidents, flush_outbound=False)]
+            except Exception as e:
+                # solo il gruppo fallito torna in coda (o in dead-letter): gli altri non vengono rieseguiti
+                for incident in group.incidents:
+                    status = queue.fail(worker_id, incident.id, repr(e))
+                    logger.error(f"{incident.id} failed ({e}): {status}")
+        # un solo flush outbound per lease: gli esiti dei batch nei WorkerLog prima di salvarli
+        processor.flush_outbound(dict(results))
+        if processor.shadow is not None:
+            # i ShadowLog devono essere nei nodes_logs prima di scriverli nel results store
+            processor.shadow.drain()
+        for inc_id, nodes_logs in results:
+            completed += queue.complete(worker_id, inc_id, nodes_logs)
+        logger.info(f"Work queue: {queue.stats()}")
+
+
+def aggregate_results(queue: WorkQueue) -> List[Dict[str, Dict[str, List[BaseLog]]]]:
+    """Tutti i risultati del results store nel formato di process_input, per il riepilogo finale."""
+    dead = queue.dead_letters()
+    for incident_id, attempts, error in dead:
+        logger.error(f"Dead-lettered {incident_id} after {attempts} attempts: {error}")
+    return [{f"Inc{i}": nodes_logs} for i, (_, nodes_logs) in enumerate(queue.results())]
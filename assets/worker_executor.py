@@ -0,0 +1,234 @@
+"""
+Esecutore asincrono delle azioni dei worker (restart, diagnostica, notifiche, work note).
+
+- le azioni girano su un event loop dedicato, in un thread: il supervisor le sottomette e
+  prosegue, l'esito viene raccolto a fine batch (`collect`);
+- concorrenza limitata per tool e per service (es. al più 2 restart contemporanei sullo stesso
+  service), con timeout per azione;
+- idempotenza per `directive_id`: una directive già sottomessa non viene rieseguita e restituisce
+  lo stesso risultato (delle azioni concluse si ricorda solo il WorkerLog);
+- le coroutine partono in un contesto vuoto: la Task non trattiene il contesto del nodo
+  LangGraph che le ha sottomesse (config di pregel, nodes_logs, ...);
+- nel WorkerLog finiscono il tempo di esecuzione misurato e l'esito reale
+  ("ok", "timeout" o "error: ...").
+"""
+import asyncio
+import contextvars
+import functools
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Tuple
+
+from loguru import logger
+
+from assets.custom_obj import AgentRole, BaseLog, WorkerLog
+from assets.helper.costants import DIAGNOSTIC_WORKER_NAME, LOG_WORK_NOTE_WORKER_NAME, NOTIFY_TEAM_WORKER_NAME, \
+    RESTART_WORKER_NAME
+from assets.helper.logging import worker_log_factory
+from assets.outbound import get_outbound_buffer
+from assets.tracing import IncidentTrace, current_trace
+
+# (directive, directive_id, service) -> id del batch outbound o None
+Action = Callable[[str, str, str], Awaitable[str | None]]
+
+# azioni contemporanee per (tool, service); notifiche e work note si limitano ad accodarsi nel
+# buffer outbound, inviato a fine run batch da collect_worker_logs o dal timer della finestra
+DEFAULT_CONCURRENCY = {
+    RESTART_WORKER_NAME: 2,
+    DIAGNOSTIC_WORKER_NAME: 4,
+    NOTIFY_TEAM_WORKER_NAME: 64,
+    LOG_WORK_NOTE_WORKER_NAME: 64,
+}
+DEFAULT_TIMEOUT_S = 30.0
+MAX_RESULTS = 10_000  # risultati completati ricordati per la deduplica
+ANY_SERVICE = "*"
+
+
+class WorkerExecutor:
+    def __init__(self, actions: Dict[str, Action], concurrency: Dict[str, int] | None = None,
+                 timeout_s: float = DEFAULT_TIMEOUT_S, max_results: int = MAX_RESULTS):
+        self.actions = actions
+        self.concurrency = {**DEFAULT_CONCURRENCY, **(concurrency or {})}
+        self.timeout_s = timeout_s
+        self.max_results = max_results
+        self._semaphores: Dict[Tuple[str, str], asyncio.Semaphore] = {}
+        self._pending: Dict[str, Future] = {}
+        self._results: "OrderedDict[str, WorkerLog]" = OrderedDict()
+        self._by_incident: Dict[str, List[str]] = {}
+        self._lock = threading.Lock()
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="worker-executor", daemon=True)
+        self._thread.start()
+
+    def submit(self, tool_name: str, directive: str, directive_id: str, service: str | None = None,
+               incident_id: str | None = None) -> "Future[WorkerLog]":
+        """
+        Sottomette l'azione senza attenderla. Con `incident_id` il WorkerLog viene poi
+        restituito da `collect(incident_id)`.
+        """
+        submitted = None
+        with self._lock:
+            if incident_id is not None:
+                self._by_incident.setdefault(incident_id, []).append(directive_id)
+            future = self._pending.get(directive_id)
+            if future is None and directive_id in self._results:
+                future = Future()
+                future.set_result(self._results[directive_id])
+            if future is not None:
+                logger.info(f"Directive {directive_id} already submitted: reusing its result")
+                return future
+            # contesto vuoto: la traccia dell'incident va passata esplicitamente
+            coroutine = self._execute(tool_name, directive, directive_id, service or ANY_SERVICE, current_trace())
+            submitted = contextvars.Context().run(asyncio.run_coroutine_threadsafe, coroutine, self._loop)
+            self._pending[directive_id] = submitted
+        # fuori dal lock: se l'azione è già conclusa il callback gira subito in questo thread
+        submitted.add_done_callback(functools.partial(self._completed, directive_id))
+        return submitted
+
+    def run(self, tool_name: str, directive: str, directive_id: str, service: str | None = None) -> WorkerLog:
+        """Esegue l'azione e ne attende l'esito (percorso agent)."""
+        return self.submit(tool_name, directive, directive_id, service).result()
+
+    def collect(self, incident_id: str) -> List[WorkerLog]:
+        """Attende le azioni sottomesse per l'incident e ne restituisce i WorkerLog (una volta sola)."""
+        with self._lock:
+            entries = [self._pending.get(d) or self._results.get(d) for d in self._by_incident.pop(incident_id, [])]
+        return [entry.result() if isinstance(entry, Future) else entry for entry in entries if entry is not None]
+
+    def _completed(self, directive_id: str, future: Future) -> None:
+        # del Future (e della Task) resta solo il WorkerLog
+        with self._lock:
+            self._pending.pop(directive_id, None)
+            if future.cancelled() or future.exception() is not None:
+                return
+            self._results[directive_id] = future.result()
+            while len(self._results) > self.max_results:
+                self._results.popitem(last=False)
+
+    def _semaphore(self, tool_name: str, service: str) -> asyncio.Semaphore:
+        # chiamato solo dal thread dell'event loop
+        key = (tool_name, service)
+        if key not in self._semaphores:
+            self._semaphores[key] = asyncio.Semaphore(self.concurrency.get(tool_name, 1))
+        return self._semaphores[key]
+
+    async def _execute(self, tool_name: str, directive: str, directive_id: str, service: str,
+                       trace: IncidentTrace | None = None) -> WorkerLog:
+        queued = time.perf_counter()
+        async with self._semaphore(tool_name, service):
+            start, start_ns = time.perf_counter(), time.perf_counter_ns()
+            batch_id = None
+            try:
+                batch_id = await asyncio.wait_for(self.actions[tool_name](directive, directive_id, service),
+                                                  self.timeout_s)
+                success = "ok"
+            except asyncio.TimeoutError:
+                success = "timeout"
+            except Exception as e:
+                success = f"error: {e}"
+            elapsed = time.perf_counter() - start
+        if trace is not None:
+            trace.add(tool_name, "tool", start_ns, time.perf_counter_ns(), tools=True, service=service,
+                      directive_id=directive_id, wait_ms=round((start - queued) * 1000, 1), success=success)
+        if success != "ok":
+            logger.error(f"[{tool_name}] directive {directive_id} on {service}: {success}")
+        logger.debug(f"[{tool_name}] {directive_id} waited {(start - queued) * 1000:.0f} ms, "
+                     f"ran {elapsed * 1000:.0f} ms")
+        return worker_log_factory(
+            node_name=tool_name,
+            processing_time=round(elapsed * 1000),
+            token_usage=0,
+            total_cost=0,
+            llm_count=0,
+            directive_id=directive_id,
+            action=directive,
+            success=success,
+            timestamp=datetime.now(),
+            batch_id=batch_id,
+        )
+
+    def pending(self) -> int:
+        """Azioni sottomesse e non ancora concluse (in coda sui semafori o in esecuzione)."""
+        with self._lock:
+            return len(self._pending)
+
+    def flush_outbound(self) -> Dict[str, str]:
+        """Invia subito i batch outbound aperti; restituisce gli esiti dei batch falliti (batch_id -> esito)."""
+        return asyncio.run_coroutine_threadsafe(get_outbound_buffer().flush(), self._loop).result()
+
+    def watch_outbound(self, logs: List[WorkerLog]) -> None:
+        """Riporta nei WorkerLog l'esito dei rispettivi batch outbound quando questi vengono inviati."""
+        def apply(log: WorkerLog, outcome: str | None) -> None:
+            if outcome is not None:
+                log.success = outcome
+
+        def register() -> None:
+            buffer = get_outbound_buffer()
+            for log in logs:
+                buffer.watch(log.batch_id, functools.partial(apply, log))
+
+        if logs:
+            self._loop.call_soon_threadsafe(register)
+
+    def drain(self) -> None:
+        """Attende tutte le azioni in corso."""
+        with self._lock:
+            futures = list(self._pending.values())
+        for future in futures:
+            future.exception()
+
+
+_executor: WorkerExecutor | None = None
+_executor_lock = threading.Lock()
+
+
+def get_worker_executor(concurrency: Dict[str, int] | None = None, timeout_s: float | None = None) -> WorkerExecutor:
+    """Istanza di processo dell'esecutore; `concurrency` e `timeout_s` aggiornano i limiti se indicati."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # import locale: i tool dei worker importano questo modulo
+            from assets.nodes.workers import WORKER_ACTIONS
+
+            _executor = WorkerExecutor(WORKER_ACTIONS, concurrency, timeout_s or DEFAULT_TIMEOUT_S)
+        else:
+            if concurrency is not None:
+                _executor.concurrency = {**DEFAULT_CONCURRENCY, **concurrency}
+            if timeout_s is not None:
+                _executor.timeout_s = timeout_s
+        return _executor
+
+
+def collect_worker_logs(logs_by_incident: Dict[str, Dict[str, List[BaseLog]]], flush: bool = True) -> None:
+    """
+    Attende le azioni sottomesse per ogni incident e ne aggiunge i WorkerLog ai nodes_logs; poi
+    (con `flush`) invia i batch outbound ancora aperti e riporta nei WorkerLog l'esito dei batch falliti.
+    Senza `flush` i batch restano aperti fino al timer della finestra (o al flush di un'altra run)
+    e l'esito arriva nei WorkerLog all'invio; un chiamante che vuole gli esiti a fine batch
+    chiama una sola volta apply_outbound_failures.
+    """
+    executor = get_worker_executor()
+    for incident_id, nodes_logs in logs_by_incident.items():
+        worker_logs = executor.collect(incident_id)
+        if worker_logs:
+            nodes_logs.setdefault(AgentRole.worker.value, []).extend(worker_logs)
+    if flush:
+        apply_outbound_failures(logs_by_incident)
+    else:
+        # anche i WorkerLog del percorso agent, aggiunti dal supervisor
+        executor.watch_outbound([log for nodes_logs in logs_by_incident.values()
+                                 for log in nodes_logs.get(AgentRole.worker.value, [])
+                                 if isinstance(log, WorkerLog) and log.batch_id is not None])
+
+
+def apply_outbound_failures(logs_by_incident: Dict[str, Dict[str, List[BaseLog]]]) -> None:
+    """Invia i batch outbound aperti e riporta l'esito dei batch falliti nei WorkerLog indicati."""
+    failures = get_worker_executor().flush_outbound()
+    if failures:
+        for nodes_logs in logs_by_incident.values():
+            for log in nodes_logs.get(AgentRole.worker.value, []):
+                if isinstance(log, WorkerLog) and log.batch_id in failures:
+                    log.success = failures[log.batch_id]
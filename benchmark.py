@@ -0,0 +1,202 @@
+"""
+Benchmark end-to-end del grafo: throughput e latenze di IncidentProcessor (lo stesso percorso di
+process_input) con un chat model finto a latenza configurabile, senza chiamate di rete.
+
+Per ogni combinazione di concorrenza e llm_call (supervisor con/senza LLM) la run gira in un
+processo separato, così il picco di RSS è quello della sola configurazione. Con concorrenza N,
+N thread prendono incident da una coda comune, ognuno con il proprio IncidentProcessor: la
+latenza del modello finto è una sleep, come l'attesa di rete di una chiamata vera.
+
+Report per configurazione: incident/s, p50/p99 per incident e per nodo, chiamate LLM per
+incident, picco di RSS. Con --output i risultati finiscono in un JSON (con commit e parametri),
+per confrontare branch e configurazioni.
+
+Uso (dalla root del progetto):
+    python benchmark.py [--incidents 100] [--concurrency 1 4 16] [--llm-call on off]
+                        [--latency-ms 200] [--jitter-ms 50] [--output runs/benchmark.json]
+"""
+import argparse
+import json
+import queue
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Dict, List
+
+from loguru import logger
+
+PROJECT_ROOT = Path(__file__).resolve().parent
+
+
+def percentile(values: List[float], q: int) -> float:
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return statistics.quantiles(values, n=100, method="inclusive")[q - 1]
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss è in KB su Linux, in byte su macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def make_incidents(n: int):
+    from assets.custom_obj import Incident
+    from assets.utils import upload_json_incidents
+
+    base = upload_json_incidents() or []
+    if not base:
+        sys.exit("data/incidents.json is missing or empty")
+    return [Incident.model_validate({**base[i % len(base)], "id": f"BENCH{i}"}) for i in range(n)]
+
+
+def run_config(incidents: int, concurrency: int, llm_call: bool, latency_ms: float, jitter_ms: float,
+               direct_tool_dispatch: bool, outbound_window_s: float | None, warmup: int, log_level: str) -> Dict:
+    """Esegue una configurazione (in un processo dedicato) e ne restituisce le metriche."""
+    logger.remove()
+    logger.add(sys.stderr, level=log_level.upper())
+    from assets.helper.config_helper import AppSettings
+    from assets.run import IncidentProcessor
+    from assets.scripted_llm import ScriptedChatModel, set_scripted_llm
+
+    model = ScriptedChatModel(latency_ms=latency_ms, jitter_ms=jitter_ms)
+    set_scripted_llm(model)
+    sink = Path(tempfile.mkdtemp(prefix="benchmark_")) / "outbound.jsonl"
+    # nessun effetto sui file di data/: né esempi per il classificatore né contatori dei topic
+    settings = AppSettings(llm_call=llm_call, direct_tool_dispatch=direct_tool_dispatch, outbound_sink_path=str(sink))
+    if outbound_window_s is not None:
+        settings.outbound_window_s = outbound_window_s
+    processors = [IncidentProcessor.from_settings(settings, persist=False, record_labels=False)
+                  for _ in range(concurrency)]
+    for incident in make_incidents(warmup):
+        processors[0].process([incident])
+    calls_before = model.calls
+
+    todo: "queue.Queue" = queue.Queue()
+    for incident in make_incidents(incidents):
+        todo.put(incident)
+    latencies: List[float] = []
+    node_times: Dict[str, List[int]] = {}
+    llm_counts: List[int] = []
+    errors: List[str] = []
+    lock = threading.Lock()
+
+    def worker(processor):
+        while True:
+            try:
+                incident = todo.get_nowait()
+            except queue.Empty:
+                return
+            start = time.perf_counter()
+            try:
+                (_, _, nodes_logs), = processor.process([incident])
+            except Exception as e:
+                with lock:
+                    errors.append(f"{incident.id}: {e!r}")
+                continue
+            elapsed = (time.perf_counter() - start) * 1000
+            with lock:
+                latencies.append(elapsed)
+                llm_counts.append(sum(log.llm_count for logs in nodes_logs.values() for log in logs))
+                for logs in nodes_logs.values():
+                    for log in logs:
+                        node_times.setdefault(log.node_name, []).append(log.processing_time)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(p,), name=f"bench-{i}") for i, p in enumerate(processors)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall_s = time.perf_counter() - start
+    for processor in processors:
+        processor.close()
+
+    done = len(latencies)
+    return {
+        "concurrency": concurrency,
+        "llm_call": llm_call,
+        "incidents": done,
+        "errors": errors,
+        "wall_s": round(wall_s, 3),
+        "incidents_per_s": round(done / wall_s, 3) if wall_s else 0.0,
+        "incident_p50_ms": round(percentile(latencies, 50), 1),
+        "incident_p99_ms": round(percentile(latencies, 99), 1),
+        "nodes": {node: {"p50_ms": percentile(times, 50), "p99_ms": percentile(times, 99), "count": len(times)}
+                  for node, times in sorted(node_times.items())},
+        # chiamate contate dal modello finto (agent compresi) e quelle registrate nei nodes_logs
+        "llm_calls_per_incident": round((model.calls - calls_before) / done, 3) if done else 0.0,
+        "logged_llm_calls_per_incident": round(sum(llm_counts) / done, 3) if done else 0.0,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=PROJECT_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_result(result: Dict) -> None:
+    print(f"\nconcurrency={result['concurrency']} llm_call={result['llm_call']}: "
+          f"{result['incidents']} incidents in {result['wall_s']:.2f} s -> {result['incidents_per_s']:.2f} inc/s, "
+          f"p50 {result['incident_p50_ms']:.0f} ms, p99 {result['incident_p99_ms']:.0f} ms, "
+          f"LLM calls/incident {result['llm_calls_per_incident']:.2f}, peak RSS {result['peak_rss_mb']:.0f} MB")
+    for node, stats in result["nodes"].items():
+        print(f"    {node:30} p50 {stats['p50_ms']:8.0f} ms   p99 {stats['p99_ms']:8.0f} ms   n={stats['count']}")
+    for error in result["errors"]:
+        print(f"    error: {error}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end throughput and latency of the incident graph")
+    parser.add_argument("--incidents", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16],
+                        help="incidents processed at the same time (one thread each)")
+    parser.add_argument("--llm-call", nargs="+", choices=["on", "off"], default=["on", "off"],
+                        help="run with LLM supervisors (on) and/or deterministic supervisors (off)")
+    parser.add_argument("--latency-ms", type=float, default=200.0, help="latency of every fake LLM call")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="uniform +/- variation of the latency")
+    parser.add_argument("--agent-tools", action="store_true",
+                        help="invoke the worker tools through the LLM agent instead of direct dispatch")
+    parser.add_argument("--outbound-window-s", type=float, default=None,
+                        help="max delay of buffered notifications/work notes (default: outbound buffer default)")
+    parser.add_argument("--warmup", type=int, default=2, help="incidents run before the measurement")
+    parser.add_argument("--log-level", default="error")
+    parser.add_argument("--output", default=None, help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    results = []
+    for llm_call in (value == "on" for value in args.llm_call):
+        for concurrency in args.concurrency:
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+                result = pool.submit(run_config, args.incidents, concurrency, llm_call, args.latency_ms,
+                                     args.jitter_ms, not args.agent_tools, args.outbound_window_s, args.warmup,
+                                     args.log_level).result()
+            print_result(result)
+            results.append(result)
+
+    if args.output:
+        output = Path(args.output)
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps({
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "git_revision": git_revision(),
+            "params": vars(args),
+            "results": results,
+        }, indent=2), encoding="utf-8")
+        print(f"\nResults saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,8 @@
-import sys
 from typing import List, Dict
 
-from loguru import logger
-
 from assets.custom_obj import BaseLog
 from assets.helper.config_helper import load_settings, log_settings
+from assets.log_setup import configure_logging, logging_options
 from assets.run import process_input
 from assets.helper import log_processing, print_summary
 
@@ -18,16 +16,23 @@ logs: List[Dict[str, Dict[str, List[BaseLog]]]] = []
 def main():
     settings = load_settings()
     log_settings(settings)
-    logger.remove()
-    logger.add(sys.stderr, level=settings.log_level.upper())
-    print_summary(
-        log_processing(
-            process_input(
-                settings.llm_call,
-                settings.n_items
-            )
-        ),
-        settings)
+    configure_logging(**logging_options(settings))
+    if settings.mode == "serve":
+        from assets.service import serve
+
+        serve(settings)
+        return
+    if settings.mode == "follow":
+        from assets.follow import follow
+
+        follow(settings)
+        return
+    if settings.mode == "deferred":
+        from assets.batch_jobs import run_deferred
+
+        print_summary(log_processing(run_deferred(settings)), settings)
+        return
+    print_summary(log_processing(process_input(settings)), settings)
 
 
 if __name__=="__main__":
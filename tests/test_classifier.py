@@ -0,0 +1,43 @@
+from datetime import datetime
+
+from assets.classifier import LocalTopicClassifier
+from assets.custom_obj import Incident
+
+
+def _incident(inc_id, description, service):
+    return Incident(id=inc_id, created_at=datetime(2025, 9, 1, 8), short_description=description[:40],
+                    description=description, service=service, impact=2, state="new")
+
+
+def _rows():
+    texts = [
+        ("Database connection pool exhausted on primary replica", "orders-db", {"database": 0.8, "capacity": 0.6}),
+        ("Login requests failing with invalid token errors", "auth-service", {"auth": 0.9, "availability": 0.5}),
+        ("Latency spike on checkout API after deployment", "checkout-api", {"latency": 0.7, "deployment": 0.7}),
+        ("Intermittent DNS resolution failures between services", "gateway", {"network": 0.8, "dependency": 0.6}),
+    ]
+    return [(_incident(f"INC{i}", text, service), "root_cause_consultant", topics)
+            for i, (text, service, topics) in enumerate(texts * 3)]
+
+
+def test_training_example_is_confident_even_with_two_topics():
+    rows = _rows()
+    model = LocalTopicClassifier().fit(rows)
+    incident, node, _ = rows[0]
+    _, confidence = model.predict(incident, node)
+    assert confidence > 0.9
+
+
+def test_unseen_input_has_low_confidence():
+    model = LocalTopicClassifier().fit(_rows())
+    unseen = _incident("X", "qzx vlorp wibble frazzle snork", "zz-unknown")
+    _, confidence = model.predict(unseen, "root_cause_consultant")
+    assert confidence < 0.3
+
+
+def test_confidence_survives_save_and_load(tmp_path):
+    rows = _rows()
+    model = LocalTopicClassifier().fit(rows)
+    loaded = LocalTopicClassifier.load(model.save(tmp_path / "model.json"))
+    incident, node, _ = rows[1]
+    assert loaded.predict(incident, node)[1] == model.predict(incident, node)[1]
@@ -0,0 +1,30 @@
+from assets.metrics import MetricsRegistry
+
+
+def _histogram(registry: MetricsRegistry, name: str) -> dict:
+    lines = [line for line in registry.render().splitlines() if line.startswith(name)]
+    return dict(line.rsplit(" ", 1) for line in lines)
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = MetricsRegistry(buckets=(1.0, 5.0))
+    for value in (0.5, 1.0, 3.0):
+        registry.observe("latency", "test", value, node="a")
+    series = _histogram(registry, "latency")
+    assert series['latency_bucket{node="a",le="1"}'] == "2"
+    assert series['latency_bucket{node="a",le="5"}'] == "3"
+    assert series['latency_bucket{node="a",le="+Inf"}'] == "3"
+    assert series['latency_sum{node="a"}'] == "4.5"
+    assert series['latency_count{node="a"}'] == "3"
+
+
+def test_histogram_value_past_last_bucket():
+    registry = MetricsRegistry(buckets=(1.0, 5.0))
+    registry.observe("latency", "test", 0.5)
+    registry.observe("latency", "test", 120.0)
+    series = _histogram(registry, "latency")
+    assert series['latency_bucket{le="1"}'] == "1"
+    assert series['latency_bucket{le="5"}'] == "1"
+    assert series['latency_bucket{le="+Inf"}'] == "2"
+    assert series["latency_sum"] == "120.5"
+    assert series["latency_count"] == "2"
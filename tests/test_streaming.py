@@ -0,0 +1,109 @@
+import json
+import time
+from concurrent.futures import Future
+
+from assets.helper.logging import create_node_log
+from assets.streaming import IncrementalJSONParser, stream_json
+
+
+def test_parser_returns_fields_as_they_complete():
+    parser = IncrementalJSONParser()
+    parser.feed('```json\n{"route": "ro')
+    assert parser.fields == {}
+    parser.feed('ot", "scores": {"a": [1,')
+    assert parser.fields == {"route": "root"}
+    parser.feed(' 2]}, "reason": "a\\"}b", "n": 3')
+    assert parser.fields == {"route": "root", "scores": {"a": [1, 2]}, "reason": 'a"}b'}
+    assert not parser.closed
+    parser.feed('} trailing {"z": 1}\n```')
+    assert parser.closed
+    assert parser.result() == {"route": "root", "scores": {"a": [1, 2]}, "reason": 'a"}b', "n": 3}
+
+
+def test_parser_has_and_unclosed_fallback():
+    parser = IncrementalJSONParser()
+    parser.feed('{"tool_name": "diagnostic_worker", "confidence": 0.')
+    assert parser.has(("tool_name",))
+    assert not parser.has(("tool_name", "confidence"))
+    assert parser.result() == {"tool_name": "diagnostic_worker"}
+
+
+class _Prompt:
+    def __init__(self, text):
+        self.text = text
+
+    def invoke(self, input):
+        return self
+
+    def to_string(self):
+        return self.text
+
+
+class _Chain:
+    """Chain finta: produce il JSON a chunk e, se `usage`, chiama on_llm_end dei callback a fine stream."""
+
+    steps = ()
+
+    def __init__(self, text, usage=True):
+        self.first = _Prompt("prompt " * 50)
+        self.text, self.usage, self.read = text, usage, 0
+
+    def stream(self, input, config):
+        for i in range(0, len(self.text), 4):
+            self.read = i + 4
+            yield self.text[i:i + 4]
+        if self.usage:
+            for handler in config["callbacks"]:
+                handler.on_llm_end(None)
+
+
+class _Handler:
+    def __init__(self):
+        self.successful_requests = 0
+        self.responses = []
+
+    def on_llm_end(self, response):
+        self.successful_requests += 1
+        self.responses.append(response)
+
+
+TEXT = json.dumps({"route": "root_cause_consultant", "reason": "x" * 200})
+
+
+def test_stream_reads_usage_after_the_object_closes():
+    chain, handler = _Chain(TEXT + "\n```"), _Handler()
+    result, timing = stream_json(chain, {}, {"callbacks": [handler]}, ("route",))
+    assert result["route"] == "root_cause_consultant"
+    assert handler.responses == [None]
+    assert timing["usage_estimated"] is False
+
+
+def test_early_exit_keeps_reading_the_stream_for_usage():
+    chain, handler = _Chain(TEXT), _Handler()
+    result, timing = stream_json(chain, {}, {"callbacks": [handler]}, ("route",), stop_on_decision=True)
+    assert result == {"route": "root_cause_consultant"}
+    assert timing["usage_pending"].result() is False
+    assert chain.read >= len(TEXT)
+    assert handler.responses == [None]
+
+
+def test_missing_usage_is_estimated():
+    chain, handler = _Chain(TEXT, usage=False), _Handler()
+    _, timing = stream_json(chain, {}, {"callbacks": [handler]}, ("route",), stop_on_decision=True)
+    assert timing["usage_pending"].result() is True
+    usage = handler.responses[0].llm_output["token_usage"]
+    assert usage["prompt_tokens"] > 0 and usage["completion_tokens"] > 0
+
+
+class _Usage:
+    total_tokens, total_cost, successful_requests = 0, 0.0, 0
+
+
+def test_node_log_is_completed_when_the_background_read_ends():
+    pending, usage = Future(), _Usage()
+    log = create_node_log("restart_worker", "worker", None, time.perf_counter(), True, usage,
+                          usage_pending=pending, directive_id="d1", action="restart")
+    assert log.token_usage == 0 and log.llm_count == 0
+    usage.total_tokens, usage.total_cost, usage.successful_requests = 420, 0.001, 1
+    pending.set_result(True)
+    assert (log.token_usage, log.total_cost, log.llm_count, log.usage_estimated) == (420, 0.001, 1, True)
@@ -0,0 +1,28 @@
+from assets.vocabulary import CORE_TOPICS, EVICTION_GRACE, TopicVocabulary
+
+
+def _vocabulary(tmp_path, extra_slots):
+    vocabulary = TopicVocabulary(len(CORE_TOPICS) + extra_slots, topics_path=tmp_path / "topics.txt",
+                                 counts_path=tmp_path / "counts.json", synonyms_path=tmp_path / "synonyms.json")
+    vocabulary.persist = False
+    return vocabulary
+
+
+def test_new_topic_survives_when_the_cap_is_reached(tmp_path):
+    vocabulary = _vocabulary(tmp_path, 2)
+    vocabulary.observe({"old_a": 1.0, "old_b": 1.0})
+    vocabulary.observe({"old_a": 1.0})
+    for _ in range(EVICTION_GRACE):
+        vocabulary.observe({"latency": 1.0})
+    vocabulary.observe({"new_topic": 1.0})
+    # il topic nuovo ha il conteggio più basso ma è nel periodo di grazia: esce il vecchio meno usato
+    assert "new_topic" in vocabulary.topics()
+    assert "old_b" not in vocabulary.topics()
+    assert len(vocabulary.topics()) == vocabulary.max_topics
+
+
+def test_cap_holds_when_every_candidate_is_new(tmp_path):
+    vocabulary = _vocabulary(tmp_path, 1)
+    vocabulary.observe({"first": 1.0})
+    vocabulary.observe({"first": 1.0, "second": 1.0})
+    assert vocabulary.topics() == CORE_TOPICS | {"first"}
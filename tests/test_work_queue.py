@@ -0,0 +1,94 @@
+import time
+from datetime import datetime
+
+import pytest
+
+from assets.custom_obj import Incident
+from assets.work_queue import SQLiteWorkQueue, WorkQueue, drain_queue
+
+
+def _incident(inc_id, service="svc", minute=0):
+    return Incident(id=inc_id, created_at=datetime(2025, 9, 1, 8, minute), short_description=inc_id,
+                    description=f"{inc_id} on {service}", service=service)
+
+
+@pytest.fixture
+def queue(tmp_path):
+    q = SQLiteWorkQueue(tmp_path / "q.sqlite", visibility_timeout=0.05, max_attempts=2)
+    yield q
+    q.close()
+
+
+def test_interface_is_abstract():
+    with pytest.raises(TypeError):
+        WorkQueue()
+
+
+def test_expired_lease_is_taken_by_another_worker(queue):
+    queue.enqueue([_incident("INC1")])
+    assert [i.id for i in queue.lease("w1", 10)] == ["INC1"]
+    assert queue.lease("w2", 10) == []
+    time.sleep(0.1)
+    assert [i.id for i in queue.lease("w2", 10)] == ["INC1"]
+    # il lease di w1 non vale più: il suo fail non rilascia l'incident
+    assert queue.fail("w1", "INC1", "late") == "leased"
+
+
+def test_dead_letter_after_max_attempts_via_fail(queue):
+    queue.enqueue([_incident("INC1")])
+    queue.lease("w1", 1)
+    assert queue.fail("w1", "INC1", "boom 1") == "pending"
+    queue.lease("w1", 1)
+    assert queue.fail("w1", "INC1", "boom 2") == "dead"
+    assert queue.lease("w1", 1) == []
+    assert queue.dead_letters() == [("INC1", 2, "boom 2")]
+
+
+def test_dead_letter_after_max_attempts_via_expired_lease(queue):
+    queue.enqueue([_incident("INC1")])
+    queue.lease("w1", 1)
+    time.sleep(0.1)
+    queue.lease("w2", 1)
+    time.sleep(0.1)
+    assert queue.lease("w3", 1) == []
+    assert queue.dead_letters() == [("INC1", 2, "lease expired")]
+    assert queue.stats()["dead"] == 1
+
+
+def test_complete_is_idempotent(queue):
+    queue.enqueue([_incident("INC1")])
+    queue.lease("w1", 1)
+    assert queue.complete("w1", "INC1", {}) is True
+    assert queue.complete("w2", "INC1", {}) is False
+    assert [inc_id for inc_id, _ in queue.results()] == ["INC1"]
+    assert queue.stats()["done"] == 1
+
+
+class _Processor:
+    """Processor finto: fallisce sugli incident del service `broken` e conta le esecuzioni."""
+    shadow = None
+    service_graph = None
+    coalesce_window_minutes = 5
+
+    def __init__(self):
+        self.runs = []
+
+    def process(self, incidents, flush_outbound=True):
+        self.runs += [inc.id for inc in incidents]
+        if any(inc.service == "broken" for inc in incidents):
+            raise RuntimeError("graph failed")
+        return [(inc.id, None, {}) for inc in incidents]
+
+    def flush_outbound(self, logs_by_incident):
+        pass
+
+
+def test_drain_releases_only_the_failed_group(tmp_path):
+    queue = SQLiteWorkQueue(tmp_path / "q.sqlite", visibility_timeout=60, max_attempts=2)
+    queue.enqueue([_incident("INC1", "a"), _incident("INC2", "broken"), _incident("INC3", "b")])
+    processor = _Processor()
+    assert drain_queue(queue, processor, worker_id="w1", lease_size=10, poll_interval=0) == 2
+    # gli incident riusciti girano una volta sola; quello fallito solo per i suoi tentativi
+    assert sorted(processor.runs) == ["INC1", "INC2", "INC2", "INC3"]
+    assert queue.dead_letters() == [("INC2", 2, "RuntimeError('graph failed')")]
+    queue.close()
@@ -0,0 +1,124 @@
+"""
+Import-time benchmark of the project modules.
+
+Every module found by `find_import_cycles.discover_modules` is imported in a fresh interpreter
+with `-X importtime`; the report shows self and cumulative cost per module. The run fails
+(exit code 1) when:
+  - a module is slower than the saved baseline beyond the tolerance;
+  - a startup module (default: main, assets.run) pulls in an LLM-only dependency
+    (openai, langchain_openai, langchain_community, langchain.agents, tiktoken);
+  - a module cannot be imported.
+
+Usage (from the repo root):
+    python -m tools.import_time_benchmark [--repeat 3] [--tolerance 0.25] [--update-baseline]
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+
+from tools.find_import_cycles import discover_modules
+
+DEFAULT_BASELINE = os.path.join("tools", "import_time_baseline.json")
+DEFAULT_PACKAGES = ("assets",)
+DEFAULT_STARTUP = ("main", "assets.run")
+LLM_ONLY_MODULES = ("openai", "langchain_openai", "langchain_community", "langchain.agents", "tiktoken")
+IMPORTTIME_RE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)$")
+
+
+def measure(root: str, module: str):
+    """
+    Import `module` in a fresh interpreter.
+    Returns (self_ms, cumulative_ms, set of all imported module names) or raises RuntimeError.
+    """
+    env = {**os.environ, "PYTHONPATH": root + os.pathsep + os.environ.get("PYTHONPATH", "")}
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                          cwd=root, env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        last_line = proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "unknown error"
+        raise RuntimeError(last_line)
+    imported = set()
+    self_us = cumulative_us = 0
+    for line in proc.stderr.splitlines():
+        match = IMPORTTIME_RE.match(line)
+        if not match:
+            continue
+        name = match.group(4)
+        imported.add(name)
+        if name == module:
+            self_us, cumulative_us = int(match.group(1)), int(match.group(2))
+    return self_us / 1000, cumulative_us / 1000, imported
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-module import cost with regression check")
+    parser.add_argument("--packages", nargs="+", default=list(DEFAULT_PACKAGES),
+                        help="top-level packages whose modules are measured")
+    parser.add_argument("--startup", nargs="+", default=list(DEFAULT_STARTUP),
+                        help="modules that must not import LLM-only dependencies")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per module; the fastest is kept")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative slowdown")
+    parser.add_argument("--min-delta-ms", type=float, default=50.0,
+                        help="slowdowns below this absolute value are never a regression")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args()
+
+    root = os.getcwd()
+    _, module_to_file, _ = discover_modules(root)
+    modules = sorted(m for m in module_to_file if m.split(".")[0] in args.packages)
+    modules += [m for m in args.startup if m not in modules]
+
+    results, errors, leaks = {}, {}, {}
+    for module in modules:
+        runs = []
+        try:
+            for _ in range(max(1, args.repeat)):
+                runs.append(measure(root, module))
+        except RuntimeError as e:
+            errors[module] = str(e)
+            continue
+        self_ms, cumulative_ms, imported = min(runs, key=lambda r: r[1])
+        results[module] = {"self_ms": round(self_ms, 1), "cumulative_ms": round(cumulative_ms, 1)}
+        if module in args.startup:
+            leaked = sorted(m for m in imported if m in LLM_ONLY_MODULES)
+            if leaked:
+                leaks[module] = leaked
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    regressions = []
+    print(f"{'module':40} {'self ms':>9} {'cum ms':>9} {'base ms':>9} {'delta':>8}")
+    for module, result in sorted(results.items(), key=lambda item: -item[1]["cumulative_ms"]):
+        base = baseline.get(module, {}).get("cumulative_ms")
+        delta = "" if base is None else f"{result['cumulative_ms'] - base:+.1f}"
+        print(f"{module:40} {result['self_ms']:9.1f} {result['cumulative_ms']:9.1f} "
+              f"{'' if base is None else f'{base:.1f}':>9} {delta:>8}")
+        if base is not None and result["cumulative_ms"] > base * (1 + args.tolerance) \
+                and result["cumulative_ms"] - base > args.min_delta_ms:
+            regressions.append(module)
+
+    for module, error in errors.items():
+        print(f"\nImport failed: {module}: {error}")
+    for module, leaked in leaks.items():
+        print(f"\nStartup module {module} imports LLM-only dependencies: {', '.join(leaked)}")
+    for module in regressions:
+        print(f"\nImport time regression: {module} "
+              f"({baseline[module]['cumulative_ms']:.1f} ms -> {results[module]['cumulative_ms']:.1f} ms)")
+
+    if args.update_baseline or not baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f"\nBaseline saved to {args.baseline}")
+
+    if errors or leaks or regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
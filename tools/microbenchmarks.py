@@ -0,0 +1,229 @@
+"""
+Microbenchmarks of the pure helpers that run on every incident: topic scoring and routing
+(`group_scores`, `merge_topic_scores`, `choose_worker_tool`, `router_supervisor_deterministic`),
+worker output parsing (`parse_worker_log`), node logging (`add_log_to_state`), the final
+summary (`log_processing`) and the construction of the pydantic models in `custom_obj`.
+
+Inputs are synthetic and seeded: topic dicts over the 13 core topics and over a 1,000 topic
+vocabulary, and --incidents (default 10,000) incidents of nodes_logs for `log_processing`.
+Each benchmark is timed with `timeit`; the fastest of --repeat runs is kept, in microseconds
+per call. Logging is disabled, so the numbers do not include loguru sinks.
+
+Results are compared with a JSON baseline: a benchmark slower than the baseline beyond the
+tolerance is a regression and the command exits with code 1.
+
+Usage (from the repo root):
+    python -m tools.microbenchmarks run [--incidents 10000] [--repeat 5] [--only group_scores]
+                                        [--output results.json] [--update-baseline]
+    python -m tools.microbenchmarks compare results.json [--baseline tools/microbench_baseline.json]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import timeit
+from datetime import datetime
+from typing import Callable, Dict, List, Tuple
+
+from loguru import logger
+
+from assets.custom_obj import AgentRole, AgentState, ConsultantLog, Directive, Incident, SupervisorLog, Token, \
+    WorkerLog
+from assets.helper.logging import add_log_to_state, log_processing
+from assets.nodes.supervisors import router_supervisor_deterministic
+from assets.utils import choose_worker_tool, group_scores, merge_topic_scores, parse_worker_log
+from assets.vocabulary import CORE_TOPICS
+
+DEFAULT_BASELINE = os.path.join("tools", "microbench_baseline.json")
+VOCABULARY_SIZES = (13, 1000)
+SEED = 42
+
+Benchmark = Tuple[str, Callable[[], object]]
+
+
+def make_topics(size: int, rng: random.Random) -> Dict[str, float]:
+    """Topic -> score over the core topics plus synthetic ones, up to `size` topics."""
+    names = sorted(CORE_TOPICS) + [f"topic_{i}" for i in range(max(0, size - len(CORE_TOPICS)))]
+    return {name: round(rng.random(), 3) for name in names[:size]}
+
+
+def make_incident(i: int) -> Dict:
+    return {
+        "id": f"INC{i:06d}", "created_at": "2025-01-01T10:00:00", "short_description": "Checkout latency",
+        "description": f"p99 latency above SLO on checkout, sample {i}", "service": "checkout",
+        "impact": 1 + i % 3, "state": "new",
+    }
+
+
+def make_worker_output(i: int) -> Dict:
+    return {
+        "node_name": "diagnostic_worker", "processing_time": 120, "token_usage": 0, "total_cost": 0.0,
+        "llm_count": 0, "directive_id": f"DIR{i}", "action": "collect diagnostics on checkout",
+        "success": "ok", "timestamp": "2025-01-01T10:00:01",
+    }
+
+
+def make_nodes_logs(i: int, rng: random.Random) -> Dict:
+    """nodes_logs of a typical incident: one consultant, one supervisor and one worker log."""
+    now = datetime(2025, 1, 1, 10)
+    return {
+        AgentRole.consultant.value: [ConsultantLog(
+            node_name="root_cause_consultant", token_usage=900, processing_time=rng.randint(300, 900),
+            total_cost=0.0002, llm_count=1, prompt_tokens=700, prompt_tokens_saved=40, input_length=400,
+            token_id=f"TOK{i}", topic_extracted=["latency", "diagnostics"], prompt_topics_chars=180,
+        )],
+        AgentRole.supervisor.value: [SupervisorLog(
+            node_name="router_supervisor", token_usage=0, processing_time=rng.randint(0, 5), total_cost=0.0,
+            llm_count=0, actions=["collect diagnostics"], reasons=["diagnostics indicated"], token_id=f"TOK{i}",
+            directive_generated=1, timestamp=now,
+        )],
+        AgentRole.worker.value: [WorkerLog.model_validate(make_worker_output(i))],
+    }
+
+
+def make_state(topics: Dict[str, float]) -> AgentState:
+    now = datetime(2025, 1, 1, 10)
+    return AgentState(
+        topics=set(topics), nodes_logs={},
+        incident=Incident.model_validate(make_incident(0)),
+        token=Token(id="TOK0", layer="consultant", topics=topics, content="p99 latency above SLO",
+                    timestamp=now, metadata={}),
+        directives=[Directive(id="DIR0", action="collect diagnostics", confidence=0.8, source_token_id="TOK0",
+                              timestamp=now, metadata={"directive_reason": "diagnostics indicated"})],
+    )
+
+
+def build_benchmarks(incidents: int) -> List[Benchmark]:
+    rng = random.Random(SEED)
+    benchmarks: List[Benchmark] = []
+    for size in VOCABULARY_SIZES:
+        topics, update = make_topics(size, rng), make_topics(size, rng)
+        incident = make_incident(size)
+        benchmarks += [
+            (f"group_scores[{size}]", lambda t=topics: group_scores(t)),
+            (f"merge_topic_scores[{size}]", lambda t=topics, u=update: merge_topic_scores(t, u)),
+            (f"choose_worker_tool[{size}]", lambda t=topics, inc=incident: choose_worker_tool(t, inc)),
+            (f"router_supervisor_deterministic[{size}]", lambda t=topics: router_supervisor_deterministic(t)),
+        ]
+
+    worker_output = make_worker_output(0)
+    worker_output_json = json.dumps({"tool_output": worker_output})
+    benchmarks += [
+        ("parse_worker_log[dict]", lambda: parse_worker_log(worker_output)),
+        ("parse_worker_log[json]", lambda: parse_worker_log(worker_output_json)),
+        ("parse_worker_log[invalid]", lambda: parse_worker_log("restart done")),
+    ]
+
+    state = make_state(make_topics(13, rng))
+
+    def add_logs():
+        # un consultant e un supervisor su uno stato vuoto, come in un incident
+        state.nodes_logs = {}
+        start = time.perf_counter()
+        add_log_to_state("root_cause_consultant", AgentRole.consultant.value, state, start, False, None)
+        add_log_to_state("router_supervisor", AgentRole.supervisor.value, state, start, False, None)
+
+    benchmarks.append(("add_log_to_state[consultant+supervisor]", add_logs))
+
+    incident_data = make_incident(0)
+    log_data = make_worker_output(0)
+    benchmarks += [
+        ("custom_obj.Incident", lambda: Incident.model_validate(incident_data)),
+        ("custom_obj.WorkerLog", lambda: WorkerLog.model_validate(log_data)),
+        ("custom_obj.AgentState", lambda: make_state({"latency": 0.8, "diagnostics": 0.7})),
+    ]
+
+    logs = [{f"Inc{i}": make_nodes_logs(i, rng)} for i in range(incidents)]
+    benchmarks.append((f"log_processing[{incidents}]", lambda: log_processing(logs)))
+    return benchmarks
+
+
+def measure(func: Callable[[], object], repeat: int, min_time: float) -> float:
+    """Microseconds per call: best of `repeat` runs, each lasting at least `min_time` seconds."""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    number = max(1, int(number * min_time / 0.2))
+    return min(timer.repeat(repeat=repeat, number=number)) / number * 1e6
+
+
+def compare(results: Dict[str, float], baseline: Dict[str, float], tolerance: float) -> List[str]:
+    """Print the comparison with the baseline and return the regressed benchmarks."""
+    regressions = []
+    print(f"{'benchmark':45} {'us/call':>12} {'base us':>12} {'delta':>8}")
+    for name, value in results.items():
+        base = baseline.get(name)
+        delta = "" if base is None else f"{(value / base - 1) * 100:+.1f}%"
+        print(f"{name:45} {value:12.2f} {'' if base is None else f'{base:.2f}':>12} {delta:>8}")
+        if base is not None and value > base * (1 + tolerance):
+            regressions.append(name)
+    for name in sorted(set(baseline) - set(results)):
+        print(f"{name:45} {'-':>12} {baseline[name]:12.2f}   (not run)")
+    for name in regressions:
+        print(f"\nRegression: {name} ({baseline[name]:.2f} us -> {results[name]:.2f} us)")
+    return regressions
+
+
+def load_json(path: str) -> Dict[str, float]:
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_json(path: str, results: Dict[str, float]) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmarks of the per-incident helpers")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run the benchmarks and compare them with the baseline")
+    run_parser.add_argument("--incidents", type=int, default=10_000, help="incidents summarized by log_processing")
+    run_parser.add_argument("--repeat", type=int, default=5, help="runs per benchmark; the fastest is kept")
+    run_parser.add_argument("--min-time", type=float, default=0.2, help="minimum seconds per run")
+    run_parser.add_argument("--only", nargs="+", default=None, help="run only benchmarks containing these names")
+    run_parser.add_argument("--output", default=None, help="also write the results to this JSON file")
+    run_parser.add_argument("--update-baseline", action="store_true")
+
+    compare_parser = commands.add_parser("compare", help="compare a results file with the baseline")
+    compare_parser.add_argument("results", help="JSON file written by `run --output`")
+
+    for sub in (run_parser, compare_parser):
+        sub.add_argument("--baseline", default=DEFAULT_BASELINE)
+        sub.add_argument("--tolerance", type=float, default=0.2, help="allowed relative slowdown")
+    args = parser.parse_args()
+
+    baseline = load_json(args.baseline)
+    if args.command == "compare":
+        results = load_json(args.results)
+        if not results:
+            sys.exit(f"{args.results} is missing or empty")
+        if not baseline:
+            sys.exit(f"Baseline {args.baseline} is missing: create it with `run --update-baseline`")
+        sys.exit(1 if compare(results, baseline, args.tolerance) else 0)
+
+    logger.remove()
+    results = {}
+    for name, func in build_benchmarks(args.incidents):
+        if args.only and not any(part in name for part in args.only):
+            continue
+        results[name] = round(measure(func, args.repeat, args.min_time), 3)
+    regressions = compare(results, baseline, args.tolerance)
+
+    if args.output:
+        save_json(args.output, results)
+        print(f"\nResults saved to {args.output}")
+    if args.update_baseline or not baseline:
+        save_json(args.baseline, {**baseline, **results})
+        print(f"\nBaseline saved to {args.baseline}")
+        regressions = []
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
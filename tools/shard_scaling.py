@@ -0,0 +1,68 @@
+"""
+Scaling benchmark of the multi-process sharded runner.
+
+The incidents in data/incidents.json are repeated (with fresh ids) up to --incidents and
+processed with 1, 2, 4, ... processes. No LLM is called: topics come from the local classifier
+(threshold 0) and the tool is dispatched directly, so the numbers measure graph execution and
+process overhead only. Train the classifier first with `python -m tools.train_topic_classifier`.
+
+For every process count the report shows wall time, throughput, speedup over the first
+process count, scaling efficiency (speedup / relative process count) and worker utilization
+(busy time / wall time).
+
+Usage (from the repo root):
+    python -m tools.shard_scaling [--incidents 200] [--processes 1 2 4]
+"""
+import argparse
+import sys
+import tempfile
+
+from loguru import logger
+
+from assets.classifier import DEFAULT_MODEL_PATH
+from assets.custom_obj import Incident
+from assets.helper.config_helper import AppSettings
+from assets.sharded import run_sharded
+from assets.utils import upload_json_incidents
+
+
+def make_incidents(n: int):
+    base = upload_json_incidents() or []
+    if not base:
+        sys.exit("data/incidents.json is missing or empty")
+    return [Incident.model_validate({**base[i % len(base)], "id": f"SHARD{i}"}) for i in range(n)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput and scaling efficiency of the sharded runner")
+    parser.add_argument("--incidents", type=int, default=200)
+    parser.add_argument("--processes", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--coalesce-window", type=int, default=0,
+                        help="coalescing window in minutes (0 = round-robin sharding)")
+    args = parser.parse_args()
+
+    if not DEFAULT_MODEL_PATH.exists():
+        sys.exit(f"No topic classifier at {DEFAULT_MODEL_PATH}: run python -m tools.train_topic_classifier")
+    logger.remove()
+    logger.add(sys.stderr, level="ERROR")
+    incidents = make_incidents(args.incidents)
+    settings = AppSettings(llm_call=False, local_classifier_threshold=0.0, direct_tool_dispatch=True,
+                           coalesce_window_minutes=args.coalesce_window,
+                           outbound_sink_path=f"{tempfile.mkdtemp(prefix='shard_scaling_')}/outbound.jsonl")
+
+    baseline = None  # (processes, wall) of the first run: speedup is relative to it
+    print(f"{'procs':>5} {'wall s':>8} {'inc/s':>8} {'speedup':>8} {'scaling':>8} {'util':>6}")
+    for processes in args.processes:
+        logs, stats = run_sharded(incidents, processes, settings, log_options={"level": "error"},
+                                  persist=False)
+        if len(logs) != len(incidents):
+            sys.exit(f"{processes} processes returned {len(logs)} results for {len(incidents)} incidents")
+        baseline = baseline or (stats["processes"], stats["wall_s"])
+        speedup = baseline[1] / stats["wall_s"]
+        scaling = speedup / (stats["processes"] / baseline[0])
+        print(f"{stats['processes']:5d} {stats['wall_s']:8.2f} {len(incidents) / stats['wall_s']:8.1f} "
+              f"{speedup:8.2f} {scaling:8.0%} {stats['efficiency']:6.0%}")
+
+
+if __name__ == "__main__":
+    main()
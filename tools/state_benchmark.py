@@ -0,0 +1,81 @@
+"""
+Microbenchmark of the per-incident graph state overhead: standard mode (pydantic AgentState
+validated at every node, MemorySaver checkpointer) vs fast-state mode (dataclass state with
+append-only reducers, no checkpointer, validation only at the graph boundary).
+
+No LLM is called: every incident reuses a fixed analysis, so consultants and supervisors take
+their local paths and the tool is dispatched directly. What is left is graph/state machinery,
+node logging and the submission of the worker action (which runs in the background and is
+awaited outside the measurement).
+
+Usage (from the repo root):
+    python -m tools.state_benchmark [--incidents 200] [--warmup 20]
+"""
+import argparse
+import statistics
+import tempfile
+import time
+from datetime import datetime
+
+from loguru import logger
+
+from assets.custom_obj import Incident, SimilarAnalysis
+from assets.graph import IncidentsGraph
+from assets.helper.costants import DIAGNOSTIC_WORKER_NAME, ROOT_CAUSE_CONSULTANT_NAME
+from assets.outbound import get_outbound_buffer
+from assets.vocabulary import get_vocabulary
+from assets.worker_executor import get_worker_executor
+
+REUSED = SimilarAnalysis(incident_id="BENCH0", topics={"latency": 0.8, "diagnostics": 0.7},
+                         route=ROOT_CAUSE_CONSULTANT_NAME, tool=DIAGNOSTIC_WORKER_NAME, similarity=1.0)
+
+
+def make_incidents(n: int):
+    return [
+        Incident(id=f"BENCH{i}", created_at=datetime.now(), short_description="Checkout latency",
+                 description=f"p99 latency above SLO on checkout, sample {i}", service="checkout", impact=2)
+        for i in range(n)
+    ]
+
+
+def bench(fast_state: bool, incidents, warmup: int):
+    graph = IncidentsGraph(llm_call=False, direct_tool_dispatch=True, fast_state=fast_state, record_labels=False)
+    topics = set(REUSED.topics)
+    executor = get_worker_executor()
+    for incident in incidents[:warmup]:
+        graph.run(incident, reused=REUSED, topics=topics)
+        executor.collect(incident.id)
+    timings = []
+    for incident in incidents:
+        start = time.perf_counter()
+        graph.run(incident, reused=REUSED, topics=topics)
+        timings.append((time.perf_counter() - start) * 1000)
+        # il tool gira in background: atteso fuori dalla misura
+        executor.collect(incident.id)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-incident state overhead: standard vs fast-state")
+    parser.add_argument("--incidents", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=20)
+    args = parser.parse_args()
+
+    logger.remove()
+    # nothing is written to data/: topic usage stays in memory and notifications go to a temp sink
+    get_vocabulary().persist = False
+    get_outbound_buffer(sink_path=f"{tempfile.mkdtemp(prefix='state_benchmark_')}/outbound.jsonl")
+    incidents = make_incidents(args.incidents)
+    results = {}
+    for label, fast_state in (("standard", False), ("fast-state", True)):
+        timings = bench(fast_state, incidents, args.warmup)
+        results[label] = timings
+        print(f"{label:11} mean {statistics.mean(timings):7.2f} ms   "
+              f"p50 {statistics.median(timings):7.2f} ms   "
+              f"p99 {statistics.quantiles(timings, n=100)[98]:7.2f} ms")
+    standard, fast = statistics.mean(results["standard"]), statistics.mean(results["fast-state"])
+    print(f"saved per incident: {standard - fast:.2f} ms ({(1 - fast / standard) * 100:.1f}%)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Addestra e valuta il classificatore locale dei topic sugli output accumulati dei consultant LLM.
+
+Uso (dalla root del repo):
+    python -m tools.train_topic_classifier [--epochs 15] [--test-ratio 0.2] [--threshold 0.8]
+"""
+import argparse
+import json
+import time
+from pathlib import Path
+
+from assets.classifier import (
+    DEFAULT_DATASET_PATH,
+    DEFAULT_MODEL_PATH,
+    LocalTopicClassifier,
+    load_dataset,
+    split_dataset,
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the local topic classifier on LLM consultant labels")
+    parser.add_argument("--data", type=Path, default=DEFAULT_DATASET_PATH)
+    parser.add_argument("--model", type=Path, default=DEFAULT_MODEL_PATH)
+    parser.add_argument("--epochs", type=int, default=15)
+    parser.add_argument("--test-ratio", type=float, default=0.2)
+    parser.add_argument("--threshold", type=float, default=0.8,
+                        help="confidence threshold (IDF-weighted share of the input features seen in training) "
+                             "used to report the coverage of the local path")
+    args = parser.parse_args()
+
+    rows = load_dataset(args.data)
+    train, test = split_dataset(rows, args.test_ratio)
+    print(f"Loaded {len(rows)} labelled consultant outputs: {len(train)} train, {len(test)} held-out")
+    if not train:
+        print("Not enough data to train.")
+        return
+
+    start = time.perf_counter()
+    model = LocalTopicClassifier().fit(train, epochs=args.epochs)
+    print(f"Trained in {time.perf_counter() - start:.2f}s on {len(model.topics)} topics")
+
+    if test:
+        metrics = model.evaluate(test)
+        confident = [row for row in test if model.predict(row[0], row[1])[1] >= args.threshold]
+        metrics["local_coverage"] = len(confident) / len(test)
+        metrics["confident_f1"] = model.evaluate(confident)["f1"] if confident else 0.0
+        start = time.perf_counter()
+        for incident, node, _ in test:
+            model.predict(incident, node)
+        metrics["predictions_per_sec"] = len(test) / (time.perf_counter() - start)
+        print(json.dumps(metrics, indent=2))
+
+    path = model.save(args.model)
+    print(f"Model saved to {path}")
+
+
+if __name__ == "__main__":
+    main()